@@ -0,0 +1,330 @@
+# %%
+# Бенчмарк всех этапов конвейера на синтетических данных.
+# Запуск из корня репозитория:
+#   python -m benchmarks.bench_pipeline --preset small
+#   python -m benchmarks.bench_pipeline --ids 20000 --rows 5000000 --stages load daily_resample
+#
+# Данные генерируются в рабочий каталог (benchmarks/.work/<ids>x<rows>) и
+# переиспользуются следующими запусками с теми же параметрами. Каждый этап
+# выполняется в отдельном процессе, поэтому пик RSS относится только к нему
+# (Polars выделяет память вне tracemalloc). Этапы зависят от результатов
+# предыдущих на диске (хранилище, индекс, дневные данные), поэтому
+# отдельный этап можно повторить только после полного прогона.
+# Результаты пишутся в benchmarks/results/*.json и сравниваются с
+# предыдущим прогоном с теми же параметрами.
+import argparse
+import glob
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+
+import polars as pl
+
+from benchmarks.synthetic import write_collected, write_gap_registry, write_new
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+WORK_DIR = REPO_DIR / "benchmarks" / ".work"
+RESULTS_DIR = REPO_DIR / "benchmarks" / "results"
+
+# id, строк collected.csv, строк в каждом файле data/new
+PRESETS = {
+    'small': (1_000, 1_000_000, 10_000),
+    'medium': (10_000, 10_000_000, 100_000),
+    'large': (100_000, 100_000_000, 1_000_000),
+}
+
+CHART_WIDTH = 1800
+BATCH_SIZE = 30
+GROUP_MODE = "magnitude"
+
+# %%
+# Этапы (выполняются в рабочем каталоге, пути относительные, как в скриптах)
+
+def _raw_lf():
+    """Сырые точки collected как в tz.py: date, item_id, y"""
+    from loaders import load_collected
+    return load_collected().select([
+        pl.col("date"),
+        pl.col("id").alias("item_id"),
+        pl.col("value").alias("y"),
+    ]).drop_nulls()
+
+def stage_load():
+    """Сборка Parquet-хранилища и индекса рядов из collected.csv"""
+    from columnar_store import COLLECTED_CSV
+    rows_in = pl.scan_csv(COLLECTED_CSV).select(pl.len()).collect().item()
+    rows_out = _raw_lf().select(pl.len()).collect().item()
+    return {'rows_in': rows_in, 'rows_out': rows_out}
+
+def stage_daily_resample():
+    """Дневные медианы всех рядов частями по item_id (как tz.py)"""
+    from columnar_store import STORE_DIR
+    from resample import sink_daily_chunks
+    rows_in = _raw_lf().select(pl.len()).collect().item()
+    daily = sink_daily_chunks(_raw_lf(), f"{STORE_DIR}/daily", n_chunks=16)
+    return {'rows_in': rows_in, 'rows_out': daily.select(pl.len()).collect().item()}
+
+def stage_stationarity():
+    """Заполнение пропусков и z-оценка приращений всех рядов одним запросом"""
+    from columnar_store import STORE_DIR
+    from stationarity import build_stationary
+    daily = pl.scan_parquet(f"{STORE_DIR}/daily/*.parquet")
+    stationary = build_stationary(daily)
+    return {
+        'rows_in': daily.select(pl.len()).collect().item(),
+        'rows_out': stationary.select(pl.len()).collect().item(),
+    }
+
+def stage_change_points():
+    """Поиск сбросов, скачков и выбросов во всех дневных рядах одним запросом"""
+    from change_points import detect_events
+    from columnar_store import STORE_DIR
+    daily = pl.scan_parquet(f"{STORE_DIR}/daily/*.parquet")
+    events = detect_events(daily, by="item_id", value_col="y").collect()
+    return {'rows_in': daily.select(pl.len()).collect().item(), 'rows_out': events.height}
+
+def stage_forecast():
+    """Линейные тренды всех дневных рядов одним group_by и дни до порога"""
+    from columnar_store import STORE_DIR
+    from forecast import days_to_threshold, fit_trends
+    daily = pl.scan_parquet(f"{STORE_DIR}/daily/*.parquet")
+    trends = fit_trends(daily).collect()
+    report = days_to_threshold(trends, trends['last_value'].max()).collect()
+    return {
+        'rows_in': daily.select(pl.len()).collect().item(),
+        'rows_out': trends.height,
+        'growing': report['days_to_threshold'].is_not_null().sum(),
+    }
+
+def stage_pyramid():
+    """Пирамида агрегатов collected и выборка уровней для одной группы графика"""
+    from columnar_store import STORE_DIR, scan_dataset
+    from pyramid import build_pyramid, chart_levels, multires_frame
+    from series_index import scan_series_index, series_summary
+    raw = scan_dataset(f"{STORE_DIR}/collected")
+    build_pyramid('collected')
+    start, end = raw.select([pl.col('date').min(), pl.col('date').max().alias('end')]).collect().row(0)
+    ids = raw.select(pl.col('id').unique().sort().head(10)).collect()['id'].to_list()
+    summary = series_summary(scan_series_index("collected")).filter(pl.col('id').is_in(ids)).collect()
+    plot_data = multires_frame('collected', ids, chart_levels(end - start, CHART_WIDTH, summary=summary))
+    return {'rows_in': raw.select(pl.len()).collect().item(), 'rows_out': plot_data.height}
+
+def stage_sketches():
+    """Скетчи квантилей collected: построение, дневные медианы и слияние в месяцы"""
+    from sketches import build_sketches, daily_from_sketches, scan_sketches, sketch_quantiles
+    build_sketches('collected')
+    daily = daily_from_sketches(scan_sketches('collected')).collect()
+    monthly = sketch_quantiles(scan_sketches('collected', every='1mo'), (0.5, 0.95)).collect()
+    return {'rows_in': _raw_lf().select(pl.len()).collect().item(), 'rows_out': daily.height, 'monthly': monthly.height}
+
+def stage_gap_exclusion():
+    """Исключение общих и пообъектных сбоев реестра из сырых точек"""
+    from gaps import exclude_gaps, load_gap_registry
+    gaps = load_gap_registry()
+    rows_in = _raw_lf().select(pl.len()).collect().item()
+    rows_out = exclude_gaps(_raw_lf(), gaps).select(pl.len()).collect().item()
+    return {'rows_in': rows_in, 'rows_out': rows_out, 'gaps': gaps.height}
+
+def stage_series_selection():
+    """Отбор рядов по индексу: tz.py (точки вне сбоев) и visualization_collected.py (дни)"""
+    from gaps import exclude_gaps, load_gap_registry
+    from grouping import rank_series
+    from series_index import scan_series_index, series_days, series_summary
+    stats = rank_series(exclude_gaps(series_days("collected"), load_gap_registry()), min_points=9).collect()
+    days_per_id = series_summary(scan_series_index("collected")).filter(pl.col("unique_days") > 20).collect()
+    stats.write_parquet("selected_ids.parquet")
+    return {
+        'rows_in': scan_series_index("collected").select(pl.len()).collect().item(),
+        'rows_out': stats.height,
+        'collected_selected': days_per_id.height,
+    }
+
+def stage_group_assignment():
+    """Номера групп и диапазоны оси y групп для дневных данных отобранных рядов (как tz.py)"""
+    from columnar_store import STORE_DIR
+    from grouping import assign_groups, chart_frame, group_domains, with_scale
+    stats = pl.read_parquet("selected_ids.parquet")
+    df = (
+        pl.scan_parquet(f"{STORE_DIR}/daily/*.parquet")
+        .filter(pl.col("item_id").is_in(stats["item_id"].implode()))
+        .collect()
+    )
+    groups = assign_groups(with_scale(stats, df.lazy()), size=BATCH_SIZE, mode=GROUP_MODE).collect()
+    chart_data = chart_frame(df, groups).collect()
+    domains = group_domains(chart_data.lazy()).collect()
+    chart_data.write_parquet("chart_data.parquet")
+    return {'rows_in': df.height, 'rows_out': chart_data.height, 'groups': domains.height}
+
+def stage_normalization():
+    """Нормализация файлов data/new (один pl.collect_all на потоках Polars, хранилище и индекс)"""
+    from normalization import run_normalization
+    input_files = glob.glob("data/new/*.csv")
+    rows_in = sum(
+        pl.scan_csv(f, has_header=not f.endswith("wd_time_range.csv")).select(pl.len()).collect().item()
+        for f in input_files
+    )
+    report = run_normalization(input_files, "data/normalized", manifest_path="normalized.manifest.json")
+    rows_out = sum(
+        pl.scan_csv(f).select(pl.len()).collect().item() for f in glob.glob("data/normalized/*.csv")
+    )
+    return {'rows_in': rows_in, 'rows_out': rows_out, 'failed': len(report['failed'])}
+
+def stage_chart_spec():
+    """Прореживание под ширину графика и сериализация спецификации Vega-Lite (обычной и компактной)"""
+    import altair as alt
+    from chart_payload import compact_chart
+    from downsample import downsample
+    alt.data_transformers.disable_max_rows()
+
+    chart_data = pl.read_parquet("chart_data.parquet")
+    plot_data = downsample(chart_data, CHART_WIDTH, mode="minmax", by="item_id")
+    group_param = alt.param(value=1, bind=alt.binding_range(min=1, max=chart_data['group_num'].max(), step=1))
+    chart = alt.Chart(plot_data).mark_line(point=True).encode(
+        x='date:T', y='value:Q', color='item_id:N', tooltip=['item_id:N', 'date:T', 'value:Q'],
+    ).add_params(group_param).transform_filter(alt.datum.group_num == group_param)
+    spec = chart.to_json()
+    compact_spec = compact_chart(chart, plot_data, by="item_id", series_cols=["group_num"]).to_json()
+    return {
+        'rows_in': chart_data.height,
+        'rows_out': plot_data.height,
+        'spec_bytes': len(spec),
+        'compact_spec_bytes': len(compact_spec),
+    }
+
+STAGES = {
+    'load': stage_load,
+    'daily_resample': stage_daily_resample,
+    'stationarity': stage_stationarity,
+    'change_points': stage_change_points,
+    'forecast': stage_forecast,
+    'pyramid': stage_pyramid,
+    'sketches': stage_sketches,
+    'gap_exclusion': stage_gap_exclusion,
+    'series_selection': stage_series_selection,
+    'group_assignment': stage_group_assignment,
+    'normalization': stage_normalization,
+    'chart_spec': stage_chart_spec,
+}
+
+# %%
+# Замер
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: КБ
+
+def measure_stage(name, work_dir):
+    """Выполняет этап name в work_dir; вызывается в отдельном процессе"""
+    sys.path.insert(0, str(REPO_DIR))
+    os.chdir(work_dir)
+    import altair  # noqa: F401 - импорт не должен попадать в замер этапа
+
+    baseline_mb = _max_rss_mb()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = STAGES[name]()
+    return {
+        'stage': name,
+        'wall_s': round(time.perf_counter() - wall, 4),
+        'cpu_s': round(time.process_time() - cpu, 4),
+        'peak_rss_mb': round(_max_rss_mb(), 1),
+        'rss_growth_mb': round(_max_rss_mb() - baseline_mb, 1),
+        **result,
+    }
+
+def prepare_inputs(work_dir, n_ids, n_rows, new_rows):
+    """Генерирует входные данные, если их еще нет в work_dir"""
+    marker = work_dir / "inputs.json"
+    params = {'ids': n_ids, 'rows': n_rows, 'new_rows': new_rows}
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        return None
+
+    started = time.perf_counter()
+    written = write_collected(work_dir / "data/raw/collected.csv", n_ids, n_rows)
+    write_new(work_dir / "data/new", new_rows)
+    write_gap_registry(work_dir / "gap_registry.csv", REPO_DIR / "gap_registry.csv", n_ids)
+    marker.write_text(json.dumps(params))
+    elapsed = time.perf_counter() - started
+    print(f"Сгенерировано {written} строк collected.csv за {elapsed:.1f} с")
+    return elapsed
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def previous_result(params):
+    """Последний сохраненный результат с теми же параметрами"""
+    for path in sorted(RESULTS_DIR.glob("*.json"), reverse=True):
+        result = json.loads(path.read_text())
+        if result['params'] == params:
+            return path, result
+    return None, None
+
+def print_table(stages, previous=None):
+    before = {s['stage']: s for s in previous['stages']} if previous else {}
+    print(f"\n{'этап':<20}{'стена, с':>10}{'CPU, с':>10}{'пик RSS, МБ':>14}{'строк на входе':>16}{'на выходе':>12}{'было, с':>10}")
+    for s in stages:
+        old = before.get(s['stage'])
+        old_wall = f"{old['wall_s']:.3f}" if old else "-"
+        print(f"{s['stage']:<20}{s['wall_s']:>10.3f}{s['cpu_s']:>10.3f}{s['peak_rss_mb']:>14.1f}"
+              f"{s['rows_in']:>16}{s['rows_out']:>12}{old_wall:>10}")
+
+def run_benchmark(n_ids, n_rows, new_rows, stages=tuple(STAGES)):
+    params = {'ids': n_ids, 'rows': n_rows, 'new_rows': new_rows}
+    work_dir = WORK_DIR / f"{n_ids}x{n_rows}"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    generate_s = prepare_inputs(work_dir, n_ids, n_rows, new_rows)
+
+    results = []
+    for name in stages:
+        print(f"Этап {name}...")
+        # Свежий процесс на каждый этап: пик RSS не наследуется от предыдущих
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as pool:
+            results.append(pool.submit(measure_stage, name, work_dir).result())
+
+    previous_path, previous = previous_result(params)
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'polars': pl.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': params,
+        'generate_s': generate_s,
+        'stages': results,
+    }
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    out_path = RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}_{report['commit'] or 'nogit'}_{n_ids}x{n_rows}.json"
+    out_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+
+    print_table(results, previous)
+    if previous_path:
+        print(f"\nСравнение с {previous_path.name} (коммит {previous['commit']})")
+    print(f"Результаты: {out_path}")
+    return report
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов конвейера на синтетических данных")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--ids", type=int, help="число рядов (item_id), по умолчанию из --preset")
+    parser.add_argument("--rows", type=int, help="строк collected.csv, по умолчанию из --preset")
+    parser.add_argument("--new-rows", type=int, help="строк в каждом файле data/new, по умолчанию из --preset")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    args = parser.parse_args()
+
+    n_ids, n_rows, new_rows = PRESETS[args.preset]
+    run_benchmark(args.ids or n_ids, args.rows or n_rows, args.new_rows or new_rows, stages=args.stages)
@@ -0,0 +1,60 @@
+# %%
+# Бенчмарк: разбор значений через map_elements (построчно) против выражений Polars
+# Запуск из корня репозитория: python -m benchmarks.bench_value_parsing
+import time
+
+import polars as pl
+
+from value_parsing import (
+    extract_numeric_value,
+    extract_numeric_value_expr,
+    parse_decimal_comma,
+    parse_decimal_comma_expr,
+)
+
+N_ROWS = 1_000_000
+REPEATS = 3
+
+# %%
+# Синтетические колонки в форматах из data/new
+sample_units = ["54.5 GB", "220 MB", "2,21 TB", "91,5 GB", "", "1,5"]
+sample_commas = ["2263,04", "91,5", "170", "56,58260803"]
+
+df = pl.DataFrame({
+    "with_units": [sample_units[i % len(sample_units)] for i in range(N_ROWS)],
+    "with_commas": [sample_commas[i % len(sample_commas)] for i in range(N_ROWS)],
+})
+
+def best_time(func):
+    """Минимальное время из REPEATS запусков"""
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+cases = {
+    "extract_numeric_value": (
+        lambda: df.select(pl.col("with_units").map_elements(extract_numeric_value, return_dtype=pl.Float64)),
+        lambda: df.select(extract_numeric_value_expr("with_units")),
+    ),
+    "parse_decimal_comma": (
+        lambda: df.select(pl.col("with_commas").map_elements(parse_decimal_comma, return_dtype=pl.Float64)),
+        lambda: df.select(parse_decimal_comma_expr("with_commas")),
+    ),
+}
+
+# %%
+print(f"Строк: {N_ROWS}, лучший из {REPEATS} запусков\n")
+print(f"{'функция':<24}{'map_elements, с':>16}{'выражение, с':>16}{'ускорение':>12}")
+
+for name, (callback_case, expr_case) in cases.items():
+    callback_time, callback_result = best_time(callback_case)
+    expr_time, expr_result = best_time(expr_case)
+
+    # Пустые строки построчная версия пропускает как null, векторная - тоже
+    diff = (callback_result.to_series() - expr_result.to_series()).abs().max()
+    assert diff is None or diff < 1e-9, f"{name}: результаты расходятся на {diff}"
+
+    print(f"{name:<24}{callback_time:>16.3f}{expr_time:>16.3f}{callback_time / expr_time:>11.1f}x")
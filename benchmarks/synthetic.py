@@ -0,0 +1,171 @@
+# %%
+# Генератор синтетических входных данных для бенчмарков.
+#
+# Пишет файлы той же формы, что и настоящие:
+#   data/raw/collected.csv - ,collected,item_id,property_value
+#   data/new/*.csv          - err*, errrors1, PG02, wd, wd_time_range
+#   gap_registry.csv        - общие сбои из реестра репозитория + сбои
+#                             отдельных рядов
+# Ряды растут с шумом, содержат плато (значение не меняется) и пропуски;
+# у части рядов сбор начинается позже. Случайность - хэш номера строки,
+# поэтому результат детерминирован и не требует numpy. collected.csv
+# пишется порциями, память генератора не зависит от числа строк.
+from pathlib import Path
+
+import polars as pl
+
+START = pl.datetime(2024, 6, 1, time_zone=None)
+SPAN_SECONDS = 365 * 86400
+FIRST_ITEM_ID = 170_000_000
+CHUNK_ROWS = 2_000_000
+PLATEAU_LEN = 64
+
+def _uniform(expr, seed):
+    """Псевдослучайное число в [0, 1) из хэша выражения"""
+    return (expr.hash(seed) % 1_000_003).cast(pl.Float64) / 1_000_003
+
+def _write_header(f, columns):
+    """Заголовок без кавычек у пустого имени колонки, как в исходных выгрузках"""
+    f.write((','.join(columns) + '\n').encode())
+
+# %%
+# collected.csv
+
+def collected_chunk(lo, hi, n_ids, n_rows):
+    """Строки collected.csv с номерами [lo, hi)"""
+    per_id = -(-n_rows // n_ids)
+    i = pl.int_range(lo, hi, dtype=pl.Int64)
+    id_idx = i // per_id
+    k = i % per_id
+
+    # Ряд начинается в случайный момент первых 30% периода
+    start_s = _uniform(id_idx, 1) * 0.3 * SPAN_SECONDS
+    step_s = (SPAN_SECONDS - start_s) / per_id
+    ts_s = start_s + (k.cast(pl.Float64) + _uniform(i, 2) * 0.5) * step_s
+
+    # Плато: на части отрезков по PLATEAU_LEN точек значение не меняется
+    segment = id_idx * per_id + k // PLATEAU_LEN
+    plateau = _uniform(segment, 3) < 0.125
+    k_eff = pl.when(plateau).then(k // PLATEAU_LEN * PLATEAU_LEN).otherwise(k).cast(pl.Float64)
+    noise = pl.when(plateau).then(0.0).otherwise((_uniform(i, 4) - 0.5) * 0.004)
+
+    base = 1e9 + _uniform(id_idx, 5) * 5e10
+    growth = _uniform(id_idx, 6) * 0.5
+    value = base * (1 + growth * k_eff / per_id) * (1 + noise)
+
+    # Пропуск сбора в середине периода у 20% рядов
+    position = k.cast(pl.Float64) / per_id
+    in_gap = (_uniform(id_idx, 7) < 0.2) & position.is_between(0.45, 0.55, closed='left')
+
+    return (
+        pl.select([
+            i.alias(''),
+            (START + pl.duration(seconds=ts_s.cast(pl.Int64))).dt.strftime('%Y-%m-%d %H:%M:%S').alias('collected'),
+            (id_idx + FIRST_ITEM_ID).alias('item_id'),
+            value.cast(pl.Int64).alias('property_value'),
+            in_gap.alias('_gap'),
+        ])
+        .filter(~pl.col('_gap'))
+        .drop('_gap')
+    )
+
+def write_collected(path, n_ids, n_rows):
+    """Пишет collected.csv: n_rows строк за вычетом попавших в пропуски сбора"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    written = 0
+    with open(path, 'wb') as f:
+        for lo in range(0, n_rows, CHUNK_ROWS):
+            chunk = collected_chunk(lo, min(lo + CHUNK_ROWS, n_rows), n_ids, n_rows)
+            if lo == 0:
+                _write_header(f, chunk.columns)
+            chunk.write_csv(f, include_header=False)
+            written += chunk.height
+    return written
+
+# %%
+# data/new
+
+def _new_frame(n_rows, seed, date_format='%Y-%m-%d %H:%M:%S', step_s=43200):
+    """Каркас файла из data/new: дата с шагом step_s и растущее значение"""
+    i = pl.int_range(0, n_rows, dtype=pl.Int64)
+    ts = START + pl.duration(seconds=(i * step_s + (_uniform(i, seed) * 60).cast(pl.Int64)))
+    plateau = _uniform(i // PLATEAU_LEN, seed + 1) < 0.125
+    i_eff = pl.when(plateau).then(i // PLATEAU_LEN * PLATEAU_LEN).otherwise(i).cast(pl.Float64)
+    value = (50 + _uniform(pl.lit(seed), seed) * 500) * (1 + i_eff / n_rows)
+    return pl.select([
+        ts.dt.strftime(date_format).alias('date'),
+        value.alias('value'),
+        _uniform(i, seed + 2).alias('_u'),
+    ])
+
+def _decimal_comma(expr, decimals=2):
+    return expr.round(decimals).cast(pl.String).str.replace('.', ',', literal=True)
+
+def _with_unit(expr_gb):
+    """Значение в GB как строка с суффиксом MB, GB или TB"""
+    return (
+        pl.when(expr_gb < 1).then(pl.format('{} MB', (expr_gb * 1000).round(0).cast(pl.Int64)))
+        .when(expr_gb < 1000).then(pl.format('{} GB', expr_gb.round(1)))
+        .otherwise(pl.format('{} TB', (expr_gb / 1000).round(2)))
+    )
+
+def write_new(new_dir, n_rows, n_err_files=5):
+    """Пишет файлы data/new по n_rows строк, возвращает число строк"""
+    new_dir = Path(new_dir)
+    new_dir.mkdir(parents=True, exist_ok=True)
+    for stale in new_dir.glob('*.csv'):
+        stale.unlink()
+
+    for k in range(1, n_err_files + 1):
+        _new_frame(n_rows, 10 * k).select([
+            pl.col('date').alias('created_at'),
+            _decimal_comma(pl.col('value')).alias('count'),
+        ]).write_csv(new_dir / f'err{k}.csv')
+
+    errrors1 = _new_frame(n_rows, 100).select([
+        pl.col('date').alias('created_at'),
+        _decimal_comma(pl.col('value')).alias('count'),
+        _decimal_comma(pl.col('value') / 1000).alias('05_db'),
+        pl.when(pl.col('_u') < 0.5).then(pl.lit('GB')).otherwise(pl.lit('TB')).alias(''),
+    ])
+    with open(new_dir / 'errrors1.csv', 'wb') as f:
+        _write_header(f, errrors1.columns)
+        errrors1.write_csv(f, include_header=False)
+
+    _new_frame(n_rows, 200).select([
+        pl.col('date').alias('Time'),
+        _with_unit(pl.col('value') * 10 * pl.col('_u')).alias('odm_std_08'),
+        _with_unit(pl.col('value') / 100).alias('postgres'),
+    ]).write_csv(new_dir / 'PG02.csv')
+
+    _new_frame(n_rows, 300, date_format='%Y-%m-%d', step_s=86400).select([
+        pl.col('date').alias('created_at'),
+        _decimal_comma(pl.col('value'), 8).alias('count'),
+    ]).write_csv(new_dir / 'wd.csv')
+
+    _new_frame(n_rows, 400, date_format='%Y-%m-%d', step_s=86400).select([
+        pl.col('date'),
+        (pl.col('value') * 1e9).cast(pl.Int64).alias('bytes'),
+        pl.lit('b').alias('kind'),
+    ]).write_csv(new_dir / 'wd_time_range.csv', include_header=False)
+
+    return n_rows * (n_err_files + 4)
+
+# %%
+# Реестр сбоев
+
+def write_gap_registry(path, source_registry, n_ids, scoped_share=0.01):
+    """Общие сбои из source_registry и трехдневные сбои scoped_share рядов"""
+    global_gaps = pl.read_csv(source_registry, schema_overrides={'item_id': pl.String})
+    n_scoped = max(1, int(n_ids * scoped_share))
+    idx = pl.int_range(0, n_scoped, dtype=pl.Int64) * (n_ids // n_scoped)
+    start = START + pl.duration(days=(_uniform(idx, 8) * 360).cast(pl.Int64))
+    scoped = pl.select([
+        start.dt.strftime('%Y-%m-%d').alias('start'),
+        start.dt.offset_by('3d').dt.strftime('%Y-%m-%d').alias('end'),
+        (idx + FIRST_ITEM_ID).cast(pl.String).alias('item_id'),
+        pl.lit('синтетический сбой ряда').alias('comment'),
+    ])
+    pl.concat([global_gaps, scoped]).write_csv(path)
+    return global_gaps.height + scoped.height
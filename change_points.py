@@ -0,0 +1,156 @@
+# %%
+# Поиск резких изменений в рядах: сбросы и скачки уровня (err1 2263 -> 91.5,
+# PG02 54.5 -> 535 ГБ) и одиночные выбросы.
+#
+# Все ряды обрабатываются одним запросом: скользящие статистики считаются
+# через over(by), циклов по рядам нет. Для каждой точки:
+#   before - медиана window точек до нее;
+#   after  - медиана window точек начиная с нее;
+#   noise  - обычное изменение за шаг: медиана |diff| в окне до точки и в
+#            окне после нее, берется меньшая (сам скачок в шум не входит).
+# Ступень - разность after - before, выброс - отклонение точки от обоих
+# уровней. Оценка - отношение к шуму; у рядов-ступенек (плато без шума)
+# шум снизу ограничен долей уровня NOISE_FLOOR. Подряд идущие точки над
+# порогом сворачиваются в одно событие: для ступени - точка с наибольшим
+# скачком от предыдущей, для выброса - с максимальной оценкой.
+#
+# Результат - таблица событий (by..., date, kind, value, before, after,
+# change, relative_change, score), которую графики накладывают слоем
+# event_layer.
+import altair as alt
+import polars as pl
+
+WINDOW = 7              # точек в окнах до и после
+THRESHOLD = 8.0         # порог оценки (в единицах шума)
+MIN_RELATIVE_CHANGE = 0.1  # изменение меньше 10% уровня событием не считается
+NOISE_FLOOR = 0.005     # нижняя граница шума как доля уровня
+
+KINDS = ("jump", "drop", "spike")
+
+# %%
+# Оценки
+
+def score_frame(lf, window=WINDOW, by="id", date_col="date", value_col="value"):
+    """LazyFrame с колонками before, after, noise, jump, step_score, spike_score.
+
+    Строки без значения отбрасываются, результат отсортирован по (by, date_col).
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    v = pl.col(value_col)
+    # У первой точки ряда скачка нет - берется следующий (окна без null
+    # считаются заметно быстрее)
+    jump = v.diff().abs().fill_null(strategy="backward")
+    jump_col = pl.col("jump")
+    level = pl.max_horizontal(pl.col("before").abs(), pl.col("after").abs())
+    scale = pl.max_horizontal(pl.col("noise") * 1.4826, level * NOISE_FLOOR, pl.lit(1e-12))
+
+    return (
+        lf.drop_nulls(value_col)
+        .sort(keys + [date_col])
+        .with_columns(jump.over(keys).alias("jump"))
+        .with_columns([
+            v.rolling_median(window, min_samples=1).shift(1).over(keys).alias("before"),
+            v.reverse().rolling_median(window, min_samples=1).reverse().over(keys).alias("after"),
+            jump_col.rolling_median(window, min_samples=1).shift(1).over(keys).alias("noise"),
+            jump_col.shift(-1).reverse().rolling_median(window, min_samples=1).reverse().over(keys)
+            .alias("_noise_after"),
+        ])
+        .with_columns(pl.min_horizontal("noise", "_noise_after").alias("noise"))
+        .drop("_noise_after")
+        .with_columns([
+            ((pl.col("after") - pl.col("before")).abs() / scale).alias("step_score"),
+            (pl.min_horizontal((v - pl.col("before")).abs(), (v - pl.col("after")).abs()) / scale)
+            .alias("spike_score"),
+        ])
+    )
+
+# %%
+# События
+
+def detect_events(lf, window=WINDOW, threshold=THRESHOLD, min_relative_change=MIN_RELATIVE_CHANGE,
+                  by="id", date_col="date", value_col="value"):
+    """LazyFrame событий по всем рядам lf.
+
+    kind: jump/drop - смена уровня вверх/вниз (date - первая точка нового
+    уровня), spike - одиночный выброс, после которого ряд возвращается.
+    by может быть списком колонок, постоянных внутри ряда (например,
+    item_id и group_num) - они переносятся в таблицу событий.
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    change = pl.col("after") - pl.col("before")
+    spike_change = pl.col(value_col) - pl.col("before")
+    level = pl.max_horizontal(pl.col("before").abs(), pl.col("after").abs())
+
+    is_step = (pl.col("step_score") >= threshold) & (change.abs() >= min_relative_change * level)
+    is_spike = (
+        (pl.col("spike_score") >= threshold)
+        & (spike_change.abs() >= min_relative_change * pl.col("before").abs())
+        & ~is_step
+    )
+
+    flagged = (
+        score_frame(lf, window, keys, date_col, value_col)
+        .with_columns([
+            pl.when(is_step & (change > 0)).then(pl.lit("jump"))
+            .when(is_step).then(pl.lit("drop"))
+            .when(is_spike).then(pl.lit("spike"))
+            .alias("kind"),
+            pl.when(is_step).then("step_score").otherwise("spike_score").alias("score"),
+            pl.when(is_step).then(change).otherwise(spike_change).alias("change"),
+            pl.when(is_step).then("jump").otherwise("spike_score").alias("_rank"),
+        ])
+        # Номер серии подряд идущих точек одного вида: строки отсортированы
+        # по ряду, поэтому новая серия начинается и при смене ряда
+        .with_columns(
+            pl.any_horizontal(
+                pl.col("kind").ne_missing(pl.col("kind").shift(1)),
+                *[pl.col(key).ne_missing(pl.col(key).shift(1)) for key in keys],
+            ).cum_sum().alias("_run")
+        )
+        .filter(pl.col("kind").is_not_null())
+    )
+
+    return (
+        flagged.group_by(keys + ["_run"])
+        .agg(pl.all().sort_by("_rank").last())
+        .select(keys + [
+            pl.col(date_col),
+            pl.col("kind"),
+            pl.col(value_col).alias("value"),
+            pl.col("before"),
+            pl.col("after"),
+            pl.col("change"),
+            (pl.col("change") / pl.col("before").abs()).alias("relative_change"),
+            pl.col("score"),
+        ])
+        .sort(keys + [date_col])
+    )
+
+# %%
+# Слой графика
+
+def event_layer(events, date_col="date", color=None, tooltip_id="id:N"):
+    """Вертикальные линии событий для наложения на график рядов.
+
+    events - таблица detect_events; фильтры групп добавляются снаружи тем
+    же transform_filter, что и у рядов. color - кодирование цвета (обычно
+    то же, что у рядов, чтобы линия совпадала по цвету со своим рядом).
+    """
+    encoding = {
+        'x': alt.X(f'{date_col}:T'),
+        'strokeDash': alt.StrokeDash(
+            'kind:N', scale=alt.Scale(domain=list(KINDS), range=[[6, 3], [6, 3], [2, 2]]), legend=None
+        ),
+        'tooltip': [
+            alt.Tooltip(f'{date_col}:T', format='%d.%m.%Y %H:%M', title='Дата'),
+            alt.Tooltip(tooltip_id, title='ID'),
+            alt.Tooltip('kind:N', title='Событие'),
+            alt.Tooltip('before:Q', format=',.2f', title='До'),
+            alt.Tooltip('after:Q', format=',.2f', title='После'),
+            alt.Tooltip('relative_change:Q', format='+.1%', title='Изменение'),
+            alt.Tooltip('score:Q', format='.1f', title='Оценка'),
+        ],
+    }
+    if color is not None:
+        encoding['color'] = color
+    return alt.Chart(events).mark_rule(strokeWidth=1.5, opacity=0.7).encode(**encoding)
@@ -0,0 +1,182 @@
+# %%
+# Компактные данные графиков.
+#
+# По умолчанию Altair вписывает данные в спецификацию построчно: в каждой
+# строке повторяются ISO-строки дат, строковые id, имена слоев, unique_days.
+# Здесь данные кодируются иначе:
+#   - даты - целые миллисекунды от эпохи в колонках <дата>_ms, исходная
+#     колонка восстанавливается calculate (Vega-Lite понимает число как
+#     время; под своим именем числовая колонка сбила бы разбор дат в слоях
+#     со своими данными);
+#   - ряд (колонки by) - целый код SERIES_CODE, сами значения by и
+#     постоянные внутри ряда колонки (series_cols: группа, unique_days)
+#     хранятся один раз в таблице рядов и возвращаются transform_lookup;
+#   - строки пишутся CSV-текстом внутри спецификации (заголовок один раз)
+#     или Arrow-файлом рядом с HTML (export_compact_html(fmt="arrow")).
+# Слои с собственными данными (события, прогноз) не меняются.
+import json
+from pathlib import Path
+
+import altair as alt
+import polars as pl
+
+SERIES_CODE = "sid"
+PAYLOAD_FORMATS = ("csv", "arrow")
+DATASET_NAME = "chart_data"
+
+ARROW_JS = "https://cdn.jsdelivr.net/npm/apache-arrow@17/Arrow.es2015.min.js"
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>{title}</title>
+  <script src="https://cdn.jsdelivr.net/npm/vega@{vega_version}"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-lite@{vegalite_version}"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-embed@{vegaembed_version}"></script>
+  <script src="{arrow_js}"></script>
+</head>
+<body>
+  <div id="chart"></div>
+  <script>
+    const spec = {spec};
+    Promise.all([
+      vegaEmbed("#chart", spec),
+      fetch("{data_url}").then(response => response.arrayBuffer()),
+    ]).then(([{{view}}, buffer]) => {{
+      const rows = Arrow.tableFromIPC(buffer).toArray().map(row => row.toJSON());
+      view.change("{dataset}", vega.changeset().insert(rows)).run();
+    }});
+  </script>
+</body>
+</html>
+"""
+
+# %%
+# Кодирование
+
+def compact_frames(df, by="id", series_cols=(), date_cols=("date",)):
+    """Строки и таблица рядов для компактной передачи df.
+
+    rows - df без колонок by и series_cols, с кодом ряда SERIES_CODE и
+    датами date_cols в миллисекундах (колонки <дата>_ms); series - SERIES_CODE, by...,
+    series_cols... (строка на ряд).
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    constants = keys + list(series_cols)
+    codes = df.select(pl.struct(keys).rank("dense").cast(pl.UInt32).alias(SERIES_CODE)).to_series()
+    df = df.with_columns(codes)
+
+    series = df.select([SERIES_CODE, *constants]).unique(SERIES_CODE).sort(SERIES_CODE)
+    rows = df.drop(constants).with_columns([
+        pl.col(col).dt.epoch("ms").alias(f"{col}_ms") for col in date_cols if col in df.columns
+    ]).drop([col for col in date_cols if col in df.columns])
+    return rows, series
+
+def _parse(rows):
+    """format.parse для CSV: числовые колонки - числа, остальные - строки"""
+    return {
+        col: "boolean" if dtype == pl.Boolean else "number"
+        for col, dtype in rows.schema.items()
+        if dtype.is_numeric() or dtype == pl.Boolean
+    }
+
+_COMPOSITIONS = ('layer', 'hconcat', 'vconcat', 'concat')
+
+def _with_lookup(chart, df, lookup):
+    """Копия chart, где lookup (список преобразований) добавлен в начало
+    преобразований всех графиков, берущих данные с верхнего уровня (а данные
+    df у вложенных графиков убраны).
+
+    Преобразования верхнего уровня выполнялись бы и для слоев со своими
+    данными (события, прогноз), поэтому lookup добавляется в сами слои.
+    """
+    chart = chart.copy(deep=False)
+    for attr in _COMPOSITIONS:
+        subcharts = getattr(chart, attr, alt.Undefined)
+        if subcharts is alt.Undefined:
+            continue
+        children = []
+        for child in subcharts:
+            if child.data is df or child.data is alt.Undefined:
+                child = _with_lookup(child, df, lookup)
+                child.data = alt.Undefined
+            children.append(child)
+        setattr(chart, attr, children)
+        return chart
+
+    transforms = [] if chart.transform is alt.Undefined else list(chart.transform)
+    chart.transform = lookup + transforms
+    return chart
+
+def _with_payload(chart, df, data, series, by, series_cols, date_cols):
+    """chart с данными data верхнего уровня, lookup по таблице рядов и датами"""
+    keys = [by] if isinstance(by, str) else list(by)
+    lookup = [alt.LookupTransform(
+        lookup=SERIES_CODE,
+        **{'from': alt.LookupData(
+            data=alt.InlineData(values=series.to_dicts()),
+            key=SERIES_CODE,
+            fields=keys + list(series_cols),
+        )},
+    )] + [
+        alt.CalculateTransform(calculate=f"datum['{col}_ms']", **{'as': col})
+        for col in date_cols if col in df.columns
+    ]
+    chart = _with_lookup(chart, df, lookup)
+    chart.data = data
+    return chart
+
+def compact_chart(chart, df, by="id", series_cols=(), date_cols=("date",)):
+    """Копия chart, в которой данные df (верхнего уровня или вложенных
+    графиков с теми же данными) переданы CSV-текстом с кодами рядов.
+
+    Для notebook: график отображается так же, но спецификация в несколько
+    раз меньше. Экспорт по группам (group_shards, export_charts) работает с
+    исходным графиком.
+    """
+    rows, series = compact_frames(df, by, series_cols, date_cols)
+    data = alt.InlineData(values=rows.write_csv(), format=alt.DataFormat(type="csv", parse=_parse(rows)))
+    return _with_payload(chart, df, data, series, by, series_cols, date_cols)
+
+# %%
+# Экспорт
+
+def export_compact_html(chart, df, out_path, by="id", series_cols=(), date_cols=("date",),
+                        fmt="csv", title="График"):
+    """Сохраняет chart в HTML с компактными данными.
+
+    fmt="csv" - один HTML-файл со встроенным CSV; fmt="arrow" - HTML и
+    <имя>.arrow рядом с ним, страница загружает файл сама (открывать через
+    HTTP, как group_shards).
+    """
+    if fmt not in PAYLOAD_FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt!r}, ожидается один из {PAYLOAD_FORMATS}")
+    out_path = Path(out_path)
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if fmt == "csv":
+        compact_chart(chart, df, by, series_cols, date_cols).save(str(out_path))
+        return out_path
+
+    rows, series = compact_frames(df, by, series_cols, date_cols)
+    # Int64 в Arrow JS превращается в BigInt, с которым Vega не работает
+    rows = rows.with_columns([
+        pl.col(col).cast(pl.Float64) for col, dtype in rows.schema.items() if dtype in (pl.Int64, pl.UInt64)
+    ])
+    data_path = out_path.with_suffix(".arrow")
+    rows.write_ipc(data_path, compression="uncompressed")
+
+    spec = _with_payload(chart, df, alt.NamedData(name=DATASET_NAME), series, by, series_cols, date_cols).to_dict()
+    html = HTML_TEMPLATE.format(
+        title=title,
+        vega_version=alt.VEGA_VERSION,
+        vegalite_version=alt.VEGALITE_VERSION,
+        vegaembed_version=alt.VEGAEMBED_VERSION,
+        arrow_js=ARROW_JS,
+        spec=json.dumps(spec, ensure_ascii=False),
+        data_url=data_path.name,
+        dataset=DATASET_NAME,
+    )
+    out_path.write_text(html, encoding="utf-8")
+    return out_path
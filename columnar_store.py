@@ -0,0 +1,254 @@
+# %%
+# Колоночное хранилище рядов: Parquet, партиционированный по id ряда и месяцу
+# (data/store/<датасет>/id=<id>/month=<YYYY-MM>/*.parquet).
+#
+# Схема фиксирована: id UInt64, date Datetime(UTC), value Float64. Скрипты
+# читают хранилище через scan_parquet, поэтому фильтры по id и дате
+# отсекают ненужные партиции и текст CSV больше не разбирается повторно.
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import polars as pl
+
+from series_index import index_path, rebuild_series_index
+
+STORE_DIR = "data/store"
+COLLECTED_CSV = "data/raw/collected.csv"
+
+STORE_SCHEMA = {
+    'id': pl.UInt64,
+    'date': pl.Datetime('us', 'UTC'),
+    'value': pl.Float64,
+}
+HIVE_SCHEMA = {'id': pl.UInt64, 'month': pl.String}
+
+# Отметка об исходном файле, из которого собран датасет
+SOURCE_MARKER = "_source.json"
+
+# Форматы дат во входных CSV, пробуются по порядку
+TIMESTAMP_FORMATS = [
+    '%Y-%m-%d %H:%M:%S%.f%#z',  # 2024-07-04 09:06:15+00:00
+    '%Y-%m-%d %H:%M:%S%.f',     # 2023-05-23 15:20:25, 2024-09-16 2:19:49
+    '%Y-%m-%d %H:%M',           # 2024-08-05 12:00
+    '%Y-%m-%d',                 # 2024-04-13
+]
+TIMESTAMP_SAMPLE_ROWS = 1000  # по скольким первым строкам источника определяется формат дат
+
+# %%
+# Приведение к схеме хранилища
+
+def detect_timestamp_format(values, formats=TIMESTAMP_FORMATS):
+    """Первый из formats, в котором разбираются все значения values (Series),
+    разборные хоть в каком-то из formats (мусорные строки не мешают).
+
+    None - если разборных значений нет или в values смешаны форматы.
+    """
+    parsed = [
+        pl.col('value').str.to_datetime(fmt, strict=False, time_zone='UTC', time_unit='us').is_not_null()
+        for fmt in formats
+    ]
+    counts = values.cast(pl.String).to_frame('value').select([
+        *[mask.sum().alias(fmt) for fmt, mask in zip(formats, parsed)],
+        pl.any_horizontal(parsed).sum().alias('_parseable'),
+    ]).row(0, named=True)
+    if not counts['_parseable']:
+        return None
+    return next((fmt for fmt in formats if counts[fmt] == counts['_parseable']), None)
+
+def parse_timestamp_expr(column, fmt=None):
+    """Выражение: строка даты -> Datetime(UTC).
+
+    fmt - формат источника (detect_timestamp_format), строки в другом
+    формате дают null. Без fmt каждая строка пробуется во всех
+    TIMESTAMP_FORMATS - для источников со смешанными форматами (реестр
+    сбоев). Даты без смещения считаются UTC.
+    """
+    expr = pl.col(column) if isinstance(column, str) else column
+    if fmt is not None:
+        return expr.cast(pl.String).str.to_datetime(fmt, strict=False, time_zone='UTC', time_unit='us')
+    return pl.coalesce([
+        expr.cast(pl.String).str.to_datetime(candidate, strict=False, time_zone='UTC', time_unit='us')
+        for candidate in TIMESTAMP_FORMATS
+    ])
+
+def timestamp_expr(lf, column):
+    """Выражение: колонка дат column источника lf -> Datetime(UTC).
+
+    Формат строк определяется один раз по первым TIMESTAMP_SAMPLE_ROWS
+    строкам, дальше все строки разбираются в нем. Уже распарсенные даты
+    только приводятся к UTC.
+    """
+    dtype = lf.collect_schema()[column]
+    expr = pl.col(column)
+    if isinstance(dtype, pl.Datetime):
+        expr = expr.dt.replace_time_zone('UTC') if dtype.time_zone is None else expr.dt.convert_time_zone('UTC')
+        return expr.dt.cast_time_unit('us')
+    if dtype == pl.Date:
+        return expr.cast(pl.Datetime('us', 'UTC'))
+
+    sample = lf.head(TIMESTAMP_SAMPLE_ROWS).select(column).collect().to_series()
+    return parse_timestamp_expr(column, detect_timestamp_format(sample))
+
+def to_store_schema(lf, id_col='id', date_col='date', value_col='value'):
+    """Приводит LazyFrame к колонкам id, date, value со схемой хранилища"""
+    return lf.select([
+        pl.col(id_col).cast(pl.UInt64).alias('id'),
+        timestamp_expr(lf, date_col).alias('date'),
+        pl.col(value_col).cast(pl.Float64, strict=False).alias('value'),
+    ])
+
+def empty_store_frame():
+    """Пустой LazyFrame со схемой хранилища"""
+    return pl.LazyFrame(schema=STORE_SCHEMA)
+
+# %%
+# Запись
+
+def _sink_partitioned(lf, target_dir):
+    """Пишет LazyFrame в target_dir с партициями id=/month= (потоково)"""
+    (
+        lf.with_columns(pl.col('date').dt.strftime('%Y-%m').alias('month'))
+        .sink_parquet(
+            pl.PartitionByKey(target_dir, by=['id', 'month'], include_key=False),
+            mkdir=True,
+        )
+    )
+
+def _swap_dir(new_dir, target_dir):
+    """Заменяет target_dir на new_dir, старое содержимое удаляется после подмены"""
+    target_dir = Path(target_dir)
+    old_dir = target_dir.with_name(f".{target_dir.name}.{os.getpid()}.old")
+    if target_dir.exists():
+        os.replace(target_dir, old_dir)
+    os.replace(new_dir, target_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+def rebuild_dataset(lf, dataset_dir, source=None):
+    """Полностью пересобирает датасет из LazyFrame со схемой хранилища.
+
+    Данные пишутся во временную директорию и подменяют датасет целиком,
+    поэтому читатели видят либо старую, либо новую версию.
+    """
+    dataset_dir = Path(dataset_dir)
+    dataset_dir.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = dataset_dir.with_name(f".{dataset_dir.name}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    _sink_partitioned(lf, tmp_dir)
+    tmp_dir.mkdir(parents=True, exist_ok=True)  # пустой вход не создает директорию
+    if source is not None:
+        (tmp_dir / SOURCE_MARKER).write_text(json.dumps(source), encoding='utf-8')
+    _swap_dir(tmp_dir, dataset_dir)
+
+def replace_series(df, dataset_dir):
+    """Заменяет в датасете все партиции рядов, присутствующих в df"""
+    dataset_dir = Path(dataset_dir)
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+
+    for (series_id,), series_df in df.partition_by('id', as_dict=True, maintain_order=True).items():
+        tmp_dir = dataset_dir / f".id={series_id}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        _sink_partitioned(series_df.lazy(), tmp_dir)
+        _swap_dir(tmp_dir / f"id={series_id}", dataset_dir / f"id={series_id}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def append_series(df, dataset_dir):
+    """Дописывает строки df в партиции рядов отдельными файлами.
+
+    Существующие файлы не переписываются, поэтому стоимость зависит только
+    от объема новых строк. Мелкие файлы сливаются при следующей полной
+    перезаписи ряда (replace_series).
+    """
+    dataset_dir = Path(dataset_dir)
+    tmp_dir = dataset_dir / f".append.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    _sink_partitioned(df.lazy(), tmp_dir)
+
+    stamp = time.time_ns()
+    for path in tmp_dir.glob("id=*/month=*/*.parquet"):
+        target_dir = dataset_dir / path.parent.relative_to(tmp_dir)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        os.replace(path, target_dir / f"append-{stamp}-{path.name}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def has_series(dataset_dir, series_id):
+    """Есть ли в датасете партиции ряда"""
+    return (Path(dataset_dir) / f"id={series_id}").is_dir()
+
+# %%
+# Чтение
+
+def scan_dataset(dataset_dir, schema=STORE_SCHEMA):
+    """LazyFrame с колонками schema (по умолчанию id, date, value) поверх датасета"""
+    files = list(Path(dataset_dir).glob("id=*/month=*/*.parquet"))
+    if not files:
+        return pl.LazyFrame(schema=schema)
+
+    return (
+        pl.scan_parquet(
+            files,  # явный список: временные директории незавершенной записи не читаются
+            hive_partitioning=True,
+            hive_schema=HIVE_SCHEMA,
+        )
+        .select(list(schema))
+    )
+
+def _source_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return {'path': str(csv_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _is_stale(csv_path, marker_path):
+    try:
+        with open(marker_path, encoding='utf-8') as f:
+            return json.load(f) != _source_fingerprint(csv_path)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return True
+
+def scan_collected(csv_path=COLLECTED_CSV, dataset_dir=f"{STORE_DIR}/collected"):
+    """Collected данные из хранилища.
+
+    При первом вызове или после изменения collected.csv датасет и индекс
+    рядов (series_index, имя "collected") пересобираются потоково из CSV,
+    дальше читается только Parquet.
+    """
+    if not os.path.exists(csv_path):
+        return scan_dataset(dataset_dir)
+
+    stale = _is_stale(csv_path, Path(dataset_dir) / SOURCE_MARKER)
+    if stale or not index_path('collected').exists():
+        raw = pl.scan_csv(
+            csv_path,
+            schema_overrides={'item_id': pl.String, 'collected': pl.String, 'property_value': pl.String},
+        )
+        store_lf = to_store_schema(raw, 'item_id', 'collected', 'property_value')
+        if stale:
+            rebuild_dataset(store_lf, dataset_dir, source=_source_fingerprint(csv_path))
+        # смещение - номер строки данных в collected.csv
+        rebuild_series_index('collected', store_lf, source=csv_path)
+    return scan_dataset(dataset_dir)
+
+def scan_normalized(dataset_dir=f"{STORE_DIR}/normalized"):
+    """Нормализованные ряды, которые пишет normalize_monitoring_data.py"""
+    return scan_dataset(dataset_dir)
+
+def scan_series_file(csv_path, files_dir=f"{STORE_DIR}/files"):
+    """Отдельный файл data/series_*.csv через его Parquet-копию.
+
+    Копия пересоздается, если CSV изменился. Файлы содержат один ряд,
+    поэтому хранятся одним Parquet без партиций.
+    """
+    parquet_path = Path(files_dir) / f"{Path(csv_path).stem}.parquet"
+    marker_path = parquet_path.with_suffix('.json')
+
+    if _is_stale(csv_path, marker_path):
+        parquet_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = parquet_path.with_name(f".{parquet_path.name}.{os.getpid()}.tmp")
+        raw = pl.scan_csv(csv_path, schema_overrides={'id': pl.String, 'date': pl.String, 'value': pl.String})
+        to_store_schema(raw).sink_parquet(tmp_path)
+        os.replace(tmp_path, parquet_path)
+        marker_path.write_text(json.dumps(_source_fingerprint(csv_path)), encoding='utf-8')
+
+    return pl.scan_parquet(parquet_path)
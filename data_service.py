@@ -0,0 +1,386 @@
+# %%
+# Локальный HTTP-сервис данных для графиков (asyncio, без внешних зависимостей).
+#
+#   python data_service.py --port 8765
+#
+# Один процесс держит данные хранилища для всех, кто смотрит графики:
+# браузер берет строки по URL (alt.UrlData), а не из спецификации, и
+# ноутбуку не нужно собирать их самому.
+#
+#   GET /series?dataset=collected
+#       сводка рядов из индекса (series_summary)
+#   GET /range?dataset=collected,normalized&id=1,2&start=2024-01-01&end=2024-03-01&resolution=1d
+#       строки id, date, value (медиана окна), min, max, count, level;
+#       resolution - raw, уровень пирамиды (1h, 1d, 1w, 1mo) или auto
+#       (самый грубый уровень, заполняющий width пикселей); levels=1d,1w -
+#       несколько уровней сразу (как multires_frame, для level_filter_expr);
+#       format=json (по умолчанию) или csv
+#
+# Запросы к Polars выполняются в потоках (asyncio.to_thread), цикл событий
+# в это время принимает другие соединения; одинаковые запросы, пришедшие
+# одновременно, считаются один раз. Ответы хранятся в LRU-кэше по
+# параметрам и версии данных (время изменения индекса рядов, он
+# обновляется при каждой записи в хранилище). ETag - хэш тела, на
+# If-None-Match с тем же ETag отдается 304 без тела.
+import argparse
+import asyncio
+import gzip
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import altair as alt
+import polars as pl
+
+from chart_payload import _with_lookup
+from columnar_store import STORE_DIR
+from pyramid import LEVELS, RAW, ensure_pyramid, pick_level, scan_level
+from series_index import index_path, scan_series_index, series_summary
+
+HOST = "127.0.0.1"
+PORT = 8765
+DATASETS = ("collected", "normalized")
+RESOLUTIONS = (RAW, *LEVELS)
+FORMATS = ("json", "csv")
+
+DEFAULT_WIDTH = 1200          # ширина графика для resolution=auto, пикселей
+MAX_ROWS = 2_000_000          # больше строк в одном ответе не отдается (400)
+CACHE_MAX_BYTES = 256 << 20   # суммарный размер тел в кэше
+CACHE_SECONDS = 60            # кэш действителен не дольше, даже если индекс не менялся
+GZIP_MIN_BYTES = 1024         # меньшие ответы не сжимаются
+
+CONTENT_TYPES = {
+    'json': "application/json; charset=utf-8",
+    'csv': "text/csv; charset=utf-8",
+}
+
+_cache = OrderedDict()  # ключ запроса -> (версия, время, ответ)
+_inflight = {}          # ключ запроса -> задача, которая его считает
+
+# %%
+# Запросы к хранилищу
+
+def _dataset_version(datasets):
+    """Версия данных: время изменения индексов рядов датасетов"""
+    version = []
+    for name in datasets:
+        path = index_path(name)
+        version.append(path.stat().st_mtime_ns if path.exists() else None)
+    return tuple(version)
+
+def _timestamp(value, name):
+    """Граница окна из строки запроса (ISO-дата или дата со временем, UTC)"""
+    if value is None:
+        return None
+    try:
+        ts = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name}: ожидается дата ISO 8601, получено {value!r}") from None
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+def _span(datasets, ids, start, end):
+    """Отрезок времени запроса; недостающие границы - по индексу рядов"""
+    if start is not None and end is not None:
+        return end - start
+    days = pl.concat([scan_series_index(name) for name in datasets])
+    if ids is not None:
+        days = days.filter(pl.col('id').is_in(ids))
+    first, last = days.select([pl.col('first_ts').min(), pl.col('last_ts').max()]).collect().row(0)
+    if first is None:
+        return LEVELS['1d']
+    return (end or last) - (start or first)
+
+def range_frame(datasets, ids=None, start=None, end=None, resolution="1d", levels=None, width=DEFAULT_WIDTH):
+    """DataFrame id (строкой), date, value, min, max, count, level рядов ids
+    датасетов datasets в окне [start, end).
+
+    levels - список уровней (все сразу, с колонкой level); иначе один
+    уровень resolution (auto - по span и width, как pick_level).
+    """
+    if levels is None:
+        if resolution == "auto":
+            resolution = pick_level(_span(datasets, ids, start, end), width)
+        levels = [resolution]
+    unknown = [level for level in levels if level not in RESOLUTIONS]
+    if unknown:
+        raise ValueError(f"Неизвестные уровни {unknown}, ожидается auto или один из {RESOLUTIONS}")
+
+    condition = pl.lit(True)
+    if ids is not None:
+        condition &= pl.col('id').is_in(ids)
+    if start is not None:
+        condition &= pl.col('date') >= start
+    if end is not None:
+        condition &= pl.col('date') < end
+
+    # Не больше MAX_ROWS + 1 строк еще в ленивом запросе: слишком широкий
+    # запрос отклоняется, не загружая все строки в память
+    df = pl.concat([
+        scan_level(name, level).filter(condition).with_columns(pl.lit(level).alias('level'))
+        for name in datasets for level in levels
+    ]).head(MAX_ROWS + 1).collect()
+    if df.height > MAX_ROWS:
+        raise ValueError(f"В ответе больше {MAX_ROWS} строк: сузьте окно или возьмите уровень грубее")
+    df = df.sort(['id', 'date', 'level'])
+    # id строкой: графики используют его как категорию (id:N)
+    return df.select([
+        pl.col('id').cast(pl.String), 'date', pl.col('median').alias('value'), 'min', 'max', 'count', 'level',
+    ])
+
+def series_frame(datasets):
+    """Сводка рядов датасетов (series_summary) с колонкой dataset"""
+    return pl.concat([
+        series_summary(scan_series_index(name)).with_columns(pl.lit(name).alias('dataset')).collect()
+        for name in datasets
+    ]).with_columns(pl.col('id').cast(pl.String)).sort('id')
+
+def _encode(df, fmt):
+    if fmt == "csv":
+        return df.write_csv(datetime_format="%Y-%m-%dT%H:%M:%S%.3fZ").encode()
+    return df.write_json().encode()
+
+# %%
+# Разбор запроса
+
+def _one(query, name, default=None):
+    values = query.get(name)
+    return values[-1] if values else default
+
+def _names(query, name, allowed):
+    values = [v for value in query.get(name, []) for v in value.split(',') if v]
+    unknown = [v for v in values if v not in allowed]
+    if unknown:
+        raise ValueError(f"{name}: неизвестные значения {unknown}, ожидается из {allowed}")
+    return values
+
+def _ids(query):
+    values = [v for value in query.get('id', []) for v in value.split(',') if v]
+    if not values:
+        return None
+    try:
+        return [int(v) for v in values]
+    except ValueError:
+        raise ValueError(f"id: ожидаются целые номера рядов, получено {values}") from None
+
+def _plan(path, query):
+    """(ключ кэша, датасеты, формат, функция без аргументов -> DataFrame) для запроса"""
+    datasets = tuple(_names(query, 'dataset', DATASETS)) or DATASETS
+    fmt = _one(query, 'format', 'json')
+    if fmt not in FORMATS:
+        raise ValueError(f"format: ожидается один из {FORMATS}")
+
+    if path == "/series":
+        return (path, datasets, fmt), datasets, fmt, lambda: series_frame(datasets)
+
+    ids = _ids(query)
+    start = _timestamp(_one(query, 'start'), 'start')
+    end = _timestamp(_one(query, 'end'), 'end')
+    resolution = _one(query, 'resolution', '1d')
+    levels = _names(query, 'levels', RESOLUTIONS) or None
+    try:
+        width = int(_one(query, 'width', DEFAULT_WIDTH))
+    except ValueError:
+        raise ValueError("width: ожидается целое число пикселей") from None
+    if width <= 0:
+        raise ValueError(f"width: ожидается положительное число пикселей, получено {width}")
+
+    key = (path, datasets, fmt, tuple(sorted(ids)) if ids else None, start, end, resolution,
+           tuple(levels) if levels else None, width)
+    return key, datasets, fmt, lambda: range_frame(datasets, ids, start, end, resolution, levels, width)
+
+# %%
+# Кэш ответов
+
+def _cached(key, version):
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    entry_version, created, response = entry
+    if entry_version != version or time.monotonic() - created > CACHE_SECONDS:
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    return response
+
+def _remember(key, version, response):
+    _cache[key] = (version, time.monotonic(), response)
+    _cache.move_to_end(key)
+    while len(_cache) > 1 and sum(len(r['body']) + len(r['gzip'] or b'') for _, _, r in _cache.values()) > CACHE_MAX_BYTES:
+        _cache.popitem(last=False)  # вытесняем давно не запрошенные
+
+def _build(fmt, frame):
+    """Ответ для кэша: тело, сжатое тело, ETag, тип (выполняется в потоке)"""
+    body = _encode(frame(), fmt)
+    return {
+        'body': body,
+        'gzip': gzip.compress(body, compresslevel=5) if len(body) >= GZIP_MIN_BYTES else None,
+        'etag': f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+        'content_type': CONTENT_TYPES[fmt],
+    }
+
+async def _response(path, query):
+    """Ответ на запрос из кэша, из уже идущего такого же запроса или новый"""
+    key, datasets, fmt, frame = _plan(path, query)
+    version = _dataset_version(datasets)
+    response = _cached(key, version)
+    if response is not None:
+        return response
+
+    task = _inflight.get((key, version))
+    if task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(_build, fmt, frame))
+        _inflight[(key, version)] = task
+        task.add_done_callback(lambda _: _inflight.pop((key, version), None))
+    response = await asyncio.shield(task)  # отключение одного клиента не отменяет запрос для остальных
+    _remember(key, version, response)
+    return response
+
+# %%
+# HTTP
+
+ROUTES = ("/series", "/range")
+
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+async def _handle_request(method, target, headers):
+    """(статус, заголовки, тело) для одного запроса"""
+    base = {
+        'Access-Control-Allow-Origin': "*",  # графики открываются из ноутбука или файла
+        'Cache-Control': "no-cache",         # браузер перепроверяет данные по ETag
+    }
+    if method not in ("GET", "HEAD"):
+        return HTTPStatus.METHOD_NOT_ALLOWED, {**base, 'Allow': "GET, HEAD"}, b""
+
+    url = urlsplit(target)
+    if url.path not in ROUTES:
+        return HTTPStatus.NOT_FOUND, {**base, 'Content-Type': "text/plain; charset=utf-8"}, \
+            f"Неизвестный путь {url.path}, есть {ROUTES}\n".encode()
+    try:
+        response = await _response(url.path, parse_qs(url.query))
+    except ValueError as e:
+        return HTTPStatus.BAD_REQUEST, {**base, 'Content-Type': "text/plain; charset=utf-8"}, f"{e}\n".encode()
+
+    base['ETag'] = response['etag']
+    if response['etag'] in (tag.strip() for tag in headers.get('if-none-match', '').split(',')):
+        return HTTPStatus.NOT_MODIFIED, base, b""
+
+    base['Content-Type'] = response['content_type']
+    base['Vary'] = "Accept-Encoding"
+    body = response['body']
+    if response['gzip'] is not None and 'gzip' in headers.get('accept-encoding', ''):
+        base['Content-Encoding'] = "gzip"
+        body = response['gzip']
+    return HTTPStatus.OK, base, body
+
+async def _read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+async def handle_connection(reader, writer):
+    """Запросы одного соединения по очереди (keep-alive HTTP/1.1)"""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            try:
+                method, target, version = request_line.decode('latin-1').split()
+            except ValueError:
+                writer.write(_head(HTTPStatus.BAD_REQUEST, {'Content-Length': 0, 'Connection': "close"}))
+                break
+            headers = await _read_headers(reader)
+
+            try:
+                status, response_headers, body = await _handle_request(method, target, headers)
+            except Exception as e:  # ошибка запроса не роняет сервис
+                print(f"{method} {target}: {type(e).__name__}: {e}")
+                status, response_headers, body = HTTPStatus.INTERNAL_SERVER_ERROR, {}, f"{e}\n".encode()
+
+            keep_alive = version == "HTTP/1.1" and headers.get('connection', '').lower() != "close"
+            response_headers['Content-Length'] = len(body)
+            response_headers['Connection'] = "keep-alive" if keep_alive else "close"
+            writer.write(_head(status, response_headers) + (b"" if method == "HEAD" else body))
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+        pass  # клиент отключился или прислал слишком длинную строку
+    finally:
+        writer.close()
+
+async def serve(host=HOST, port=PORT, datasets=DATASETS):
+    """Запускает сервис и работает до остановки (Ctrl+C)"""
+    for name in datasets:
+        if index_path(name).exists():
+            ensure_pyramid(name)  # дальше пирамиду обновляют нормализация и дочитывание
+    server = await asyncio.start_server(handle_connection, host, port, limit=1 << 20)
+    print(f"Сервис данных: http://{host}:{port}/range (хранилище {STORE_DIR})")
+    async with server:
+        await server.serve_forever()
+
+# %%
+# Графики с данными с сервиса
+
+def range_url(base_url, datasets=DATASETS, ids=None, start=None, end=None, resolution=None, levels=None,
+              width=None, fmt="json"):
+    """URL запроса /range с этими параметрами"""
+    params = {'dataset': ",".join(datasets), 'format': fmt}
+    if ids is not None:
+        params['id'] = ",".join(str(series_id) for series_id in ids)
+    for name, value in (('start', start), ('end', end), ('resolution', resolution), ('width', width)):
+        if value is not None:
+            params[name] = value.isoformat() if isinstance(value, datetime) else value
+    if levels is not None:
+        params['levels'] = ",".join(levels)
+    return f"{base_url.rstrip('/')}/range?{urlencode(params)}"
+
+def service_chart(chart, df, url, by="id", series_cols=(), rename=None):
+    """Копия chart, где данные df (верхнего уровня и вложенных графиков с
+    теми же данными) читаются по url сервиса.
+
+    Колонки series_cols (постоянные внутри ряда: группа, число дней) в
+    ответе сервиса нет - они берутся lookup по by из таблицы рядов в
+    спецификации. rename - {колонка графика: колонка ответа}, например
+    {'item_id': 'id'}.
+    """
+    rename = rename or {}
+    series = df.select([by, *series_cols]).unique(by).sort(by).with_columns(pl.col(by).cast(pl.String))
+    transforms = [
+        alt.CalculateTransform(calculate=f"datum['{source}']", **{'as': column})
+        for column, source in rename.items()
+    ]
+    if series_cols:
+        transforms.append(alt.LookupTransform(
+            lookup=by,
+            **{'from': alt.LookupData(
+                data=alt.InlineData(values=series.to_dicts()),
+                key=by,
+                fields=list(series_cols),
+            )},
+        ))
+    chart = _with_lookup(chart, df, transforms)
+    chart.data = alt.UrlData(url=url, format=alt.DataFormat(type="json"))
+    return chart
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP-сервис данных хранилища для графиков")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--datasets", nargs="+", default=list(DATASETS), choices=DATASETS)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, tuple(args.datasets)))
+    except KeyboardInterrupt:
+        pass
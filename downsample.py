@@ -0,0 +1,153 @@
+# %%
+# Прореживание рядов под ширину графика перед сериализацией в Vega-Lite.
+#
+# График шириной W пикселей не может показать больше ~2W различимых точек
+# на ряд, поэтому остальное только раздувает спецификацию и тормозит
+# браузер. Оба режима считаются для всех рядов сразу через over(by):
+#   minmax - для каждой из W корзин по времени оставляются точки с
+#            минимумом и максимумом (выбросы и резкие сбросы сохраняются);
+#   lttb   - Largest-Triangle-Three-Buckets, W точек на ряд;
+#   raw    - без прореживания (для детального зума).
+import polars as pl
+
+MODES = ("minmax", "lttb", "raw")
+
+# %%
+# Вспомогательные выражения
+
+def _numeric_x(x):
+    """Ось x как Float64 (даты - микросекунды эпохи)"""
+    return pl.col(x).to_physical().cast(pl.Float64)
+
+def _sorted(df, x, by):
+    keys = ([by] if isinstance(by, str) else list(by)) + [x]
+    return df.sort(keys)
+
+# %%
+# Режимы
+
+def minmax_downsample(df, n_buckets, x="date", y="value", by="item_id"):
+    """Min/max по n_buckets равным интервалам времени каждого ряда.
+
+    Первая и последняя точки ряда всегда сохраняются. Строки без y
+    отбрасываются.
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    t = _numeric_x(x)
+    lo = t.min().over(by)
+    hi = t.max().over(by)
+    bucket = ((t - lo) / (hi - lo) * n_buckets).floor().clip(0, n_buckets - 1).fill_nan(0).cast(pl.Int64)
+
+    data = (
+        _sorted(df.filter(pl.col(y).is_not_null()), x, by).lazy()
+        .with_row_index("_row")
+        .with_columns(pl.len().over(by).alias("_n"))
+    )
+    # Ряды, в которых точек не больше двух на корзину, не прореживаются
+    short = data.filter(pl.col("_n") <= 2 * n_buckets).select("_row")
+    long = data.filter(pl.col("_n") > 2 * n_buckets).with_columns(bucket.alias("_bucket"))
+
+    # Строки с минимумом и максимумом каждой корзины (при равенстве - первая).
+    # Данные отсортированы, поэтому корзины идут подряд и нумеруются
+    # возрастающим ключом: группировка по нему идет по быстрому пути
+    segment = (pl.col("_bucket") != pl.col("_bucket").shift()) | (pl.col("_n") != pl.col("_n").shift())
+    for key in keys:
+        segment = segment | (pl.col(key) != pl.col(key).shift())
+    long = long.with_columns(segment.fill_null(True).cum_sum().set_sorted().alias("_segment"))
+
+    extremes = (
+        long.with_columns([
+            pl.col(y).min().over("_segment").alias("_min"),
+            pl.col(y).max().over("_segment").alias("_max"),
+        ])
+        .filter((pl.col(y) == pl.col("_min")) | (pl.col(y) == pl.col("_max")))
+        .unique(subset=["_segment", y], keep="first", maintain_order=True)
+        .select("_row")
+    )
+    # Начало и конец каждого ряда
+    ends = (
+        long.group_by(keys)
+        .agg(pl.concat_list(pl.col("_row").min(), pl.col("_row").max()).alias("_row"))
+        .select(pl.col("_row").explode())
+    )
+
+    keep = pl.concat([short, extremes, ends])
+    return (
+        data.join(keep, on="_row", how="semi")
+        .sort("_row")
+        .select(df.columns)
+        .collect()
+    )
+
+def lttb_downsample(df, n_out, x="date", y="value", by="item_id"):
+    """LTTB до n_out точек на ряд (ряды короче n_out не меняются).
+
+    Точки делятся на корзины равного размера по индексу; из каждой корзины
+    берется точка с наибольшей площадью треугольника со средней точкой
+    соседних корзин. В отличие от последовательного LTTB опорой служит
+    среднее предыдущей корзины, а не выбранная в ней точка - так все
+    корзины всех рядов считаются одним проходом без цикла.
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    n_inner = max(n_out - 2, 1)
+
+    data = (
+        _sorted(df.filter(pl.col(y).is_not_null()), x, by).lazy()
+        .with_row_index("_row")
+        .with_columns([
+            pl.int_range(pl.len()).over(by).alias("_i"),
+            pl.len().over(by).alias("_n"),
+            _numeric_x(x).alias("_x"),
+            pl.col(y).cast(pl.Float64).alias("_y"),
+        ])
+        .with_columns(
+            # корзина 0 - первая точка, n_inner + 1 - последняя
+            pl.when(pl.col("_i") == 0).then(0)
+            .when(pl.col("_i") == pl.col("_n") - 1).then(n_inner + 1)
+            .otherwise(1 + (pl.col("_i") - 1) * n_inner // (pl.col("_n") - 2).clip(1))
+            .alias("_bucket")
+        )
+    )
+
+    centers = (
+        data.group_by([*keys, "_bucket"])
+        .agg(pl.col("_x").mean().alias("_cx"), pl.col("_y").mean().alias("_cy"))
+    )
+    prev_centers = centers.with_columns(pl.col("_bucket") + 1).rename({"_cx": "_ax", "_cy": "_ay"})
+    next_centers = centers.with_columns(pl.col("_bucket") - 1).rename({"_cx": "_bx", "_cy": "_by"})
+
+    # Края ряда получают площадь +inf и всегда выбираются
+    area = (
+        (pl.col("_ax") - pl.col("_bx")) * (pl.col("_y") - pl.col("_ay"))
+        - (pl.col("_ax") - pl.col("_x")) * (pl.col("_by") - pl.col("_ay"))
+    ).abs().fill_null(float("inf"))
+
+    keep = (
+        data.filter(pl.col("_n") > n_out)
+        .join(prev_centers, on=[*keys, "_bucket"], how="left")
+        .join(next_centers, on=[*keys, "_bucket"], how="left")
+        .group_by([*keys, "_bucket"])
+        .agg(pl.col("_row").sort_by(area, descending=True).first())
+        .select("_row")
+    )
+    short = data.filter(pl.col("_n") <= n_out).select("_row")
+
+    return (
+        data.join(pl.concat([keep, short]), on="_row", how="semi")
+        .sort("_row")
+        .select(df.columns)
+        .collect()
+    )
+
+def downsample(df, width, mode="minmax", x="date", y="value", by="item_id"):
+    """Прореживает df под график шириной width пикселей.
+
+    mode: "minmax" (по умолчанию), "lttb" или "raw" - вернуть данные как есть.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим прореживания {mode!r}, ожидается один из {MODES}")
+    if mode == "raw":
+        return df
+    if mode == "minmax":
+        return minmax_downsample(df, width, x=x, y=y, by=by)
+    return lttb_downsample(df, width, x=x, y=y, by=by)
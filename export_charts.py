@@ -0,0 +1,232 @@
+# %%
+# Пакетный экспорт всех групп графиков без ноутбука.
+#
+#   python export_charts.py tz --format svg
+#   python export_charts.py collected series --format png --workers 4
+#
+# Скрипт графика (tz.py, visualization_collected.py, visualization.py)
+# выполняется один раз, из его пространства имен берутся готовый график,
+# прореженные данные и параметр-слайдер групп. Данные пишутся одним
+# Parquet-файлом, который читают все процессы пула: каждый берет только
+# строки своей группы (predicate pushdown), подставляет их в спецификацию,
+# фиксирует слайдер на этой группе и рендерит HTML/SVG/PNG через vl-convert
+# (без сети; HTML со встроенными vega/vega-lite). Группы, у которых не
+# изменились данные и спецификация, пропускаются по манифесту.
+import argparse
+import hashlib
+import json
+import os
+import runpy
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from pathlib import Path
+
+import altair as alt
+import polars as pl
+
+from group_shards import _with_named_data
+from normalization import load_manifest, save_manifest
+
+EXPORT_DIR = "charts/export"
+MANIFEST_NAME = ".export_manifest_{fmt}.json"
+DATA_NAME = ".export_data.parquet"
+FORMATS = ("html", "svg", "png")
+
+# Откуда брать график: скрипт и имена переменных в нем
+CHARTS = {
+    'tz': {
+        'script': "tz.py",
+        'chart': "final_chart",
+        'data': "plot_data",
+        'param': "group_param",
+        'group_col': "group_num",
+    },
+    'collected': {
+        'script': "visualization_collected.py",
+        'chart': "chart",
+        'data': "plot_data",
+        'param': "group_param",
+        'group_col': "group_number",
+        'always_loaded': [-1],  # дополнительные серии (список слева)
+    },
+    'series': {
+        'script': "visualization.py",
+        'chart': "chart",
+        'data': "plot_data",
+        'param': "slider",
+        'group_col': "id_index",
+    },
+}
+
+# %%
+# Спецификация одной группы
+
+def group_spec(spec, param_name, group_col, group):
+    """Копия спецификации, в которой слайдер групп зафиксирован на group"""
+    params = []
+    for param in spec.get('params', []):
+        if param.get('name') == param_name:
+            param = {k: v for k, v in param.items() if k != 'bind'}
+            if 'select' in param:
+                param['value'] = [{group_col: group}]
+            else:
+                param['value'] = group
+        params.append(param)
+    return {**spec, 'params': params}
+
+def group_digest(spec, group_df, fmt):
+    """Хэш входа группы: спецификация, формат и строки данных"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps(spec, sort_keys=True, default=str).encode())
+    digest.update(fmt.encode())
+    digest.update(group_df.hash_rows(seed=0).cast(pl.String).str.join(",").item().encode())
+    return digest.hexdigest()
+
+# %%
+# Рендеринг (выполняется в процессах пула)
+
+def render(spec, fmt):
+    """Рендерит спецификацию в str (html, svg) или bytes (png)"""
+    try:
+        import vl_convert as vlc
+    except ImportError:
+        vlc = None
+
+    if vlc is None:
+        if fmt != "html":
+            raise RuntimeError(f"Для экспорта в {fmt} нужен пакет vl-convert-python")
+        # Без vl-convert HTML грузит vega с CDN
+        return alt.utils.html.spec_to_html(
+            spec, mode="vega-lite",
+            vega_version=alt.VEGA_VERSION,
+            vegalite_version=alt.VEGALITE_VERSION,
+            vegaembed_version=alt.VEGAEMBED_VERSION,
+        )
+
+    if fmt == "html":
+        return vlc.vegalite_to_html(spec, bundle=True)
+    if fmt == "svg":
+        return vlc.vegalite_to_svg(spec)
+    return vlc.vegalite_to_png(spec)
+
+def render_group(spec, data_path, group_col, groups, fmt, out_path):
+    """Читает строки групп groups из общего Parquet и пишет out_path"""
+    rows = pl.scan_parquet(data_path).filter(pl.col(group_col).is_in(groups)).collect()
+    result = render({**spec, 'data': {'values': json.loads(rows.write_json())}}, fmt)
+
+    out_path = Path(out_path)
+    tmp_path = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    if isinstance(result, bytes):
+        tmp_path.write_bytes(result)
+    else:
+        tmp_path.write_text(result, encoding="utf-8")
+    os.replace(tmp_path, out_path)
+    return str(out_path)
+
+# %%
+# Экспорт
+
+def export_chart(name, fmt="html", out_dir=EXPORT_DIR, max_workers=None, force=False):
+    """Экспортирует каждую группу графика name в <out_dir>/<name>/group_N.<fmt>.
+
+    Возвращает словарь со списками 'skipped', 'exported' и 'failed'.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt!r}, ожидается один из {FORMATS}")
+    config = CHARTS[name]
+    group_col = config['group_col']
+    always_loaded = config.get('always_loaded', [])
+
+    print(f"Строим график {name} ({config['script']})...")
+    namespace = runpy.run_path(config['script'], run_name=f"__export_{name}__")
+    chart = namespace[config['chart']]
+    data = namespace[config['data']]
+    param_name = namespace[config['param']].name
+
+    out_dir = Path(out_dir) / name
+    out_dir.mkdir(parents=True, exist_ok=True)
+    data_path = out_dir / DATA_NAME
+    data.write_parquet(data_path)
+
+    # Данные групп подставляются при рендеринге; datasets остаются - это
+    # собственные данные слоев (например, события change_points)
+    spec = _with_named_data(chart, "data").to_dict()
+    spec.pop('data', None)
+
+    manifest_path = out_dir / MANIFEST_NAME.format(fmt=fmt)
+    manifest = {} if force else load_manifest(manifest_path)
+    shared = data.filter(pl.col(group_col).is_in(always_loaded))
+
+    report = {'skipped': [], 'exported': [], 'failed': []}
+    started = time.perf_counter()
+
+    pending = {}
+    new_manifest = {}
+    for (group,), group_df in data.partition_by(group_col, as_dict=True).items():
+        if group in always_loaded:
+            continue
+        filename = f"group_{group}.{fmt}"
+        task_spec = group_spec(spec, param_name, group_col, group)
+        digest = group_digest(task_spec, pl.concat([group_df, shared]), fmt)
+        new_manifest[filename] = digest
+        if manifest.get(filename) == digest and (out_dir / filename).exists():
+            report['skipped'].append(filename)
+        else:
+            pending[filename] = (task_spec, str(data_path), group_col, [group, *always_loaded],
+                                 fmt, str(out_dir / filename))
+
+    errors = {}
+    if len(pending) == 1 or max_workers == 1:
+        for filename, task in pending.items():
+            try:
+                render_group(*task)
+            except Exception as e:
+                errors[filename] = e
+    elif pending:
+        # spawn: fork после старта пула потоков Polars может зависнуть
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_context('spawn')) as pool:
+            futures = {pool.submit(render_group, *task): filename for filename, task in pending.items()}
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    errors[filename] = e
+
+    for filename in pending:
+        if filename in errors:
+            print(f"  -> Ошибка экспорта {filename}: {errors[filename]}")
+            new_manifest.pop(filename)
+            report['failed'].append(filename)
+        else:
+            report['exported'].append(filename)
+
+    # Файлы групп, которых больше нет в данных
+    for filename in set(manifest) - set(new_manifest):
+        (out_dir / filename).unlink(missing_ok=True)
+
+    save_manifest(new_manifest, manifest_path)
+    data_path.unlink()
+
+    print(
+        f"{name}: пропущено {len(report['skipped'])}, экспортировано {len(report['exported'])}, "
+        f"ошибок {len(report['failed'])} за {time.perf_counter() - started:.2f} с -> {out_dir}"
+    )
+    return report
+
+# %%
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт всех групп графиков в HTML/SVG/PNG")
+    parser.add_argument("charts", nargs="+", choices=sorted(CHARTS), help="какие графики экспортировать")
+    parser.add_argument("--format", default="html", choices=FORMATS, dest="fmt")
+    parser.add_argument("--out", default=EXPORT_DIR, help=f"каталог результата (по умолчанию {EXPORT_DIR})")
+    parser.add_argument("--workers", type=int, default=None, help="число процессов (по умолчанию - по числу ядер)")
+    parser.add_argument("--force", action="store_true", help="экспортировать и неизменившиеся группы")
+    args = parser.parse_args()
+
+    failed = 0
+    for name in args.charts:
+        report = export_chart(name, fmt=args.fmt, out_dir=args.out, max_workers=args.workers, force=args.force)
+        failed += len(report['failed'])
+    raise SystemExit(1 if failed else 0)
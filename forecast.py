@@ -0,0 +1,165 @@
+# %%
+# Прогноз роста объемов (диски, БД): когда ряд дойдет до порога.
+#
+# Для каждого ряда строится линейный тренд по последним FIT_DAYS дням
+# (после последнего сброса или скачка уровня, если передана таблица событий
+# change_points). МНК в замкнутой форме считается для всех рядов сразу
+# одним group_by по центрированным суммам:
+#   slope = sum((t - t_mean) * (y - y_mean)) / sum((t - t_mean)^2)
+# t - дни относительно последней точки ряда, поэтому level (значение
+# тренда при t = 0) - оценка текущего уровня.
+#
+# days_to_threshold дает число дней до порога (емкости), forecast_frame и
+# forecast_layer - линию тренда с продолжением на horizon дней и полосой
+# +-2 sigma остатков для графиков.
+import altair as alt
+import polars as pl
+
+FIT_DAYS = 30       # дней истории для тренда
+HORIZON_DAYS = 90   # на сколько дней продолжать тренд на графике
+MIN_POINTS = 5      # меньше точек - тренд не строится
+BAND_SIGMAS = 2.0   # ширина полосы в стандартных отклонениях остатков
+
+_DAY_US = 86_400_000_000
+
+# %%
+# Тренды
+
+def fit_trends(lf, fit_days=FIT_DAYS, events=None, by="item_id", date_col="date", value_col="y"):
+    """LazyFrame трендов: by..., n_points, fit_start, last_date, last_value,
+    level, slope (единиц в день), sigma, r2.
+
+    events - таблица change_points.detect_events с теми же колонками by:
+    точки до последнего сброса или скачка уровня ряда в тренд не входят.
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    data = lf.drop_nulls(value_col).with_columns(
+        ((pl.col(date_col) - pl.col(date_col).max().over(keys)).dt.total_microseconds() / _DAY_US)
+        .alias("_t")
+    ).filter(pl.col("_t") > -fit_days)
+
+    if events is not None:
+        resets = (
+            events.lazy()
+            .filter(pl.col("kind").is_in(["jump", "drop"]))
+            .group_by(keys)
+            .agg(pl.col(date_col).max().alias("_since"))
+        )
+        data = (
+            data.join(resets, on=keys, how="left")
+            .filter(pl.col("_since").is_null() | (pl.col(date_col) >= pl.col("_since")))
+        )
+
+    # Центрированные t и y: суммы произведений без потери точности на
+    # больших значениях (байты)
+    data = data.with_columns([
+        (pl.col("_t") - pl.col("_t").mean().over(keys)).alias("_tc"),
+        (pl.col(value_col) - pl.col(value_col).mean().over(keys)).alias("_yc"),
+    ])
+    t, y = pl.col("_tc"), pl.col("_yc")
+    sums = data.group_by(keys).agg([
+        pl.len().alias("n_points"),
+        pl.col(date_col).min().alias("fit_start"),
+        pl.col(date_col).max().alias("last_date"),
+        pl.col(value_col).sort_by(date_col).last().alias("last_value"),
+        pl.col("_t").mean().alias("_t_mean"),
+        pl.col(value_col).mean().alias("_y_mean"),
+        (t * t).sum().alias("_stt"),
+        (t * y).sum().alias("_sty"),
+        (y * y).sum().alias("_syy"),
+    ]).filter(pl.col("n_points") >= MIN_POINTS)
+
+    slope = pl.col("_sty") / pl.col("_stt")
+    sse = (pl.col("_syy") - slope * pl.col("_sty")).clip(lower_bound=0)
+    return (
+        sums.with_columns(slope.alias("slope"))
+        .with_columns([
+            (pl.col("_y_mean") - pl.col("slope") * pl.col("_t_mean")).alias("level"),
+            (sse / (pl.col("n_points") - 2)).sqrt().alias("sigma"),
+            pl.when(pl.col("_syy") > 0).then(1 - sse / pl.col("_syy")).otherwise(1.0).alias("r2"),
+        ])
+        .filter(pl.col("slope").is_finite())  # все точки ряда в один день
+        .select(keys + ["n_points", "fit_start", "last_date", "last_value", "level", "slope", "sigma", "r2"])
+        .sort(keys)
+    )
+
+# %%
+# Дни до порога
+
+def days_to_threshold(fits, threshold, by="item_id"):
+    """Добавляет к трендам threshold, days_to_threshold и threshold_date.
+
+    threshold - число для всех рядов или таблица с колонками by и
+    "threshold" (емкость каждого ряда). Ряды без роста получают null,
+    ряды, уже достигшие порога, - 0 дней.
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    fits = fits.lazy()
+    if isinstance(threshold, (pl.DataFrame, pl.LazyFrame)):
+        fits = fits.join(threshold.lazy().select(keys + ["threshold"]), on=keys, how="left")
+    else:
+        fits = fits.with_columns(pl.lit(threshold, dtype=pl.Float64).alias("threshold"))
+
+    remaining = pl.col("threshold") - pl.col("level")
+    days = (
+        pl.when(remaining <= 0).then(0.0)
+        .when(pl.col("slope") > 0).then(remaining / pl.col("slope"))
+    )
+    return fits.with_columns(days.alias("days_to_threshold")).with_columns(
+        (pl.col("last_date") + pl.duration(microseconds=(pl.col("days_to_threshold") * _DAY_US).round().cast(pl.Int64)))
+        .alias("threshold_date")
+    )
+
+# %%
+# Слой графика
+
+def forecast_frame(fits, horizon_days=HORIZON_DAYS, by="item_id", date_col="date"):
+    """Точки линии тренда: начало подгонки, последняя точка и last_date + horizon_days.
+
+    Колонки: by..., date_col, forecast, lower, upper (полоса +-BAND_SIGMAS sigma).
+    """
+    keys = [by] if isinstance(by, str) else list(by)
+    fits = fits.lazy()
+    start_t = (pl.col("fit_start") - pl.col("last_date")).dt.total_microseconds() / _DAY_US
+
+    points = pl.concat([
+        fits.select(keys + [pl.col("fit_start").alias(date_col), start_t.alias("_t"), "level", "slope", "sigma"]),
+        fits.select(keys + [pl.col("last_date").alias(date_col), pl.lit(0.0).alias("_t"), "level", "slope", "sigma"]),
+        fits.select(keys + [
+            (pl.col("last_date") + pl.duration(days=horizon_days)).alias(date_col),
+            pl.lit(float(horizon_days)).alias("_t"), "level", "slope", "sigma",
+        ]),
+    ])
+    forecast = pl.col("level") + pl.col("slope") * pl.col("_t")
+    band = BAND_SIGMAS * pl.col("sigma").fill_null(0.0)
+    return (
+        points.select(keys + [
+            pl.col(date_col),
+            forecast.alias("forecast"),
+            (forecast - band).alias("lower"),
+            (forecast + band).alias("upper"),
+        ])
+        .sort(keys + [date_col])
+    )
+
+def forecast_layer(forecast, date_col="date", color=None, detail="item_id:N"):
+    """Пунктир тренда с продолжением и полоса неопределенности.
+
+    forecast - результат forecast_frame; фильтры групп добавляются снаружи
+    (transform_filter у возвращаемого слоя).
+    """
+    encoding = {'x': alt.X(f'{date_col}:T'), 'detail': detail}
+    if color is not None:
+        encoding['color'] = color
+    base = alt.Chart(forecast).encode(**encoding)
+
+    band = base.mark_area(opacity=0.12, clip=True).encode(y='lower:Q', y2='upper:Q')
+    line = base.mark_line(strokeDash=[6, 4], strokeWidth=1.5, clip=True).encode(
+        y='forecast:Q',
+        tooltip=[
+            alt.Tooltip(detail, title='ID'),
+            alt.Tooltip(f'{date_col}:T', format='%d.%m.%Y', title='Дата'),
+            alt.Tooltip('forecast:Q', format=',.2f', title='Прогноз'),
+        ],
+    )
+    return alt.layer(band, line)
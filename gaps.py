@@ -0,0 +1,109 @@
+# %%
+# Реестр системных сбоев и исключение попавших в них точек.
+#
+# Сбои хранятся в gap_registry.csv: start, end, item_id (пусто - сбой для
+# всех рядов), comment. Границы задаются датой или датой со временем.
+# Интервал полуоткрытый [start, end): если end задан одной датой, он
+# включает весь этот день, как в прежнем списке gap_periods.
+import polars as pl
+
+from columnar_store import parse_timestamp_expr
+
+GAP_REGISTRY = "gap_registry.csv"
+
+GAP_SCHEMA = {
+    'start': pl.Datetime('us', 'UTC'),
+    'end': pl.Datetime('us', 'UTC'),
+    'item_id': pl.UInt64,
+}
+
+# %%
+# Реестр
+
+def load_gap_registry(path=GAP_REGISTRY):
+    """Читает реестр сбоев в DataFrame start, end, item_id (UTC)"""
+    raw = pl.read_csv(
+        path,
+        schema_overrides={'start': pl.String, 'end': pl.String, 'item_id': pl.String},
+    )
+    date_only = pl.col('end').str.strip_chars().str.len_chars() <= 10
+
+    gaps = raw.select([
+        parse_timestamp_expr('start').alias('start'),
+        pl.when(date_only)
+        .then(parse_timestamp_expr('end').dt.offset_by('1d'))
+        .otherwise(parse_timestamp_expr('end'))
+        .alias('end'),
+        pl.col('item_id').cast(pl.UInt64),
+    ])
+
+    invalid = gaps.select(
+        (pl.col('start').is_null() | pl.col('end').is_null() | (pl.col('end') <= pl.col('start')))
+        .fill_null(True)
+    ).to_series()
+    if invalid.any():
+        raise ValueError(f"Некорректные интервалы в {path}:\n{raw.filter(invalid)}")
+
+    return gaps
+
+def merge_intervals(gaps, by=None):
+    """Сливает пересекающиеся и смежные интервалы (внутри by, если задан).
+
+    Возвращает непересекающиеся интервалы, отсортированные по start.
+    """
+    keys = [by] if by else []
+    ordered = gaps.sort(keys + ['start'])
+    prev_end = pl.col('end').cum_max().shift(1)
+    if by:
+        prev_end = prev_end.over(by)
+
+    return (
+        ordered
+        .with_columns((pl.col('start') > prev_end).fill_null(True).cum_sum().alias('_block'))
+        .group_by(keys + ['_block'], maintain_order=True)
+        .agg(pl.col('start').min(), pl.col('end').max())
+        .drop('_block')
+    )
+
+# %%
+# Исключение точек
+
+def in_global_gaps_expr(gaps, date_col='date'):
+    """Выражение: попадает ли date_col в один из общих (без item_id) сбоев.
+
+    Бинарный поиск по отсортированным началам интервалов, без сортировки
+    самого фрейма.
+    """
+    merged = merge_intervals(gaps.filter(pl.col('item_id').is_null()))
+    if merged.height == 0:
+        return pl.lit(False)
+
+    idx = pl.lit(merged['start']).search_sorted(pl.col(date_col), side='right').cast(pl.Int64) - 1
+    return (idx >= 0) & (pl.col(date_col) < pl.lit(merged['end']).gather(idx.clip(0)))
+
+def exclude_gaps(lf, gaps, date_col='date', by='item_id'):
+    """Убирает из LazyFrame точки, попавшие в сбои реестра.
+
+    Общие сбои проверяются выражением in_global_gaps_expr, сбои отдельных
+    рядов - через join_asof по by. Порядок строк сохраняется.
+    """
+    result = lf.filter(~in_global_gaps_expr(gaps, date_col))
+
+    scoped = merge_intervals(gaps.filter(pl.col('item_id').is_not_null()), by='item_id')
+    if scoped.height == 0:
+        return result
+
+    scoped = scoped.rename({'item_id': by}).with_columns(pl.col('start').alias(date_col))
+    key_dtype = lf.collect_schema()[by]
+
+    return (
+        result.with_row_index('_row')
+        .sort([by, date_col])
+        .join_asof(
+            scoped.lazy().with_columns(pl.col(by).cast(key_dtype)).sort([by, date_col]),
+            on=date_col, by=by, strategy='backward', check_sortedness=False,
+        )
+        .filter(pl.col('end').is_null() | (pl.col(date_col) >= pl.col('end')))
+        .sort('_row')
+        .drop(['_row', 'start', 'end'])
+    )
@@ -0,0 +1,111 @@
+# %%
+# Экспорт графика с данными, разбитыми по группам (шардам).
+#
+# Вместо одного HTML со всеми группами внутри спецификации пишется
+#   <out_dir>/index.html          - график без данных
+#   <out_dir>/groups/group_N.json - данные группы N
+# Страница подгружает по URL только выбранную слайдером группу, поэтому
+# время загрузки и память браузера зависят от размера группы, а не всего
+# набора. Открывать через HTTP (например, python -m http.server в out_dir):
+# браузеры не дают fetch() читать файлы по file://.
+import json
+from pathlib import Path
+
+import altair as alt
+
+DATASET_NAME = "group_data"
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <title>{title}</title>
+  <script src="https://cdn.jsdelivr.net/npm/vega@{vega_version}"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-lite@{vegalite_version}"></script>
+  <script src="https://cdn.jsdelivr.net/npm/vega-embed@{vegaembed_version}"></script>
+</head>
+<body>
+  <div id="chart"></div>
+  <script>
+    const spec = {spec};
+    const shards = {shards};
+    const alwaysLoaded = {always_loaded};
+    const cache = new Map();
+
+    function loadShard(group) {{
+      if (!(group in shards)) return Promise.resolve([]);
+      if (!cache.has(group)) {{
+        cache.set(group, fetch(shards[group]).then(response => response.json()));
+      }}
+      return cache.get(group);
+    }}
+
+    vegaEmbed("#chart", spec).then(({{view}}) => {{
+      let current = null;
+      async function showGroup(group) {{
+        current = group;
+        const parts = await Promise.all([group, ...alwaysLoaded].map(loadShard));
+        if (current !== group) return;  // пока грузили, выбрали другую группу
+        view.change("{dataset}", vega.changeset().remove(() => true).insert(parts.flat())).run();
+      }}
+      view.addSignalListener("{group_signal}", (name, value) => showGroup(String(value)));
+      showGroup(String(view.signal("{group_signal}")));
+    }});
+  </script>
+</body>
+</html>
+"""
+
+# %%
+# Запись
+
+def write_group_shards(df, group_col, out_dir):
+    """Пишет данные каждой группы в <out_dir>/groups/group_N.json.
+
+    Возвращает словарь {значение группы (строкой): относительный путь}.
+    """
+    shard_dir = Path(out_dir) / "groups"
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    for stale in shard_dir.glob("group_*.json"):
+        stale.unlink()
+
+    shards = {}
+    for (group,), group_df in df.partition_by(group_col, as_dict=True).items():
+        filename = f"group_{group}.json"
+        group_df.write_json(shard_dir / filename)
+        shards[str(group)] = f"groups/{filename}"
+    return shards
+
+def _with_named_data(chart, name):
+    """Копия графика, у которой данные верхнего уровня заменены на именованный источник"""
+    chart = chart.copy(deep=False)
+    chart.data = alt.NamedData(name=name)
+    return chart
+
+def export_group_shards(chart, df, group_col, group_param, out_dir, always_loaded=(), title="График"):
+    """Экспортирует chart как HTML с подгрузкой данных по группам.
+
+    chart должен брать данные из df на верхнем уровне и фильтровать их
+    параметром group_param (как transform_filter(datum.group_num == param)).
+    always_loaded - группы, которые подгружаются всегда (например, -1 для
+    дополнительных серий в visualization_collected.py).
+    """
+    out_dir = Path(out_dir)
+    shards = write_group_shards(df, group_col, out_dir)
+    spec = _with_named_data(chart, DATASET_NAME).to_dict()
+
+    html = HTML_TEMPLATE.format(
+        title=title,
+        vega_version=alt.VEGA_VERSION,
+        vegalite_version=alt.VEGALITE_VERSION,
+        vegaembed_version=alt.VEGAEMBED_VERSION,
+        spec=json.dumps(spec, ensure_ascii=False),
+        shards=json.dumps(shards),
+        always_loaded=json.dumps([str(g) for g in always_loaded]),
+        dataset=DATASET_NAME,
+        group_signal=group_param.name,
+    )
+    out_path = out_dir / "index.html"
+    out_path.write_text(html, encoding="utf-8")
+    print(f"Экспортировано {len(shards)} групп: {out_path}")
+    return out_path
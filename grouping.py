@@ -0,0 +1,185 @@
+# %%
+# Разбиение рядов на группы для графиков (по GROUP_SIZE рядов на группу).
+#
+# Номера групп считаются выражениями над таблицей сводки рядов (строка на
+# ряд) и присоединяются к данным join'ом, без словарей и map_elements.
+# Способы:
+#   rank      - по порядку строк сводки (например, по числу точек): ряды
+#               1..size - группа 1 и т.д.;
+#   magnitude - сначала по порядку величины масштаба ряда (floor(log10)),
+#               внутри порядка - по рангу: ряд в 50 ТБ не попадает в одну
+#               группу с рядами в гигабайты;
+#   cluster   - кластеры по близости log10 масштаба (ряды, отсортированные по
+#               масштабу, разрываются там, где соседние отличаются больше чем
+#               в 10^CLUSTER_GAP раз), внутри кластера - соседи по масштабу.
+# Масштаб ряда - max(|min|, |max|) его значений (scale_expr).
+#
+# group_domains дает общий для группы диапазон оси y, domain_expr -
+# выражение Vega-Lite, выбирающее диапазон текущей группы по параметру.
+import json
+import math
+
+import altair as alt
+import polars as pl
+
+GROUP_SIZE = 10
+MODES = ("rank", "magnitude", "cluster")
+CLUSTER_GAP = 0.5        # разрыв кластеров, порядков величины (10^0.5 ~ 3 раза)
+DOMAIN_PADDING = 0.05    # запас диапазона оси y с каждой стороны, доля размаха
+
+_TINY = 1e-12  # нулевой масштаб - отдельный порядок
+
+# %%
+# Сводка рядов
+
+def scale_expr(min_col="min_value", max_col="max_value"):
+    """Масштаб ряда: наибольшее по модулю значение"""
+    return pl.max_horizontal(pl.col(min_col).abs(), pl.col(max_col).abs())
+
+def summary_stats(lf, by="item_id", value_col="y"):
+    """LazyFrame by, n_points, min_value, max_value, scale по данным рядов"""
+    return (
+        lf.drop_nulls(value_col)
+        .group_by(by)
+        .agg([
+            pl.len().alias("n_points"),
+            pl.col(value_col).min().alias("min_value"),
+            pl.col(value_col).max().alias("max_value"),
+        ])
+        .with_columns(scale_expr().alias("scale"))
+    )
+
+def rank_series(lf, min_points=1, by="item_id"):
+    """LazyFrame by, n_points: ряды lf не меньше чем с min_points строками,
+    по убыванию числа строк (при равенстве - по by, порядок групп стабилен)"""
+    return (
+        lf.group_by(by)
+        .agg(pl.len().alias("n_points"))
+        .filter(pl.col("n_points") >= min_points)
+        .sort(["n_points", by], descending=[True, False])
+    )
+
+def with_scale(stats, lf, by="item_id", value_col="y"):
+    """DataFrame stats с колонкой scale по данным рядов lf; порядок строк
+    stats (ранг для assign_groups) сохраняется"""
+    scales = summary_stats(lf, by, value_col).select([by, "scale"]).collect()
+    return stats.join(scales, on=by, how="left", maintain_order="left")
+
+# %%
+# Номера групп
+
+def assign_groups(stats, size=GROUP_SIZE, mode="rank", by="item_id", scale_col="scale", first_group=1):
+    """LazyFrame by, group_num (Int64) для рядов таблицы stats.
+
+    Порядок строк stats - ранг ряда (кто раньше, тот в группе с меньшим
+    номером). Для magnitude и cluster нужна колонка scale_col.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный способ группировки {mode!r}, ожидается один из {MODES}")
+
+    lf = stats.lazy().select(pl.col(by), *([pl.col(scale_col)] if mode != "rank" else [])).with_row_index("_rank")
+    if mode == "rank":
+        return lf.select([
+            pl.col(by),
+            (pl.col("_rank").cast(pl.Int64) // size + first_group).alias("group_num"),
+        ])
+
+    log_scale = pl.col(scale_col).abs().clip(lower_bound=_TINY).log10()
+    if mode == "magnitude":
+        lf = (
+            lf.with_columns(log_scale.floor().alias("_part"))
+            .sort(["_part", "_rank"], descending=[True, False])
+        )
+    else:
+        lf = (
+            lf.with_columns(log_scale.alias("_log"))
+            .sort(["_log", "_rank"], descending=[True, False])
+            .with_columns(
+                (pl.col("_log").shift(1) - pl.col("_log") > CLUSTER_GAP).fill_null(False).cum_sum().alias("_part")
+            )
+        )
+
+    # Новая группа - при смене части или каждые size рядов внутри нее
+    # (строки отсортированы по части, номер - накопленная сумма начал)
+    position = pl.int_range(pl.len()).over("_part")
+    is_start = pl.col("_part").ne_missing(pl.col("_part").shift(1)) | (position % size == 0)
+    return lf.select([
+        pl.col(by),
+        (is_start.cum_sum().cast(pl.Int64) - 1 + first_group).alias("group_num"),
+    ])
+
+def chart_frame(lf, groups, by="item_id", value_col="y", group_col="group_num"):
+    """LazyFrame date, value, by (String), group_col: непустые точки рядов
+    lf с номерами групп groups, по группам, рядам и времени"""
+    return (
+        lf.lazy()
+        .filter(pl.col(value_col).is_not_null())
+        .join(groups.lazy(), on=by, how="inner")
+        .sort([group_col, by, "date"])
+        .select([
+            pl.col("date"),
+            pl.col(value_col).alias("value"),
+            pl.col(by).cast(pl.String),
+            pl.col(group_col),
+        ])
+    )
+
+# %%
+# Диапазоны оси y
+
+def group_domains(lf, group_col="group_num", value_col="value", padding=DOMAIN_PADDING):
+    """LazyFrame group_col, y_min, y_max: общий диапазон оси y каждой группы.
+
+    Диапазон - от минимума до максимума значений рядов группы с запасом
+    padding; у постоянных рядов запас считается от модуля значения.
+    NaN и бесконечности не учитываются: группа только из них в результат
+    не попадает.
+    """
+    spread = pl.col("y_max") - pl.col("y_min")
+    pad = (
+        pl.when(spread > 0).then(spread)
+        .when(pl.col("y_max").abs() > 0).then(pl.col("y_max").abs())
+        .otherwise(1.0)
+        * padding
+    )
+    return (
+        lf.drop_nulls(value_col)
+        .filter(pl.col(value_col).is_finite())
+        .group_by(group_col)
+        .agg([
+            pl.col(value_col).min().alias("y_min"),
+            pl.col(value_col).max().alias("y_max"),
+        ])
+        .with_columns([
+            (pl.col("y_min") - pad).alias("y_min"),
+            (pl.col("y_max") + pad).alias("y_max"),
+        ])
+        .sort(group_col)
+    )
+
+def _is_finite(value):
+    return value is not None and math.isfinite(value)
+
+def domain_expr(domains, group_param, group_col="group_num"):
+    """alt.ExprRef для scale.domain: диапазон группы, выбранной group_param.
+
+    domains - результат group_domains (DataFrame). Группа без конечного
+    диапазона (нет в domains или NaN/бесконечность в границах) получает
+    общий диапазон всех групп; если конечных диапазонов нет совсем -
+    alt.Undefined (автоматический домен Vega-Lite).
+    """
+    bounds = {
+        group: [lo, hi]
+        for group, lo, hi in domains.select([group_col, "y_min", "y_max"]).iter_rows()
+        if _is_finite(lo) and _is_finite(hi)
+    }
+    if not bounds:
+        return alt.Undefined
+    first_group, last_group = min(bounds), max(bounds)
+    ranges = [bounds.get(group) for group in range(first_group, last_group + 1)]  # пропуски - null
+    overall = [min(lo for lo, _ in bounds.values()), max(hi for _, hi in bounds.values())]
+    # Индекс вне массива дает undefined, null - тоже ложь: в обоих случаях общий диапазон
+    return alt.ExprRef(
+        f"{json.dumps(ranges, allow_nan=False)}[{group_param.name} - {first_group}]"
+        f" || {json.dumps(overall, allow_nan=False)}"
+    )
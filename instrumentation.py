@@ -0,0 +1,157 @@
+# %%
+# Замеры этапов скриптов: время, CPU, пик RSS, строки на входе/выходе и
+# планы запросов Polars.
+#
+# Включается переменной окружения VIZTZ_PROFILE:
+#   VIZTZ_PROFILE=1 python tz.py             -> profile/tz.json + таблица
+#   VIZTZ_PROFILE=run.json python tz.py      -> run.json + таблица
+# В ноутбуке отчет можно вывести вызовом report().
+#
+# CPU и RSS считаются для текущего процесса, воркеры пулов в них не входят.
+# Выключенный stage() возвращает общий пустой объект: ни замеров, ни
+# подсчета строк, ни построения планов. Поэтому в rows_in/rows_out можно
+# передавать LazyFrame (например, scan записанного результата): запрос для
+# подсчета строк выполняется только при включенных замерах.
+import atexit
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import polars as pl
+
+PROFILE_ENV = "VIZTZ_PROFILE"
+PROFILE_DIR = "profile"
+
+ENABLED = os.environ.get(PROFILE_ENV, "") not in ("", "0")
+
+_records = []
+_started = time.perf_counter()
+
+def _max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux: КБ
+
+def _count(data):
+    """Число строк; LazyFrame считается отдельным запросом pl.len() - только
+    при включенных замерах (выключенный stage его не вызывает)"""
+    if isinstance(data, int):
+        return data
+    if isinstance(data, pl.LazyFrame):
+        return data.select(pl.len()).collect().item()
+    return len(data)
+
+# %%
+# Этапы
+
+class _Stage:
+    def __init__(self, name):
+        self.record = {'stage': name, 'rows_in': None, 'rows_out': None, 'plans': []}
+
+    def __enter__(self):
+        self._rss = _max_rss_mb()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record.update({
+            'wall_s': round(time.perf_counter() - self._wall, 4),
+            'cpu_s': round(time.process_time() - self._cpu, 4),
+            'peak_rss_mb': round(_max_rss_mb(), 1),
+            'rss_growth_mb': round(_max_rss_mb() - self._rss, 1),
+            'failed': exc_type is not None,
+        })
+        _records.append(self.record)
+        return False
+
+    def rows_in(self, data):
+        self.record['rows_in'] = _count(data)
+
+    def rows_out(self, data):
+        self.record['rows_out'] = _count(data)
+
+    def plan(self, lf):
+        """Сохраняет оптимизированный план LazyFrame"""
+        self.record['plans'].append(lf.explain())
+
+    def note(self, **values):
+        self.record.update(values)
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def rows_in(self, data):
+        pass
+
+    def rows_out(self, data):
+        pass
+
+    def plan(self, lf):
+        pass
+
+    def note(self, **values):
+        pass
+
+_NOOP = _NoopStage()
+
+def stage(name):
+    """Контекст замера этапа name (пустой, если замеры выключены)"""
+    return _Stage(name) if ENABLED else _NOOP
+
+def profile_chart_spec(chart, name="chart_spec"):
+    """Замер сериализации графика в JSON (только при включенных замерах)"""
+    if not ENABLED:
+        return
+    with stage(name) as s:
+        s.note(spec_bytes=len(chart.to_json()))
+
+# %%
+# Отчет
+
+def _script_name():
+    main = sys.modules.get('__main__')
+    path = getattr(main, '__file__', None) or sys.argv[0]
+    return Path(path).stem if path else "session"
+
+def print_table(records):
+    print(f"\n{'этап':<22}{'стена, с':>10}{'CPU, с':>10}{'пик RSS, МБ':>14}{'прирост, МБ':>14}{'строк на входе':>16}{'на выходе':>12}")
+    for r in records:
+        rows_in = "-" if r['rows_in'] is None else r['rows_in']
+        rows_out = "-" if r['rows_out'] is None else r['rows_out']
+        print(f"{r['stage']:<22}{r['wall_s']:>10.3f}{r['cpu_s']:>10.3f}{r['peak_rss_mb']:>14.1f}"
+              f"{r['rss_growth_mb']:>14.1f}{rows_in:>16}{rows_out:>12}")
+
+def report(path=None):
+    """Печатает таблицу этапов и пишет отчет в JSON; возвращает отчет"""
+    setting = os.environ.get(PROFILE_ENV, "")
+    if path is None:
+        path = setting if setting not in ("", "0", "1") else f"{PROFILE_DIR}/{_script_name()}.json"
+
+    result = {
+        'script': _script_name(),
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'total_wall_s': round(time.perf_counter() - _started, 4),
+        'peak_rss_mb': round(_max_rss_mb(), 1),
+        'polars': pl.__version__,
+        'stages': list(_records),
+    }
+    print_table(_records)
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Отчет о замерах: {path}")
+    return result
+
+# Воркеры пулов (spawn) заново импортируют скрипт - отчет пишет только
+# основной процесс
+if ENABLED and multiprocessing.parent_process() is None:
+    atexit.register(report)
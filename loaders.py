@@ -0,0 +1,114 @@
+# %%
+# Общий загрузчик данных для скриптов.
+#
+# Все функции возвращают LazyFrame со схемой хранилища (id UInt64,
+# date Datetime(UTC), value Float64), переименование колонок остается в
+# скриптах. Два уровня кэша:
+#   - на диске (disk_cache=True): Parquet-хранилище columnar_store, CSV
+#     разбирается один раз после изменения;
+#   - в процессе (только с VIZTZ_MEMO=1): собранный DataFrame небольших
+#     наборов (series_*.csv, normalized) запоминается по пути, mtime и
+#     размеру источников, поэтому повторный запуск ячейки не читает их
+#     заново. Изменение файла меняет ключ. Collected данные не запоминаются
+#     никогда: это ленивый scan хранилища, фильтры по id и дате должны
+#     доходить до партиций, а весь набор в память не помещается.
+import glob
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import polars as pl
+
+from columnar_store import (
+    COLLECTED_CSV,
+    STORE_DIR,
+    empty_store_frame,
+    scan_collected,
+    scan_dataset,
+    scan_series_file,
+    to_store_schema,
+)
+
+NORMALIZED_DIR = "data/normalized"
+SERIES_FILES = "data/series_*.csv"
+
+MEMO = os.environ.get("VIZTZ_MEMO", "") not in ("", "0")
+MEMO_MAX_BYTES = 2 << 30  # суммарный размер запомненных фреймов; фрейм больше не запоминается
+
+_memo = OrderedDict()
+
+# %%
+# Кэш в процессе
+
+def _fingerprint(paths):
+    """Путь, mtime и размер каждого файла"""
+    result = []
+    for path in sorted(map(str, paths)):
+        stat = os.stat(path)
+        result.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(result)
+
+def _memoized(key, build):
+    """LazyFrame поверх собранного один раз на key результата build()"""
+    if not MEMO:
+        return build()
+
+    if key in _memo:
+        _memo.move_to_end(key)
+        return _memo[key].lazy()
+
+    df = build().collect()
+    if df.estimated_size() > MEMO_MAX_BYTES:
+        return df.lazy()  # один фрейм больше всего кэша: не вытесняем ради него остальные
+    _memo[key] = df
+    while sum(d.estimated_size() for d in _memo.values()) > MEMO_MAX_BYTES:
+        _memo.popitem(last=False)  # вытесняем давно не использованные
+    return df.lazy()
+
+def clear_cache():
+    """Сбрасывает кэш в процессе"""
+    _memo.clear()
+
+def _dataset_files(dataset_dir):
+    return list(Path(dataset_dir).glob("id=*/month=*/*.parquet"))
+
+def _read_csv(csv_path, id_col='id', date_col='date', value_col='value'):
+    raw = pl.scan_csv(
+        csv_path,
+        schema_overrides={id_col: pl.String, date_col: pl.String, value_col: pl.String},
+    )
+    return to_store_schema(raw, id_col, date_col, value_col)
+
+# %%
+# Наборы данных
+
+def load_collected(csv_path=COLLECTED_CSV, disk_cache=True, dataset_dir=f"{STORE_DIR}/collected"):
+    """Collected данные (data/raw/collected.csv), всегда ленивым scan без
+    кэша в процессе: фильтры по id (sink_daily_chunks) доходят до партиций"""
+    if not disk_cache:
+        return _read_csv(csv_path, 'item_id', 'collected', 'property_value')
+    return scan_collected(csv_path, dataset_dir)
+
+def load_series_files(paths=None, disk_cache=True):
+    """Файлы data/series_*.csv одним LazyFrame (paths - список файлов или маска)"""
+    if paths is None or isinstance(paths, str):
+        paths = glob.glob(paths or SERIES_FILES)
+    if not paths:
+        return empty_store_frame()
+
+    def build():
+        scan = scan_series_file if disk_cache else _read_csv
+        return pl.concat([scan(path) for path in sorted(paths)])
+
+    return _memoized(('series_files', _fingerprint(paths), disk_cache), build)
+
+def load_normalized(disk_cache=True, normalized_dir=NORMALIZED_DIR, dataset_dir=f"{STORE_DIR}/normalized"):
+    """Нормализованные ряды (пишет normalize_monitoring_data.py)"""
+    if disk_cache:
+        files = _dataset_files(dataset_dir)
+        return _memoized(('normalized', _fingerprint(files)), lambda: scan_dataset(dataset_dir))
+
+    files = glob.glob(f"{normalized_dir}/*.csv")
+    if not files:
+        return empty_store_frame()
+    return _memoized(('normalized_csv', _fingerprint(files)), lambda: pl.concat([_read_csv(f) for f in files]))
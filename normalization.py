@@ -0,0 +1,287 @@
+# %%
+# Нормализация выгрузок мониторинга: разбор файлов по реестру форматов
+# (source_formats.toml) и инкрементальный прогон по манифесту (хэш, размер и
+# mtime каждого источника).
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import polars as pl
+
+from columnar_store import STORE_DIR, has_series, replace_series, timestamp_expr, to_store_schema
+from instrumentation import stage
+from pyramid import replace_in_pyramid
+from sketches import replace_in_sketches
+from series_index import index_path, replace_in_series_index
+from source_formats import collect_sources, compile_source, load_formats, match_format
+
+MANIFEST_NAME = ".manifest.json"
+
+# %%
+# Разбор файлов (форматы - source_formats.toml)
+
+def _outputs(frames):
+    """Пары (имя выходного файла, DataFrame) для непустых рядов одного файла"""
+    outputs = []
+    for i, norm_df in enumerate(df for df in frames if df.height > 0):
+        series_id = norm_df['id'][0]
+        output_filename = f"series_{series_id}.csv"
+        if i > 0:  # Если несколько серий из одного файла
+            output_filename = f"series_{series_id}_{i}.csv"
+        outputs.append((output_filename, norm_df))
+    return outputs
+
+def _plans(file_paths, formats):
+    """Планы разбора {файл: [(номер ряда, LazyFrame), ...]}; файлы без формата - пустой план"""
+    plans = {}
+    for file_path in file_paths:
+        fmt = match_format(os.path.basename(file_path), formats)
+        plans[file_path] = [] if fmt is None else compile_source(file_path, fmt)
+    return plans
+
+def normalize_files(file_paths, formats=None):
+    """Нормализует файлы одним collect_all в формат id,date,value.
+
+    Возвращает (результаты {файл: [(имя выходного файла, DataFrame), ...]},
+    ошибки {файл: исключение}). Ничего не пишет на диск.
+    """
+    formats = load_formats() if formats is None else formats
+    results, errors = collect_sources(_plans(file_paths, formats))
+    return {file_path: _outputs(frames) for file_path, frames in results.items()}, errors
+
+def normalize_file(file_path, data=None, formats=None):
+    """Нормализует один файл в формат id,date,value.
+
+    data - содержимое (bytes) вместо чтения file_path, например заголовок и
+    дописанные строки (см. tail_follow); формат определяется по имени файла.
+    Возвращает список пар (имя выходного файла, DataFrame). Ничего не пишет
+    на диск, ошибки разбора пробрасываются вызывающему.
+    """
+    formats = load_formats() if formats is None else formats
+    fmt = match_format(os.path.basename(file_path), formats)
+    if fmt is None:
+        return []
+    return _outputs(pl.collect_all([lf for _, lf in compile_source(file_path, fmt, data)]))
+
+def write_csv_atomic(df, output_path):
+    """Пишет CSV через временный файл и os.replace, чтобы читатели не видели половину файла"""
+    output_path = Path(output_path)
+    tmp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.tmp")
+    try:
+        df.write_csv(tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+# %%
+# Манифест источников
+
+def file_sha256(file_path, chunk_size=1 << 20):
+    """SHA-256 содержимого файла, читается блоками"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_header(file_path):
+    """Первая строка файла (bytes, с переводом строки)"""
+    with open(file_path, 'rb') as f:
+        return f.readline()
+
+def line_end_offset(file_path, size, block_size=1 << 16):
+    """Смещение конца последней полной строки среди первых size байт"""
+    with open(file_path, 'rb') as f:
+        start = max(0, size - block_size)
+        while True:
+            f.seek(start)
+            pos = f.read(size - start).rfind(b'\n')
+            if pos >= 0:
+                return start + pos + 1
+            if start == 0:
+                return 0
+            start = max(0, start - block_size)
+
+def follow_state(file_path, offset, outputs):
+    """Поля записи манифеста для дочитывания источника (см. tail_follow).
+
+    offset - сколько байт источника разобрано; last_ts и rows - последняя
+    отметка времени и число строк каждого выходного ряда.
+    """
+    last_ts = {}
+    rows = {}
+    for _, norm_df in outputs:
+        series_id = str(norm_df['id'][0])
+        ts = norm_df.select(timestamp_expr(norm_df.lazy(), 'date').max()).item()
+        last_ts[series_id] = ts.isoformat() if ts is not None else None
+        rows[series_id] = norm_df.height
+    return {
+        'offset': offset,
+        'header_sha256': hashlib.sha256(read_header(file_path)).hexdigest(),
+        'last_ts': last_ts,
+        'rows': rows,
+    }
+
+def load_manifest(manifest_path):
+    """Читает манифест; отсутствующий или битый файл - пустой манифест"""
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_manifest(manifest, manifest_path):
+    """Атомарно сохраняет манифест"""
+    manifest_path = Path(manifest_path)
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def is_unchanged(file_path, entry, output_dir, store_dir):
+    """Проверяет источник по манифесту.
+
+    Если совпадают размер и mtime - файл не читается. Иначе сравнивается
+    хэш содержимого (например, после touch или повторного копирования).
+    Возвращает (не изменился, отпечаток источника).
+    """
+    stat = os.stat(file_path)
+    fingerprint = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    outputs_exist = entry is not None and all(
+        os.path.exists(os.path.join(output_dir, name)) for name in entry.get('outputs', [])
+    ) and all(
+        has_series(store_dir, series_id) for series_id in entry.get('ids', [])
+    )
+    if not outputs_exist:
+        return False, fingerprint
+
+    if entry['size'] == fingerprint['size'] and entry['mtime_ns'] == fingerprint['mtime_ns']:
+        fingerprint['sha256'] = entry['sha256']
+        return True, fingerprint
+
+    fingerprint['sha256'] = file_sha256(file_path)
+    return fingerprint['sha256'] == entry['sha256'], fingerprint
+
+def output_keys(outputs):
+    """Что пишет источник по списку пар (имя выходного файла, DataFrame):
+    множество ('file', имя) и ('id', номер ряда)"""
+    return {('file', name) for name, _ in outputs} | {('id', int(norm_df['id'][0])) for _, norm_df in outputs}
+
+def entry_keys(entry):
+    """То же по записи манифеста (поля outputs и ids)"""
+    entry = entry or {}
+    return {('file', name) for name in entry.get('outputs', [])} | {('id', i) for i in entry.get('ids', [])}
+
+def shared_keys(manifest):
+    """Выходные файлы и ряды, которые по манифесту пишут несколько источников"""
+    seen = set()
+    shared = set()
+    for entry in manifest.values():
+        keys = entry_keys(entry)
+        shared |= seen & keys
+        seen |= keys
+    return shared
+
+# %%
+# Прогон по всем источникам
+
+def run_normalization(input_files, output_dir, manifest_path=None, store_dir=f"{STORE_DIR}/normalized"):
+    """Нормализует изменившиеся источники одним запросом (normalize_files).
+
+    Неизменившиеся по манифесту файлы пропускаются. Если изменившийся
+    источник пишет тот же выходной файл или ряд, что и другой источник
+    манифеста, тот разбирается заново вместе с ним (и так далее по цепочке).
+    Результаты пишутся атомарно в порядке сортировки имен источников,
+    поэтому при совпадении имен выходных файлов и рядов побеждает тот же
+    источник, что и при полном прогоне. Упавшие источники не попадают в манифест и
+    будут повторены при следующем запуске. Кроме CSV ряды пишутся в
+    колоночное хранилище store_dir (см. columnar_store) и индекс рядов
+    "normalized" (см. series_index).
+
+    Возвращает словарь со списками 'skipped', 'processed' и 'failed'.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    if not index_path('normalized').exists():
+        manifest = {}  # индекс рядов еще не построен - обрабатываем все заново
+
+    report = {'skipped': [], 'processed': [], 'failed': []}
+    started = time.perf_counter()
+
+    pending = {}
+    for file_path in sorted(input_files):
+        unchanged, fingerprint = is_unchanged(file_path, manifest.get(file_path), output_dir, store_dir)
+        if unchanged:
+            manifest[file_path].update(fingerprint)
+            report['skipped'].append(file_path)
+        else:
+            pending[file_path] = fingerprint
+
+    # Все изменившиеся источники - один collect_all (потоки Polars). Источники
+    # с общими выходами разбираются следующим collect_all, пока такие есть
+    with stage("normalize_parse") as s:
+        s.rows_in(len(pending))
+        results, errors = {}, {}
+        to_parse = list(pending)
+        while to_parse:
+            parsed, failed = normalize_files(to_parse)
+            results.update(parsed)
+            errors.update(failed)
+            keys = set().union(
+                *(output_keys(outputs) for outputs in parsed.values()),
+                *(entry_keys(manifest.get(file_path)) for file_path in to_parse),
+            )
+            to_parse = sorted(
+                file_path for file_path, entry in manifest.items()
+                if file_path not in pending and os.path.exists(file_path) and entry_keys(entry) & keys
+            )
+            for file_path in to_parse:
+                stat = os.stat(file_path)
+                pending[file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+                if file_path in report['skipped']:
+                    report['skipped'].remove(file_path)
+        s.rows_out(sum(norm_df.height for outputs in results.values() for _, norm_df in outputs))
+
+    # Запись результатов, хранилища и индекса
+    with stage("normalize_write"):
+        for file_path, fingerprint in sorted(pending.items()):
+            filename = os.path.basename(file_path)
+            print(f"Обрабатываем: {filename}")
+
+            if file_path in errors:
+                print(f"  -> Ошибка обработки {filename}: {errors[file_path]}")
+                manifest.pop(file_path, None)
+                report['failed'].append(file_path)
+                continue
+
+            for output_filename, norm_df in results[file_path]:
+                output_path = os.path.join(output_dir, output_filename)
+                write_csv_atomic(norm_df, output_path)
+                store_df = to_store_schema(norm_df.lazy()).collect()
+                replace_series(store_df, store_dir)
+                replace_in_series_index('normalized', store_df.lazy(), source=output_path)
+                replace_in_pyramid('normalized', store_df)
+                replace_in_sketches('normalized', store_df)
+                print(f"  -> Сохранено: {output_filename} ({norm_df.height} строк)")
+
+            if 'sha256' not in fingerprint:
+                fingerprint['sha256'] = file_sha256(file_path)
+            manifest[file_path] = {
+                **fingerprint,
+                **follow_state(file_path, line_end_offset(file_path, fingerprint['size']), results[file_path]),
+                'outputs': [name for name, _ in results[file_path]],
+                'ids': [int(norm_df['id'][0]) for _, norm_df in results[file_path]],
+            }
+            report['processed'].append(file_path)
+
+    save_manifest(manifest, manifest_path)
+
+    print(
+        f"\nПропущено: {len(report['skipped'])}, обработано: {len(report['processed'])}, "
+        f"ошибок: {len(report['failed'])} за {time.perf_counter() - started:.2f} с"
+    )
+    return report
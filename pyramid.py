@@ -0,0 +1,272 @@
+# %%
+# Пирамида агрегатов для графиков с масштабированием.
+#
+# Для каждого датасета хранилища (collected, normalized) заранее считаются
+# агрегаты по окнам 1h, 1d, 1w, 1mo: min, median, max, count. Каждый
+# уровень - отдельный датасет с партициями id=/month= (по началу окна):
+#   data/store/pyramid/<датасет>/<уровень>/id=<id>/month=<YYYY-MM>/*.parquet
+# Уровень raw - сам датасет хранилища.
+#
+# График получает несколько уровней сразу (колонка level) и показывает
+# самый грубый уровень, окна которого еще заполняют видимую ширину в
+# пикселях (level_filter_expr): при отдалении браузер рисует месячные
+# агрегаты, при приближении - все более подробные. Число строк всех уровней
+# ограничено EMBED_MAX_ROWS (оценка по индексу рядов, chart_levels с
+# summary): подробные уровни отбрасываются первыми, и глубина приближения
+# тем меньше, чем больше рядов на графике.
+#
+# Обновление инкрементальное: для новых строк пересчитываются только
+# затронутые месяцы затронутых рядов (append_to_pyramid,
+# replace_in_pyramid - вызываются рядом с записью в хранилище).
+import os
+import shutil
+from datetime import timedelta
+from pathlib import Path
+
+import polars as pl
+
+from columnar_store import SOURCE_MARKER, STORE_DIR, _sink_partitioned, rebuild_dataset, scan_dataset
+
+PYRAMID_DIR = f"{STORE_DIR}/pyramid"
+
+# Уровни от подробного к грубому и длительность окна (месяц - примерно)
+LEVELS = {
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1),
+    '1w': timedelta(weeks=1),
+    '1mo': timedelta(days=30),
+}
+RAW = "raw"
+
+PYRAMID_SCHEMA = {
+    'id': pl.UInt64,
+    'date': pl.Datetime('us', 'UTC'),
+    'min': pl.Float64,
+    'median': pl.Float64,
+    'max': pl.Float64,
+    'count': pl.UInt32,
+}
+
+POINTS_PER_PIXEL = 0.5  # уровень "заполняет" ширину, если окон не меньше width * POINTS_PER_PIXEL
+MAX_ZOOM = 8            # во сколько раз можно приблизить график без потери подробности
+EMBED_MAX_ROWS = 200_000  # строк всех уровней на все ряды в данных одного графика
+
+# %%
+# Агрегаты
+
+def rollup(lf, level):
+    """LazyFrame агрегатов уровня level по LazyFrame со схемой хранилища"""
+    return (
+        lf.drop_nulls('value')
+        .group_by(['id', pl.col('date').dt.truncate(level)])
+        .agg([
+            pl.col('value').min().alias('min'),
+            pl.col('value').median().alias('median'),
+            pl.col('value').max().alias('max'),
+            pl.len().cast(pl.UInt32).alias('count'),
+        ])
+    )
+
+def _dataset_dir(name):
+    return Path(STORE_DIR) / name
+
+def level_dir(name, level):
+    return Path(PYRAMID_DIR) / name / level
+
+def _marker(name):
+    try:
+        return (_dataset_dir(name) / SOURCE_MARKER).read_text(encoding='utf-8')
+    except FileNotFoundError:
+        return None
+
+# %%
+# Построение и обновление
+
+def build_pyramid(name):
+    """Пересчитывает все уровни пирамиды датасета name целиком"""
+    raw = scan_dataset(_dataset_dir(name))
+    for level in LEVELS:
+        rebuild_dataset(rollup(raw, level), level_dir(name, level))
+
+    marker = _marker(name)
+    pyramid_dir = Path(PYRAMID_DIR) / name
+    if marker is not None:
+        (pyramid_dir / SOURCE_MARKER).write_text(marker, encoding='utf-8')
+    else:
+        (pyramid_dir / SOURCE_MARKER).unlink(missing_ok=True)
+
+def has_pyramid(name):
+    return all(level_dir(name, level).is_dir() for level in LEVELS)
+
+def ensure_pyramid(name):
+    """Строит пирамиду, если ее нет или датасет пересобран из другого источника"""
+    pyramid_dir = Path(PYRAMID_DIR) / name
+    try:
+        marker = (pyramid_dir / SOURCE_MARKER).read_text(encoding='utf-8')
+    except FileNotFoundError:
+        marker = None
+    if not has_pyramid(name) or marker != _marker(name):
+        build_pyramid(name)
+
+def _since(df):
+    """Для каждого id - начало первого месяца, агрегаты которого надо пересчитать.
+
+    Неделя, в которую попала первая новая строка, может начинаться в
+    предыдущем месяце, поэтому граница сдвигается на начало ее месяца.
+    """
+    start = pl.col('date').min().dt.truncate('1mo')
+    return df.lazy().group_by('id').agg(
+        start.dt.truncate('1w').dt.truncate('1mo').alias('since')
+    )
+
+def _replace_months(lf, target_dir, since):
+    """Заменяет партиции id=/month= начиная с месяца since каждого id"""
+    target_dir = Path(target_dir)
+    tmp_dir = target_dir / f".update.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    _sink_partitioned(lf, tmp_dir)
+
+    for series_id, first_month in since.select(['id', pl.col('since').dt.strftime('%Y-%m')]).iter_rows():
+        id_dir = target_dir / f"id={series_id}"
+        new_dir = tmp_dir / f"id={series_id}"
+        for month_dir in list(id_dir.glob("month=*")):
+            if month_dir.name.removeprefix("month=") >= first_month:
+                shutil.rmtree(month_dir)
+        if new_dir.is_dir():
+            id_dir.mkdir(parents=True, exist_ok=True)
+            for month_dir in new_dir.iterdir():
+                os.replace(month_dir, id_dir / month_dir.name)
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def _update(name, since):
+    """Пересчитывает агрегаты рядов since начиная с месяца since каждого id"""
+    raw = (
+        scan_dataset(_dataset_dir(name))
+        .join(since.lazy(), on='id', how='inner')
+        .filter(pl.col('date') >= pl.col('since'))
+        .drop('since')
+    )
+    for level in LEVELS:
+        # Неделя на границе может начинаться раньше since - она не пересчитывается
+        buckets = (
+            rollup(raw, level)
+            .join(since.lazy(), on='id', how='inner')
+            .filter(pl.col('date') >= pl.col('since'))
+            .drop('since')
+        )
+        _replace_months(buckets, level_dir(name, level), since)
+
+def append_to_pyramid(name, df):
+    """Пересчитывает агрегаты, затронутые строками df (уже записанными в хранилище).
+
+    Ничего не делает, если пирамида датасета еще не построена.
+    """
+    if df.height == 0 or not has_pyramid(name):
+        return
+    _update(name, _since(df).collect())
+
+def replace_in_pyramid(name, df):
+    """Пересчитывает все агрегаты рядов df (ряд в хранилище заменен целиком)"""
+    if df.height == 0 or not has_pyramid(name):
+        return
+    ids = df['id'].unique()
+    for level in LEVELS:
+        for series_id in ids:
+            shutil.rmtree(level_dir(name, level) / f"id={series_id}", ignore_errors=True)
+    stored = scan_dataset(_dataset_dir(name)).filter(pl.col('id').is_in(ids.implode()))
+    _update(name, _since(stored).collect())
+
+# %%
+# Чтение
+
+def scan_level(name, level):
+    """LazyFrame уровня level (или raw) со схемой PYRAMID_SCHEMA"""
+    if level == RAW:
+        return scan_dataset(_dataset_dir(name)).drop_nulls('value').select([
+            'id', 'date',
+            pl.col('value').alias('min'),
+            pl.col('value').alias('median'),
+            pl.col('value').alias('max'),
+            pl.lit(1, dtype=pl.UInt32).alias('count'),
+        ])
+    return scan_dataset(level_dir(name, level), schema=PYRAMID_SCHEMA)
+
+def pick_level(span, width, points_per_pixel=POINTS_PER_PIXEL):
+    """Самый грубый уровень, окна которого заполняют width пикселей на отрезке span"""
+    max_bucket = span / (width * points_per_pixel)
+    fitting = [level for level, bucket in LEVELS.items() if bucket <= max_bucket]
+    return fitting[-1] if fitting else RAW
+
+def levels_between(coarsest, finest):
+    """Уровни от finest до coarsest включительно (raw - самый подробный)"""
+    order = [RAW, *LEVELS]
+    return order[order.index(finest):order.index(coarsest) + 1]
+
+def level_rows(summary, level):
+    """Оценка сверху числа строк уровня level по сводке рядов (series_summary):
+    не больше точек ряда и не больше окон между первой и последней точкой"""
+    if level == RAW:
+        return summary['n_points'].sum()
+    span = pl.col('last_ts') - pl.col('first_ts')
+    windows = span.dt.total_microseconds() // int(LEVELS[level].total_seconds() * 1_000_000) + 1
+    return summary.select(pl.min_horizontal(pl.col('n_points'), windows).sum()).item()
+
+def chart_levels(span, width, max_zoom=MAX_ZOOM, points_per_pixel=POINTS_PER_PIXEL, summary=None,
+                 max_rows=EMBED_MAX_ROWS):
+    """Уровни для графика шириной width: от полного вида span до приближения в max_zoom раз.
+
+    summary - сводка показываемых рядов (series_summary): уровни от грубого
+    к подробному берутся, пока их строк вместе не больше max_rows. Если не
+    помещается и уровень полного вида, берется самый подробный из более
+    грубых, который помещается (или самый грубый).
+    """
+    levels = levels_between(
+        pick_level(span, width, points_per_pixel),
+        pick_level(span / max_zoom, width, points_per_pixel),
+    )
+    if summary is None:
+        return levels
+
+    kept = []
+    total = 0
+    for level in reversed(levels):
+        total += level_rows(summary, level)
+        if total > max_rows:
+            break
+        kept.insert(0, level)
+    if kept:
+        return kept
+    order = [RAW, *LEVELS]
+    coarser = order[order.index(levels[-1]) + 1:]
+    return [next((level for level in coarser if level_rows(summary, level) <= max_rows), order[-1])]
+
+def multires_frame(name, ids, levels):
+    """Агрегаты рядов ids датасета name на уровнях levels (см. chart_levels).
+
+    Колонки: id, date, value (медиана окна), min, max, count, level.
+    """
+    frames = pl.collect_all([
+        scan_level(name, level).filter(pl.col('id').is_in(ids)).with_columns(pl.lit(level).alias('level'))
+        for level in levels
+    ])
+    return pl.concat(frames).select([
+        'id', 'date', pl.col('median').alias('value'), 'min', 'max', 'count', 'level',
+    ])
+
+def level_filter_expr(zoom_param, levels, width, full_span, field='date', points_per_pixel=POINTS_PER_PIXEL):
+    """Vega-выражение: datum.level совпадает с уровнем для видимого отрезка.
+
+    zoom_param - selection_interval(bind='scales') по оси x; пока график не
+    масштабировали, берется full_span (timedelta). levels - уровни в данных.
+    """
+    span = (
+        f"(isValid({zoom_param.name}.{field}) ? "
+        f"(+{zoom_param.name}.{field}[1] - +{zoom_param.name}.{field}[0]) : {full_span.total_seconds() * 1000})"
+    )
+    # От грубого к подробному: первый уровень, окна которого заполняют ширину
+    ordered = sorted(levels, key=[RAW, *LEVELS].index)
+    choice = f"'{ordered[0]}'"
+    for level in ordered[1:]:
+        threshold_ms = LEVELS[level].total_seconds() * 1000 * width * points_per_pixel
+        choice = f"({span} >= {threshold_ms} ? '{level}' : {choice})"
+    return f"datum.level == {choice}"
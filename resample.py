@@ -0,0 +1,75 @@
+# %%
+# Потоковое ресемплирование по дням: медиана за день + пропущенные дни как null.
+#
+# Дает тот же результат, что group_by_dynamic(every="1d").agg(median)
+# с последующим upsample, но строится из операций, которые поддерживает
+# потоковый движок Polars (truncate + group_by + join), поэтому сырые данные
+# не нужно целиком держать в памяти.
+from pathlib import Path
+
+import polars as pl
+
+# %%
+# Ресемплирование
+
+def fill_missing(daily, every="1d", date_col="date", by="item_id", value_col="y"):
+    """Добавляет окна every без данных внутри диапазона каждого ряда (null),
+    как upsample. Результат отсортирован по (by, date_col)."""
+    # Полная сетка дней от первого до последнего окна каждого ряда
+    grid = (
+        daily.group_by(by)
+        .agg(pl.datetime_ranges(pl.col(date_col).min(), pl.col(date_col).max(), every))
+        .explode(date_col)
+    )
+
+    return (
+        grid.join(daily, on=[by, date_col], how="left")
+        .select([date_col, by, value_col])
+        .sort([by, date_col])
+    )
+
+def resample_daily(lf, every="1d", date_col="date", by="item_id", value_col="y"):
+    """LazyFrame с медианой value_col по окнам every для каждого by.
+
+    Дни без данных внутри диапазона ряда добавляются с null, как у
+    upsample. Результат отсортирован по (by, date_col).
+    """
+    daily = (
+        lf.group_by([by, pl.col(date_col).dt.truncate(every)])
+        .agg(pl.col(value_col).median())
+    )
+    return fill_missing(daily, every, date_col, by, value_col)
+
+def collect_daily(lf, **kwargs):
+    """resample_daily + collect потоковым движком (вход целиком в одной части)"""
+    return resample_daily(lf, **kwargs).collect(engine="streaming")
+
+# %%
+# Обработка частями по item_id
+
+def sink_daily_chunks(lf, output_dir, n_chunks=16, by="item_id", **kwargs):
+    """Ресемплирует вход частями по диапазонам by и пишет part-XXXX.parquet.
+
+    Медиана требует всех значений окна, поэтому даже потоковый движок
+    держит в памяти сырые данные всех групп сразу. Здесь вход режется на
+    n_chunks диапазонов item_id: фильтр is_between проталкивается в scan_*
+    (партиции id= хранилища и статистики row group), так что пиковая память
+    определяется размером одной части, а не всего входа.
+
+    Возвращает LazyFrame поверх записанных частей; порядок (by, date)
+    сохраняется внутри каждой части, части идут по возрастанию by.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for stale in output_dir.glob("part-*.parquet"):
+        stale.unlink()
+
+    ids = lf.select(pl.col(by).unique().sort()).collect(engine="streaming")[by]
+    chunk_size = max(1, -(-len(ids) // n_chunks))
+
+    for chunk, start in enumerate(range(0, len(ids), chunk_size)):
+        bounds = ids[start:start + chunk_size]
+        part = lf.filter(pl.col(by).is_between(bounds[0], bounds[-1]))
+        resample_daily(part, by=by, **kwargs).sink_parquet(output_dir / f"part-{chunk:04d}.parquet")
+
+    return pl.scan_parquet(output_dir / "part-*.parquet")
@@ -0,0 +1,138 @@
+# %%
+# Индекс рядов: сводка по каждому ряду без сканирования сырых данных.
+#
+# На диске хранится дневная таблица data/store/index/<датасет>.parquet:
+# строка на (id, день) с числом точек, первой/последней отметкой времени,
+# min/max/последним значением, исходным файлом и номером строки, с которой
+# ряд начинается в этом файле. Дневная гранулярность нужна, чтобы точно
+# считать число заполненных дней и обновлять индекс порциями: новые строки
+# сворачиваются в дни и сливаются с уже сохраненными.
+#
+# Сводка по ряду (series_summary) - агрегат дневной таблицы, она на порядки
+# меньше сырых данных.
+import os
+from pathlib import Path
+
+import polars as pl
+
+INDEX_DIR = "data/store/index"
+
+DAY_SCHEMA = {
+    'id': pl.UInt64,
+    'day': pl.Date,
+    'n_points': pl.UInt32,
+    'first_ts': pl.Datetime('us', 'UTC'),
+    'last_ts': pl.Datetime('us', 'UTC'),
+    'min_value': pl.Float64,
+    'max_value': pl.Float64,
+    'last_value': pl.Float64,
+    'source': pl.String,
+    'offset': pl.UInt64,
+}
+
+# %%
+# Построение и обновление
+
+def day_table(lf, source, offset_col=None):
+    """Сворачивает строки id, date, value в дневную таблицу индекса.
+
+    offset_col - колонка с номером строки в исходном файле; без нее
+    смещение считается по порядку строк lf.
+    """
+    if offset_col is None:
+        lf = lf.with_row_index('_offset')
+        offset_col = '_offset'
+
+    return (
+        lf.filter(pl.col('date').is_not_null() & pl.col('value').is_not_null())
+        .group_by(['id', pl.col('date').dt.date().alias('day')])
+        .agg([
+            pl.len().alias('n_points'),
+            pl.col('date').min().alias('first_ts'),
+            pl.col('date').max().alias('last_ts'),
+            pl.col('value').min().alias('min_value'),
+            pl.col('value').max().alias('max_value'),
+            pl.col('value').sort_by('date').last().alias('last_value'),
+            pl.lit(str(source)).alias('source'),
+            pl.col(offset_col).min().cast(pl.UInt64).alias('offset'),
+        ])
+        .select([pl.col(c).cast(t) for c, t in DAY_SCHEMA.items()])
+    )
+
+def _merge_days(lf):
+    """Сливает строки одного (id, день) из разных порций"""
+    return (
+        lf.group_by(['id', 'day'])
+        .agg([
+            pl.col('n_points').sum(),
+            pl.col('first_ts').min(),
+            pl.col('last_ts').max(),
+            pl.col('min_value').min(),
+            pl.col('max_value').max(),
+            pl.col('last_value').sort_by('last_ts').last(),
+            pl.col('source').sort_by('first_ts').first(),
+            pl.col('offset').sort_by('first_ts').first(),
+        ])
+        .sort(['id', 'day'])
+    )
+
+def index_path(name):
+    return Path(INDEX_DIR) / f"{name}.parquet"
+
+def _write(df, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    df.write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+def rebuild_series_index(name, lf, source, offset_col=None):
+    """Строит индекс датасета name заново"""
+    _write(_merge_days(day_table(lf, source, offset_col)).collect(), index_path(name))
+
+def append_to_series_index(name, lf, source, offset_col=None):
+    """Добавляет в индекс новые строки (например, дописанные в конец файла)"""
+    new_days = day_table(lf, source, offset_col)
+    merged = _merge_days(pl.concat([scan_series_index(name), new_days])).collect()
+    _write(merged, index_path(name))
+
+def replace_in_series_index(name, lf, source):
+    """Заменяет в индексе ряды, присутствующие в lf (ряд переписан целиком)"""
+    new_days = day_table(lf, source).collect()
+    kept = scan_series_index(name).filter(~pl.col('id').is_in(new_days['id'].unique().implode()))
+    merged = pl.concat([kept.collect(), new_days]).sort(['id', 'day'])
+    _write(merged, index_path(name))
+
+# %%
+# Запросы
+
+def scan_series_index(name):
+    """Дневная таблица индекса (пустая, если индекс еще не построен)"""
+    path = index_path(name)
+    if not path.exists():
+        return pl.LazyFrame(schema=DAY_SCHEMA)
+    return pl.scan_parquet(path)
+
+def series_days(name, by='item_id', date_col='date'):
+    """LazyFrame by, date_col: дни с данными рядов датасета name (начало дня,
+    Datetime UTC) - вход для exclude_gaps вместо сырых точек"""
+    return scan_series_index(name).select([
+        pl.col('id').alias(by),
+        pl.col('day').cast(pl.Datetime('us', 'UTC')).alias(date_col),
+    ])
+
+def series_summary(days):
+    """Сводка по рядам из дневной таблицы (LazyFrame)"""
+    return (
+        days.group_by('id')
+        .agg([
+            pl.col('n_points').sum().alias('n_points'),
+            pl.len().alias('unique_days'),
+            pl.col('first_ts').min().alias('first_ts'),
+            pl.col('last_ts').max().alias('last_ts'),
+            pl.col('min_value').min().alias('min_value'),
+            pl.col('max_value').max().alias('max_value'),
+            pl.col('last_value').sort_by('last_ts').last().alias('last_value'),
+            pl.col('source').sort_by('first_ts').first().alias('source'),
+            pl.col('offset').sort_by('first_ts').first().alias('offset'),
+        ])
+    )
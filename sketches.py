@@ -0,0 +1,235 @@
+# %%
+# Сливаемые скетчи квантилей (в духе t-digest) по окнам рядов.
+#
+# Точная медиана окна (resample_daily, pyramid) требует всех сырых значений
+# окна: ее нельзя дополнить новыми точками и нельзя собрать из медиан
+# мелких окон. Скетч окна - упорядоченные центроиды (среднее, вес) плюс
+# min, max и число точек. Скетчи сливаются: центроиды объединяются и
+# сжимаются заново, поэтому
+#   - новые точки дописываются скетчами только этих точек (append_to_sketches);
+#   - недельные и месячные окна собираются из дневных скетчей (scan_sketches
+#     с every), сырые данные не читаются;
+#   - медиана и любые перцентили считаются по скетчу (sketch_quantiles).
+#
+# Сжатие - по масштабной функции t-digest k(q) = COMPRESSION / 2pi * asin(2q - 1):
+# центроиды, попавшие в один целый отрезок k, сливаются. У краев
+# распределения отрезки узкие (точные хвосты), в середине - шире. Пока
+# в окне мало точек, все центроиды единичные и медиана точная.
+#
+# Точность. Ошибка перцентиля q ограничена по рангу, а не по значению:
+# результат лежит между точными перцентилями q - e и q + e окна, где
+# e = rank_tolerance(q, compression) ~ 4pi * sqrt(q(1 - q)) / compression
+# (ширина двух отрезков k) плюс 1 / число точек окна. Для дневных скетчей
+# (COMPRESSION = 100) это до ~6% точек у медианы, для слитых недель и
+# месяцев (MERGE_COMPRESSION = 400) - до ~1.6%. Ошибка по значению - разброс
+# значений ряда в этой полосе рангов: на гладких рядах она мала, а на
+# ступенчатых рядах с редкими точками (уровень сменился внутри окна, на
+# новом уровне - около q точек) перцентиль попадает между ступенями, и
+# ошибка доходит до высоты ступени. Где нужна точная медиана ступенчатых
+# рядов - DAILY_MEDIAN = "exact" в tz.py.
+#
+# Хранение: data/store/sketches/<датасет>/ с партициями id=/month=, окно
+# SKETCH_EVERY. Дописанные скетчи лежат отдельными файлами и сливаются
+# при чтении; полная пересборка (build_sketches) их уплотняет.
+import math
+from pathlib import Path
+
+import polars as pl
+
+from columnar_store import SOURCE_MARKER, STORE_DIR, append_series, rebuild_dataset, replace_series, scan_dataset
+from resample import fill_missing
+
+SKETCH_DIR = f"{STORE_DIR}/sketches"
+SKETCH_EVERY = "1d"
+COMPRESSION = 100  # центроидов в скетче - не больше примерно COMPRESSION / 2
+MERGE_COMPRESSION = 400  # для слитых окон every: в них во много раз больше точек
+
+SKETCH_SCHEMA = {
+    'id': pl.UInt64,
+    'date': pl.Datetime('us', 'UTC'),
+    'means': pl.List(pl.Float64),
+    'weights': pl.List(pl.UInt32),
+    'min': pl.Float64,
+    'max': pl.Float64,
+    'count': pl.UInt32,
+}
+
+# %%
+# Скетчи
+
+def _compress(centroids, keys, compression=COMPRESSION):
+    """Скетчи по центроидам: LazyFrame keys..., mean, weight, min, max (строка на центроид)"""
+    weight = pl.col('weight')
+    q = (weight.cum_sum().over(keys) - weight / 2) / weight.sum().over(keys)
+    k = (2 * q - 1).arcsin() * (compression / (2 * math.pi))
+    return (
+        centroids.sort([*keys, 'mean'])
+        .with_columns(k.floor().alias('_cluster'))
+        .group_by([*keys, '_cluster'])
+        .agg([
+            ((pl.col('mean') * weight).sum() / weight.sum()).alias('mean'),
+            weight.sum().cast(pl.UInt32).alias('weight'),
+            pl.col('min').min(),
+            pl.col('max').max(),
+        ])
+        .sort([*keys, '_cluster'])
+        .group_by(keys, maintain_order=True)
+        .agg([
+            pl.col('mean').alias('means'),
+            pl.col('weight').alias('weights'),
+            pl.col('min').min(),
+            pl.col('max').max(),
+            pl.col('weight').sum().cast(pl.UInt32).alias('count'),
+        ])
+    )
+
+def sketch_points(lf, every=SKETCH_EVERY, by='id', date_col='date', value_col='value', compression=COMPRESSION):
+    """LazyFrame скетчей (колонки SKETCH_SCHEMA, by и date_col под своими
+    именами) по сырым точкам lf в окнах every"""
+    keys = [by, date_col]
+    centroids = lf.drop_nulls(value_col).select([
+        pl.col(by),
+        pl.col(date_col).dt.truncate(every),
+        pl.col(value_col).cast(pl.Float64).alias('mean'),
+        pl.lit(1, dtype=pl.UInt32).alias('weight'),
+        pl.col(value_col).cast(pl.Float64).alias('min'),
+        pl.col(value_col).cast(pl.Float64).alias('max'),
+    ])
+    return _compress(centroids, keys, compression)
+
+def merge_sketches(lf, every=None, by='id', date_col='date', compression=None):
+    """Сливает скетчи lf с одинаковыми (by, окно).
+
+    every - более крупное окно ('1w', '1mo'): скетчи сливаются в его окна
+    со сжатием MERGE_COMPRESSION. Без every сливаются только повторы одного
+    окна (дописанные скетчи) со сжатием COMPRESSION.
+    """
+    if compression is None:
+        compression = COMPRESSION if every is None else MERGE_COMPRESSION
+    window = pl.col(date_col) if every is None else pl.col(date_col).dt.truncate(every)
+    centroids = (
+        lf.select([pl.col(by), window, 'means', 'weights', 'min', 'max'])
+        .explode(['means', 'weights'])
+        .rename({'means': 'mean', 'weights': 'weight'})
+    )
+    return _compress(centroids, [by, date_col], compression)
+
+def sketch_quantiles(lf, quantiles=(0.5,), by='id', date_col='date'):
+    """LazyFrame by, date_col, p<перцентиль>... по скетчам lf (0.5 -> p50).
+
+    Значение между центроидами интерполируется линейно по накопленному
+    весу; центроид стоит в середине своего веса, min и max - на краях
+    (по единичным центроидам - точный перцентиль с позицией count * q - 1/2).
+    Ошибка по рангу - rank_tolerance, см. начало модуля.
+    """
+    keys = [by, date_col]
+    # Точки окна по порядку: min (pos = 0), центроиды, max (pos = count).
+    # Строки окна идут подряд и первая из них - min с pos = 0, поэтому
+    # сдвиг без over: чужая предыдущая строка достается только ей
+    positions = pl.col('weights').list.eval(pl.element().cum_sum() - pl.element() / 2)
+    points = (
+        lf.select([
+            *keys,
+            pl.concat_list([pl.lit(0.0), positions, pl.col('count').cast(pl.Float64)]).alias('pos'),
+            pl.concat_list(['min', 'means', 'max']).alias('value'),
+            'count',
+        ])
+        .explode(['pos', 'value'])
+        .with_columns([
+            pl.col('pos').shift(1).alias('prev_pos'),
+            pl.col('value').shift(1).alias('prev_value'),
+        ])
+        .cache()
+    )
+
+    def percentile(q):
+        # В каждом окне ровно одна точка с pos >= target и prev_pos < target:
+        # она и предыдущая - концы отрезка интерполяции
+        name = f"p{q * 100:g}"
+        if q <= 0:
+            return points.filter(pl.col('pos') == 0).select(pl.col('value').alias(name))
+        target = pl.col('count') * q
+        share = (target - pl.col('prev_pos')) / (pl.col('pos') - pl.col('prev_pos'))
+        return (
+            points.filter((pl.col('pos') >= target) & (pl.col('prev_pos') < target))
+            .select((pl.col('prev_value') + (pl.col('value') - pl.col('prev_value')) * share).alias(name))
+        )
+
+    return pl.concat(
+        [points.filter(pl.col('pos') == 0).select(keys), *[percentile(q) for q in quantiles]],
+        how='horizontal',
+    )
+
+def rank_tolerance(q, compression=COMPRESSION):
+    """Оценка ошибки перцентиля q по рангу (доля точек окна) без учета
+    дискретности 1 / число точек: ширина двух отрезков масштабной функции"""
+    return 4 * math.pi * math.sqrt(q * (1 - q)) / compression
+
+# %%
+# Хранилище скетчей
+
+def _dataset_dir(name):
+    return Path(STORE_DIR) / name
+
+def sketch_dir(name):
+    return Path(SKETCH_DIR) / name
+
+def _marker(name):
+    try:
+        return (_dataset_dir(name) / SOURCE_MARKER).read_text(encoding='utf-8')
+    except FileNotFoundError:
+        return None
+
+def build_sketches(name):
+    """Пересчитывает скетчи датасета name целиком (дописанные файлы уплотняются)"""
+    rebuild_dataset(sketch_points(scan_dataset(_dataset_dir(name))), sketch_dir(name))
+    marker = _marker(name)
+    if marker is not None:
+        (sketch_dir(name) / SOURCE_MARKER).write_text(marker, encoding='utf-8')
+
+def has_sketches(name):
+    return sketch_dir(name).is_dir()
+
+def ensure_sketches(name):
+    """Строит скетчи, если их нет или датасет пересобран из другого источника"""
+    try:
+        marker = (sketch_dir(name) / SOURCE_MARKER).read_text(encoding='utf-8')
+    except FileNotFoundError:
+        marker = None
+    if not has_sketches(name) or marker != _marker(name):
+        build_sketches(name)
+
+def append_to_sketches(name, df):
+    """Дописывает скетчи строк df (уже записанных в хранилище), сырые данные не читаются.
+
+    Ничего не делает, если скетчи датасета еще не построены.
+    """
+    if df.height == 0 or not has_sketches(name):
+        return
+    append_series(sketch_points(df.lazy()).collect(), sketch_dir(name))
+
+def replace_in_sketches(name, df):
+    """Пересчитывает скетчи рядов df (ряд в хранилище заменен целиком)"""
+    if df.height == 0 or not has_sketches(name):
+        return
+    ids = df['id'].unique().implode()
+    stored = scan_dataset(_dataset_dir(name)).filter(pl.col('id').is_in(ids))
+    replace_series(sketch_points(stored).collect(), sketch_dir(name))
+
+def scan_sketches(name, every=None):
+    """LazyFrame скетчей датасета name (SKETCH_SCHEMA) по окнам SKETCH_EVERY
+    или более крупным окнам every (слитые со сжатием MERGE_COMPRESSION)"""
+    sketches = scan_dataset(sketch_dir(name), schema=SKETCH_SCHEMA)
+    if every is None and not any(sketch_dir(name).glob("id=*/month=*/append-*.parquet")):
+        return sketches  # дописанных скетчей нет, окна не повторяются
+    return merge_sketches(sketches, every)
+
+def daily_from_sketches(sketches, every=SKETCH_EVERY, by="item_id", value_col="y", quantile=0.5):
+    """Ряды по окнам every из скетчей - как resample_daily: date, by, value_col
+    (перцентиль quantile окна), пропущенные окна - null"""
+    values = sketch_quantiles(sketches, (quantile,)).select([
+        pl.col('date'),
+        pl.col('id').alias(by),
+        pl.col(f"p{quantile * 100:g}").alias(value_col),
+    ])
+    return fill_missing(values, every, by=by, value_col=value_col)
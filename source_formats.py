@@ -0,0 +1,132 @@
+# %%
+# Реестр форматов выгрузок мониторинга: source_formats.toml.
+#
+# Каждый формат описывает шаблон имени файла, колонки с явными типами,
+# колонку даты и ряды (номер, колонки значения, разбор единиц). Формат
+# компилируется в LazyFrame на каждый ряд (compile_source): схема задана,
+# поэтому файл не читается заранее для вывода типов. Все источники
+# выполняются одним pl.collect_all (collect_sources), разбор файлов идет
+# параллельно в пуле потоков Polars.
+#
+# Новый формат выгрузки - новая секция в source_formats.toml, код не меняется.
+import re
+import tomllib
+from fnmatch import fnmatch
+from pathlib import Path
+
+import polars as pl
+
+from value_parsing import extract_numeric_value_expr, parse_decimal_comma_expr
+
+FORMATS_PATH = Path(__file__).resolve().parent / "source_formats.toml"
+
+UNITS = {
+    'comma': parse_decimal_comma_expr,
+    'suffix': extract_numeric_value_expr,
+    'number': lambda column: pl.col(column).cast(pl.Float64, strict=False),
+}
+
+# %%
+# Реестр
+
+def _dtype(name):
+    dtype = getattr(pl, name, None)
+    if not (isinstance(dtype, type) and issubclass(dtype, pl.DataType)):
+        raise ValueError(f"Неизвестный тип колонки {name!r}")
+    return dtype
+
+def _check(fmt):
+    """Проверяет формат и приводит колонки к схеме Polars"""
+    schema = {name: _dtype(dtype) for name, dtype in fmt['columns']}
+    if fmt['date'] not in schema:
+        raise ValueError(f"{fmt['pattern']}: колонки даты {fmt['date']!r} нет в columns")
+    for series in fmt['series']:
+        values = [series['value']] if isinstance(series['value'], str) else series['value']
+        missing = [col for col in values if col not in schema]
+        if missing:
+            raise ValueError(f"{fmt['pattern']}: колонок {missing} нет в columns")
+        if series.get('unit', 'number') not in UNITS:
+            raise ValueError(f"{fmt['pattern']}: неизвестный разбор {series['unit']!r}, ожидается один из {tuple(UNITS)}")
+    return {**fmt, 'schema': schema}
+
+def load_formats(path=FORMATS_PATH):
+    """Список форматов из TOML-файла в порядке проверки"""
+    with open(path, 'rb') as f:
+        config = tomllib.load(f)
+    return [_check(fmt) for fmt in config.get('source', [])]
+
+def match_format(filename, formats):
+    """Первый формат, шаблон которого совпал с именем файла, или None"""
+    for fmt in formats:
+        if fnmatch(filename, fmt['pattern']):
+            return fmt
+    return None
+
+# %%
+# Компиляция
+
+def series_id(series, filename):
+    """Номер ряда: id или id + число из id_pattern по имени файла"""
+    if 'id_pattern' in series:
+        match = re.search(series['id_pattern'], filename)
+        if match:
+            return series['id'] + int(match.group(1))
+    return series['id']
+
+def value_expr(series):
+    """Выражение значения ряда: склейка колонок и разбор единиц"""
+    values = series['value']
+    column = values if isinstance(values, str) else pl.concat_str([pl.col(c) for c in values], separator=' ')
+    value = UNITS[series.get('unit', 'number')](column)
+    if 'divide_by' in series:
+        value = value / series['divide_by']
+    return value
+
+def compile_source(file_path, fmt, data=None):
+    """Список (номер ряда, LazyFrame id, date, value) для одного файла.
+
+    data - содержимое (bytes) вместо чтения file_path (см. tail_follow).
+    """
+    filename = Path(file_path).name
+    lf = pl.scan_csv(
+        file_path if data is None else data,
+        schema=fmt['schema'],
+        has_header=fmt.get('has_header', True),
+        ignore_errors=fmt.get('ignore_errors', False),
+    )
+
+    frames = []
+    for series in fmt['series']:
+        sid = series_id(series, filename)
+        value = value_expr(series)
+        frames.append((sid, lf.select([
+            pl.lit(sid).alias('id'),
+            pl.col(fmt['date']).alias('date'),
+            value.alias('value'),
+        ]).filter(pl.col('value').is_not_null())))
+    return frames
+
+def collect_sources(plans):
+    """Выполняет планы {источник: [(номер ряда, LazyFrame), ...]} одним collect_all.
+
+    Возвращает (результаты {источник: [DataFrame, ...]}, ошибки {источник:
+    исключение}). Если общий запуск упал, источники собираются по одному,
+    чтобы ошибка одного файла не мешала остальным.
+    """
+    keys = [(source, i) for source, frames in plans.items() for i in range(len(frames))]
+    queries = [plans[source][i][1] for source, i in keys]
+    try:
+        collected = pl.collect_all(queries)
+    except Exception:
+        results, errors = {}, {}
+        for source, frames in plans.items():
+            try:
+                results[source] = pl.collect_all([lf for _, lf in frames])
+            except Exception as e:
+                errors[source] = e
+        return results, errors
+
+    results = {source: [] for source in plans}
+    for (source, _), df in zip(keys, collected):
+        results[source].append(df)
+    return results, {}
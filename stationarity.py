@@ -0,0 +1,117 @@
+# %%
+# Заполнение пропусков и приведение рядов к стационарному виду.
+#
+# Раньше это делалось отдельным скриптом на каждый ряд (файлы
+# data/series_*_filled.csv и data/series_*_stationary_final.csv). Здесь все
+# ряды обрабатываются одним запросом: вход - дневной ресемплинг tz.py
+# (resample.sink_daily_chunks: date, item_id, y, пропущенные дни - null),
+# все операции внутри ряда идут через over(item_id).
+#
+# Результат пишется одним датасетом data/store/stationary с партициями
+# id=/month= (как остальные датасеты columnar_store):
+#   value      - значение с заполненными пропусками (как в *_filled.csv);
+#   stationary - z-оценка лог-приращений (как в *_stationary_final.csv).
+import polars as pl
+
+from columnar_store import STORE_DIR, rebuild_dataset, scan_dataset
+
+STATIONARY_DIR = f"{STORE_DIR}/stationary"
+
+STATIONARY_SCHEMA = {
+    'id': pl.UInt64,
+    'date': pl.Datetime('us', 'UTC'),
+    'value': pl.Float64,
+    'stationary': pl.Float64,
+}
+
+# Способы заполнения пропущенных дней:
+#   log     - линейная интерполяция log(y), то есть геометрическая между
+#             соседними точками (так получены *_filled.csv); рядом с
+#             нулевыми и отрицательными значениями - линейная;
+#   linear  - линейная интерполяция y;
+#   forward - последнее известное значение.
+FILL_METHODS = ("log", "linear", "forward")
+
+CLIP_QUANTILE = 0.01  # доля приращений, обрезаемых с каждой стороны перед z-оценкой
+
+# %%
+# Выражения
+
+def fill_gaps_expr(value_col="y", by="item_id", method="log"):
+    """Выражение: value_col с заполненными внутри каждого ряда пропусками.
+
+    Ожидает строки, отсортированные по (by, дата), с полной сеткой дней,
+    как после resample_daily. Интерполяция идет по номеру строки, то есть
+    по дням.
+    """
+    if method not in FILL_METHODS:
+        raise ValueError(f"Неизвестный способ заполнения {method!r}, ожидается один из {FILL_METHODS}")
+
+    y = pl.col(value_col).cast(pl.Float64)
+    linear = y.interpolate().over(by)
+    if method == "log":
+        geometric = y.log().interpolate().over(by).exp().fill_nan(None)
+        return pl.coalesce(y, pl.when(geometric > 0).then(geometric), linear)
+    if method == "linear":
+        return linear
+    return y.forward_fill().over(by)
+
+def stationary_exprs(value_col="value", by="item_id", clip_quantile=CLIP_QUANTILE):
+    """Шаги z-оценки приращений log1p(value_col) внутри каждого ряда.
+
+    Приращения обрезаются по квантилям clip_quantile и 1 - clip_quantile
+    ряда (единичные скачки с нуля до полного диска иначе сжимают весь
+    остальной ряд), затем центрируются и делятся на стандартное отклонение
+    (ddof=0). У первого дня ряда приращения нет - null. Постоянный ряд
+    дает нули.
+
+    Оконные выражения не вкладываются друг в друга, поэтому возвращается
+    список выражений для последовательных with_columns; результат - в
+    колонке "stationary".
+    """
+    diff = pl.col("stationary")
+    return [
+        pl.col(value_col).log1p().diff().over(by).alias("stationary"),
+        diff.clip(
+            diff.quantile(clip_quantile, "linear").over(by),
+            diff.quantile(1 - clip_quantile, "linear").over(by),
+        ),
+        ((diff - diff.mean().over(by)) / diff.std(ddof=0).over(by)).fill_nan(0.0),
+    ]
+
+# %%
+# Запрос для всех рядов
+
+def stationary_frame(daily_lf, method="log", clip_quantile=CLIP_QUANTILE,
+                     date_col="date", by="item_id", value_col="y"):
+    """LazyFrame id, date, value, stationary для всех рядов daily_lf.
+
+    Строки, которые не удалось заполнить (например, null в начале ряда
+    при method="forward"), отбрасываются до расчета приращений.
+    """
+    lf = (
+        daily_lf
+        .sort([by, date_col])
+        .with_columns(fill_gaps_expr(value_col, by, method).alias("value"))
+        .drop_nulls("value")
+    )
+    for expr in stationary_exprs("value", by, clip_quantile):
+        lf = lf.with_columns(expr)
+
+    return (
+        lf.select([
+            pl.col(by).cast(pl.UInt64).alias("id"),
+            pl.col(date_col).cast(pl.Datetime("us", "UTC")).alias("date"),
+            pl.col("value"),
+            pl.col("stationary"),
+        ])
+    )
+
+def build_stationary(daily_lf, dataset_dir=STATIONARY_DIR, **kwargs):
+    """Пересчитывает датасет stationary целиком и возвращает LazyFrame поверх него"""
+    rebuild_dataset(stationary_frame(daily_lf, **kwargs), dataset_dir)
+    return scan_stationary(dataset_dir)
+
+def scan_stationary(dataset_dir=STATIONARY_DIR):
+    """LazyFrame id, date, value, stationary поверх записанного датасета"""
+    return scan_dataset(dataset_dir, schema=STATIONARY_SCHEMA)
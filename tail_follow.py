@@ -0,0 +1,168 @@
+# %%
+# Дочитывание дописываемых выгрузок data/new (err*.csv, wd.csv, PG02.csv...).
+#
+# Источники - журналы, в которые строки только дописываются. В записи
+# манифеста нормализации (см. normalization.follow_state) хранится, сколько
+# байт уже разобрано, хэш заголовка и последняя отметка времени каждого
+# ряда. При очередном проходе читаются только полные строки после этого
+# смещения; к ним приклеивается заголовок файла, и они разбираются тем же
+# normalize_file. Новые строки дописываются в CSV data/normalized, в
+# хранилище и индекс рядов.
+#
+# Если файл укоротился, сменился заголовок или появился новый ряд, источник
+# нормализуется заново целиком (run_normalization). Так же - изменившийся
+# источник, выходной файл или ряд которого пишет и другой источник: какой
+# из них победит, решает run_normalization, дописывать в чужой ряд нельзя.
+import glob
+import hashlib
+import os
+import time
+from datetime import datetime
+
+from columnar_store import STORE_DIR, append_series, timestamp_expr, to_store_schema
+from normalization import (
+    MANIFEST_NAME,
+    entry_keys,
+    load_manifest,
+    normalize_file,
+    read_header,
+    run_normalization,
+    save_manifest,
+    shared_keys,
+)
+from pyramid import append_to_pyramid
+from sketches import append_to_sketches
+from series_index import append_to_series_index
+
+FOLLOW_INTERVAL = 60  # секунд между проходами watch()
+SETTLE_SECONDS = 5     # через сколько секунд без записи строка без \n считается дописанной
+
+# %%
+# Один источник
+
+def read_appended(file_path, offset):
+    """Строки, дописанные после offset, и смещение конца последней полной строки.
+
+    Последняя строка без перевода строки берется, только если файл не менялся
+    SETTLE_SECONDS (иначе ее, возможно, еще пишут). Смещение на нее не
+    сдвигается: при следующем проходе она читается снова и отсекается по
+    last_ts.
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read()
+    end = chunk.rfind(b'\n') + 1
+    settled = time.time() - os.path.getmtime(file_path) >= SETTLE_SECONDS
+    return (chunk if settled else chunk[:end]), offset + end
+
+def new_rows(norm_df, last_ts):
+    """Строки позже last_ts (ISO-строка); строки с неразборной датой остаются"""
+    if last_ts is None:
+        return norm_df
+    return norm_df.filter(
+        (timestamp_expr(norm_df.lazy(), 'date') > datetime.fromisoformat(last_ts)).fill_null(True)
+    )
+
+def follow_file(file_path, entry, output_dir, store_dir=f"{STORE_DIR}/normalized", shared=False):
+    """Дочитывает источник по записи манифеста entry.
+
+    shared - выходы источника пишет и другой источник: изменившийся файл
+    тогда нормализуется заново. Возвращает число дописанных строк или None,
+    если источник нужно нормализовать заново целиком (entry тогда не меняется).
+    """
+    if entry is None or 'offset' not in entry:
+        return None
+    stat = os.stat(file_path)
+    if shared and (stat.st_size, stat.st_mtime_ns) != (entry['size'], entry['mtime_ns']):
+        return None
+    if stat.st_size < entry['offset']:
+        return None
+    if hashlib.sha256(read_header(file_path)).hexdigest() != entry['header_sha256']:
+        return None
+
+    chunk, offset = read_appended(file_path, entry['offset'])
+    series_files = dict(zip(map(str, entry['ids']), entry['outputs']))
+
+    appended = []
+    if chunk:
+        for _, norm_df in normalize_file(file_path, data=read_header(file_path) + chunk):
+            series_id = str(norm_df['id'][0])
+            if series_id not in series_files:
+                return None  # в источнике появился новый ряд
+            norm_df = new_rows(norm_df, entry['last_ts'].get(series_id))
+            if norm_df.height > 0:
+                appended.append((series_id, norm_df))
+
+    # Все проверки пройдены - пишем
+    for series_id, norm_df in appended:
+        output_path = os.path.join(output_dir, series_files[series_id])
+        with open(output_path, 'ab') as f:
+            norm_df.write_csv(f, include_header=False)
+
+        store_df = to_store_schema(norm_df.lazy()).collect()
+        append_series(store_df, store_dir)
+        append_to_series_index(
+            'normalized',
+            store_df.lazy().with_row_index('_offset', offset=entry['rows'][series_id]),
+            source=output_path, offset_col='_offset',
+        )
+        append_to_pyramid('normalized', store_df)
+        append_to_sketches('normalized', store_df)
+
+        ts = store_df['date'].max()
+        if ts is not None:
+            entry['last_ts'][series_id] = ts.isoformat()
+        entry['rows'][series_id] += norm_df.height
+
+    stat = os.stat(file_path)
+    entry.update({
+        'offset': offset,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha256': None,  # полный хэш не считаем: это O(размер файла)
+    })
+    return sum(norm_df.height for _, norm_df in appended)
+
+# %%
+# Все источники
+
+def run_follow(input_files, output_dir, manifest_path=None, store_dir=f"{STORE_DIR}/normalized"):
+    """Один проход дочитывания по всем источникам.
+
+    Источники без сохраненного смещения или с несовместимыми изменениями
+    отдаются run_normalization. Возвращает словарь {источник: дописано строк}
+    и список 'renormalized'.
+    """
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    report = {'appended': {}, 'renormalized': []}
+    shared = shared_keys(manifest)
+    for file_path in sorted(input_files):
+        entry = manifest.get(file_path)
+        try:
+            n_rows = follow_file(file_path, entry, output_dir, store_dir, shared=bool(entry_keys(entry) & shared))
+        except Exception as e:
+            print(f"  -> Ошибка дочитывания {os.path.basename(file_path)}: {e}")
+            n_rows = None
+        if n_rows is None:
+            manifest.pop(file_path, None)
+            report['renormalized'].append(file_path)
+        elif n_rows:
+            report['appended'][file_path] = n_rows
+            print(f"{os.path.basename(file_path)}: дописано {n_rows} строк")
+    save_manifest(manifest, manifest_path)
+
+    if report['renormalized']:
+        run_normalization(report['renormalized'], output_dir, manifest_path=manifest_path, store_dir=store_dir)
+    return report
+
+def watch(pattern, output_dir, interval=FOLLOW_INTERVAL, **kwargs):
+    """Дочитывает источники по маске pattern каждые interval секунд (Ctrl+C - выход)"""
+    print(f"Слежение за {pattern} каждые {interval} с")
+    try:
+        while True:
+            run_follow(glob.glob(pattern), output_dir, **kwargs)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Слежение остановлено")
@@ -0,0 +1,68 @@
+# %%
+# Точность скетчей квантилей на ступенчатых рядах с редкими точками.
+# Запуск из корня репозитория: python -m pytest tests
+import random
+from datetime import datetime, timedelta, timezone
+
+import polars as pl
+
+from sketches import MERGE_COMPRESSION, merge_sketches, rank_tolerance, sketch_points, sketch_quantiles
+
+def _step_series(n_ids=40, n_days=90, seed=1):
+    """Сырые точки id, date, value: уровень держится днями и меняется
+    скачком в 0.5-3 раза, в день 1-30 точек"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    rows = []
+    for series_id in range(n_ids):
+        level = rng.choice([10.0, 100.0, 1000.0])
+        for day in range(n_days):
+            if rng.random() < 0.1:
+                level *= rng.choice([0.5, 2.0, 3.0])
+            for _ in range(rng.randint(1, 30)):
+                rows.append((series_id, start + timedelta(days=day, hours=rng.random() * 23), level * (1 + rng.random() * 0.01)))
+    return pl.DataFrame(
+        rows, schema={'id': pl.UInt64, 'date': pl.Datetime('us', 'UTC'), 'value': pl.Float64}, orient='row',
+    )
+
+def _rank_band(raw, every, q, tolerance):
+    """Точные перцентили окон every: lo, hi - значения с рангами
+    q -+ (tolerance + 1 / число точек окна)"""
+    e = tolerance + 1 / pl.len()
+    rank = lambda share: (share.clip(0, 1) * (pl.len() - 1))  # noqa: E731
+    values = pl.col('value').sort()
+    return raw.lazy().group_by(['id', pl.col('date').dt.truncate(every)]).agg([
+        values.gather(rank(q - e).floor().cast(pl.UInt32)).first().alias('lo'),
+        values.gather(rank(q + e).ceil().cast(pl.UInt32)).first().alias('hi'),
+    ])
+
+def test_merged_quantiles_within_rank_tolerance():
+    """Медиана и p90 слитых недель и месяцев лежат в полосе рангов
+    q -+ rank_tolerance(q, MERGE_COMPRESSION) точных перцентилей окна"""
+    raw = _step_series()
+    sketches = sketch_points(raw.lazy()).collect()
+    for every in ('1w', '1mo'):
+        merged = merge_sketches(sketches.lazy(), every)
+        for q in (0.5, 0.9):
+            name = f"p{q * 100:g}"
+            checked = (
+                sketch_quantiles(merged, (q,))
+                .join(_rank_band(raw, every, q, rank_tolerance(q, MERGE_COMPRESSION)), on=['id', 'date'])
+                .collect()
+            )
+            outside = checked.filter((pl.col(name) < pl.col('lo')) | (pl.col(name) > pl.col('hi')))
+            assert checked.height > 0
+            assert outside.height == 0, f"{every} {name}: {outside.head(5)}"
+
+def test_small_window_quantile_is_exact():
+    """Пока центроиды единичные, перцентиль - точный с позицией count * q - 1/2"""
+    values = [5.0, 1.0, 4.0, 2.0, 3.0, 10.0]
+    raw = pl.DataFrame({
+        'id': pl.Series([1] * len(values), dtype=pl.UInt64),
+        'date': [datetime(2024, 1, 1, hour, tzinfo=timezone.utc) for hour in range(len(values))],
+        'value': values,
+    })
+    result = sketch_quantiles(sketch_points(raw.lazy()), (0.5, 0.9)).collect()
+    # 6 точек: медиана - позиция 2.5 (между 3 и 4), p90 - позиция 4.9 (между 5 и 10)
+    assert result['p50'].item() == 3.5
+    assert abs(result['p90'].item() - 9.5) < 1e-9
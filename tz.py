@@ -1,114 +1,161 @@
 # %%
+from datetime import timedelta
+
 import polars as pl
 import altair as alt
-from datetime import datetime, timedelta
+
+from change_points import detect_events, event_layer
+from chart_payload import compact_chart, export_compact_html
+from data_service import range_url, service_chart
+from columnar_store import STORE_DIR, scan_collected
+from downsample import downsample
+from forecast import HORIZON_DAYS, days_to_threshold, fit_trends, forecast_frame, forecast_layer
+from group_shards import export_group_shards
+from grouping import assign_groups, chart_frame, domain_expr, group_domains, rank_series, with_scale
+from gaps import exclude_gaps, load_gap_registry
+from resample import sink_daily_chunks
+from sketches import daily_from_sketches, ensure_sketches, scan_sketches
+from stationarity import build_stationary
+from instrumentation import profile_chart_spec, stage
+from series_index import series_days
 
 alt.data_transformers.disable_max_rows()
 
 # %%
-# Загрузка данных
-raw_df = (
-    pl.scan_csv("data/raw/collected.csv", has_header=False,
-                new_columns=["row", "date", "item_id", "y"])
-    .with_columns([
-        pl.col("date").str.to_datetime(strict=False),
-        pl.col("y").cast(pl.Float64, strict=False),
-    ])
-    .drop("row").drop_nulls()
-    .sort(["item_id", "date"])
-    .collect()
-)
-
-# Ресемплирование по дням (медиана)
-df = (
-    raw_df
-    .group_by_dynamic("date", every="1d", group_by="item_id")
-    .agg(pl.col("y").median().alias("y"))
-    .upsample("date", every="1d", group_by="item_id")
-)
+# Загрузка данных (Parquet-хранилище, собирается из collected.csv при изменении).
+# Ленивый scan: фильтры по item_id ниже доходят до партиций id=, сырые данные
+# целиком в память не загружаются
+with stage("load") as s:
+    raw_lf = (
+        scan_collected()
+        .select([
+            pl.col("date"),
+            pl.col("id").alias("item_id"),
+            pl.col("value").alias("y"),
+        ])
+        .drop_nulls()
+    )
+    s.plan(raw_lf)
 
 # %%
-# Захардкоженные системные сбои
-gap_periods = [
-    ('2024-08-01', '2024-08-11'),
-    ('2024-10-15', '2024-10-17'), 
-    ('2024-10-19', '2024-10-20'),
-    ('2024-10-22', '2024-10-24'),
-    ('2025-01-30', '2025-03-19'),
-]
-gap_periods = [(datetime.strptime(s, '%Y-%m-%d'), datetime.strptime(e, '%Y-%m-%d')) 
-               for s, e in gap_periods]
-
-excluded_dates = set()
-for start_gap, end_gap in gap_periods:
-    current_date = start_gap
-    while current_date <= end_gap:
-        excluded_dates.add(current_date)
-        current_date += timedelta(days=1)
+# Системные сбои из реестра (gap_registry.csv)
+gaps = load_gap_registry()
 
 # %%
-# Отбор рядов с минимальным количеством точек
-stats = (
-    df.filter(~pl.col("date").is_in(list(excluded_dates)))
-    .group_by("item_id")
-    .agg([
-        pl.col("y").count().alias("n_points")
-    ])
-    .filter(pl.col("n_points") > 8)
-    .sort("n_points", descending=True)
-)
+# Отбор рядов с минимальным количеством точек: запрос к индексу рядов
+# (дни с данными), сырые данные для этого не сканируются
+MIN_POINTS = 9  # дней с данными вне сбоев
+
+with stage("series_selection") as s:
+    # item_id при равном числе точек - для стабильного порядка групп
+    stats_lf = rank_series(exclude_gaps(series_days("collected"), gaps), min_points=MIN_POINTS)
+    s.plan(stats_lf)
+    stats = stats_lf.collect()
+    s.rows_out(stats)
 
 all_series_ids = stats["item_id"].to_list()
 
 # %%
-# Подготовка данных для графика (векторизованная версия)
-def prepare_data(series_ids, batch_size=10):
-    # Создаем mapping item_id -> group_num
-    total_groups = (len(series_ids) + batch_size - 1) // batch_size
-    group_mapping = []
-    
-    for group_idx in range(total_groups):
-        start_idx = group_idx * batch_size
-        end_idx = min(start_idx + batch_size, len(series_ids))
-        group_batch = series_ids[start_idx:end_idx]
-        
-        for item_id in group_batch:
-            group_mapping.append({
-                'item_id': item_id,
-                'group_num': group_idx + 1
-            })
-    
-    # Векторизованные операции Polars
-    mapping_df = pl.DataFrame(group_mapping)
-    
-    # Присоединяем group_num к основным данным одной операцией
-    result = (
-        df.filter(pl.col("y").is_not_null())
-        .join(mapping_df, on="item_id", how="inner")
-        .sort(["group_num", "item_id", "date"])
-        .select([
-            pl.col("date"),
-            pl.col("y").alias("value"),
-            pl.col("item_id").cast(pl.String),
-            pl.col("group_num")
-        ])
-    )
-    
-    return result
+# Ресемплирование по дням (медиана) отобранных рядов частями по item_id:
+# сырые данные целиком в память не загружаются.
+# DAILY_MEDIAN = "sketch" - медиана по скетчам квантилей (sketches.py):
+# скетчи дополняются новыми точками без пересчета дня и сливаются в недели
+# и месяцы без чтения сырых данных, но медиана приближенная - ошибка до ~6%
+# точек дня по рангу (rank_tolerance). На ступенчатых рядах с редкими точками
+# это может быть ошибка на всю высоту ступени: для них оставлять "exact"
+DAILY_MEDIAN = "exact"  # "exact" или "sketch"
+
+with stage("daily_resample") as s:
+    if DAILY_MEDIAN == "sketch":
+        ensure_sketches("collected")
+        sketches_lf = scan_sketches("collected").filter(pl.col("id").is_in(all_series_ids))
+        s.plan(sketches_lf)
+        df = daily_from_sketches(sketches_lf).collect()
+    else:
+        selected_lf = raw_lf.filter(pl.col("item_id").is_in(all_series_ids))
+        s.plan(selected_lf)
+        df = sink_daily_chunks(selected_lf, f"{STORE_DIR}/daily", n_chunks=16).collect()
+    s.rows_out(df)
+
+# %%
+# Заполнение пропусков и стационарные ряды (z-оценка лог-приращений) для
+# всех отобранных рядов одним запросом -> data/store/stationary
+BUILD_STATIONARY = False
+if BUILD_STATIONARY:
+    with stage("stationarity") as s:
+        s.rows_in(df)
+        stationary_lf = build_stationary(df.lazy(), method="log")
+        s.rows_out(stationary_lf)  # scan записанного data/store/stationary, считается только при замерах
 
-chart_data = prepare_data(all_series_ids, batch_size=30)
+# %%
+# Подготовка данных для графика: номера групп (grouping.py) присоединяются
+# к дневным данным одним join
+GROUP_SIZE = 30
+GROUP_MODE = "rank"  # "rank" (по числу точек), "magnitude" или "cluster" (по масштабу рядов)
+
+with stage("group_assignment") as s:
+    s.rows_in(df)
+    # Порядок рядов - как при отборе (по числу точек), масштаб - по дневным данным
+    group_stats = with_scale(stats, df.lazy())
+    groups = assign_groups(group_stats, size=GROUP_SIZE, mode=GROUP_MODE).collect()
+    chart_data = chart_frame(df, groups).collect()
+    s.rows_out(chart_data)
 
 # %%
 # График
+CHART_WIDTH = 1800
+DOWNSAMPLE = "minmax"  # "minmax", "lttb" или "raw" (без прореживания, для детального зума)
+CAPACITY = None  # порог заполнения: число для всех рядов или DataFrame item_id, threshold
+
 max_group = chart_data['group_num'].max()
 group_param = alt.param(value=1, bind=alt.binding_range(min=1, max=max_group, step=1, name='Группа: '))
 legend_selection = alt.selection_point(fields=['item_id'])
 
 # Фиксированные домены для осей
-date_domain = [chart_data['date'].min().replace(tzinfo=None), chart_data['date'].max().replace(tzinfo=None)]
-value_domain = [chart_data['value'].min(), chart_data['value'].max()]
+# (ось времени продлена на горизонт прогноза)
+date_domain = [
+    chart_data['date'].min().replace(tzinfo=None),
+    (chart_data['date'].max() + timedelta(days=HORIZON_DAYS)).replace(tzinfo=None),
+]
+# Ось y - общий диапазон выбранной группы
+value_domain = domain_expr(group_domains(chart_data.lazy()).collect(), group_param)
+
+# Сбросы и скачки уровня по полным данным (до прореживания)
+with stage("change_points") as s:
+    s.rows_in(chart_data)
+    events = detect_events(chart_data.lazy(), by=["item_id", "group_num"]).collect()
+    s.rows_out(events)
+
+# Линейный тренд каждого ряда по последним дням (после последнего сброса) и
+# прогноз на HORIZON_DAYS дней - одним запросом для всех рядов
+with stage("forecast") as s:
+    s.rows_in(chart_data)
+    trends = fit_trends(chart_data.lazy(), events=events, by=["item_id", "group_num"], value_col="value").collect()
+    forecast_data = forecast_frame(trends, by=["item_id", "group_num"]).collect()
+    s.rows_out(trends)
+
+if CAPACITY is not None:
+    capacity_report = (
+        days_to_threshold(trends, CAPACITY)
+        .filter(pl.col("days_to_threshold").is_not_null())
+        .sort("days_to_threshold")
+        .collect()
+    )
+    print("Ряды, которые раньше всех дойдут до порога:")
+    print(capacity_report.select(["item_id", "level", "slope", "days_to_threshold", "threshold_date"]).head(20))
 
-base_chart = alt.Chart(chart_data.to_pandas()).add_params(
+# Прореживаем каждый ряд под ширину графика (домены считаются по полным данным)
+with stage("downsample") as s:
+    s.rows_in(chart_data)
+    plot_data = downsample(chart_data, CHART_WIDTH, mode=DOWNSAMPLE, by="item_id")
+    s.rows_out(plot_data)
+
+with stage("to_pandas") as s:
+    plot_pdf = plot_data.to_pandas()
+    s.rows_out(plot_pdf)
+
+# Данные задаются у слоя целиком: у слоя событий они свои
+base_chart = alt.Chart().add_params(
     group_param, legend_selection
 ).transform_filter(
     alt.datum.group_num == group_param
@@ -122,13 +169,53 @@ lines = base_chart.mark_line(point=True, strokeWidth=2).encode(
     tooltip=['item_id:N', 'date:T', 'value:Q']
 )
 
-final_chart = lines.properties(
-    width=1800, height=900,
+event_rules = event_layer(
+    events, color=alt.Color('item_id:N', legend=None), tooltip_id='item_id:N'
+).transform_filter(
+    alt.datum.group_num == group_param
+)
+
+forecast_lines = forecast_layer(
+    forecast_data, color=alt.Color('item_id:N', legend=None)
+).transform_filter(
+    alt.datum.group_num == group_param
+)
+
+final_chart = alt.layer(lines, event_rules, forecast_lines, data=plot_pdf).properties(
+    width=CHART_WIDTH, height=900,
     title="Временные ряды (клик по легенде чтобы скрыть/показать)"
 ).resolve_scale(
-    x='shared', y='independent'
+    x='shared', y='shared'
 )
+# Данные в спецификации - компактно (chart_payload.py): даты числами, ряды кодами;
+# экспорт по группам ниже работает с исходным final_chart
+COMPACT_DATA = True
+# Или данные с сервиса data_service.py (python data_service.py): браузер берет
+# дневные медианы рядов по URL, в спецификации остается только таблица групп
+SERVICE_URL = None  # например "http://127.0.0.1:8765"
+if SERVICE_URL:
+    data_url = range_url(SERVICE_URL, ["collected"], chart_data["item_id"].unique().sort().to_list(), resolution="1d")
+    display_chart = service_chart(final_chart, plot_data, data_url, by="item_id", series_cols=["group_num"],
+                                  rename={"item_id": "id"})
+elif COMPACT_DATA:
+    display_chart = compact_chart(final_chart, plot_data, by="item_id", series_cols=["group_num"])
+else:
+    display_chart = final_chart
+profile_chart_spec(display_chart)
+
+display_chart
 
-final_chart
-
+# %%
+# Экспорт с подгрузкой данных по группам: charts/tz/index.html + groups/*.json
+EXPORT_SHARDS = False
+if EXPORT_SHARDS:
+    export_group_shards(final_chart, plot_data, "group_num", group_param, "charts/tz",
+                        title="Временные ряды по группам")
 
+# %%
+# Один HTML со всеми группами и компактными данными: "csv" (данные внутри
+# файла) или "arrow" (charts/tz/compact.arrow рядом, открывать через HTTP)
+EXPORT_COMPACT = None
+if EXPORT_COMPACT:
+    export_compact_html(final_chart, plot_data, "charts/tz/compact.html", by="item_id",
+                        series_cols=["group_num"], fmt=EXPORT_COMPACT, title="Временные ряды")
@@ -0,0 +1,87 @@
+# %%
+# Разбор числовых значений из выгрузок мониторинга: десятичные запятые,
+# суффиксы единиц измерения (TB/GB/MB) и пустые строки.
+#
+# Основной путь - выражения Polars (parse_decimal_comma_expr,
+# extract_numeric_value_expr), которые работают над всей колонкой сразу.
+# Скалярные функции оставлены как эталон поведения и для бенчмарка.
+import re
+
+import polars as pl
+
+# Первое число в строке: "54.5 GB" -> 54.5, "2,21 TB" -> 2,21
+NUMBER_PATTERN = r'(\d+(?:[.,]\d+)?)'
+
+# Единицы измерения и множители для перевода в GB
+UNIT_PATTERN = r'(TB|GB|MB)'
+UNIT_MULTIPLIERS = {'TB': 1000.0, 'GB': 1.0, 'MB': 0.001}
+
+# %%
+# Скалярные версии (вызываются на каждую строку)
+
+def parse_decimal_comma(value_str):
+    """Конвертирует запятые в точки для десятичных чисел"""
+    if isinstance(value_str, str):
+        return float(value_str.replace(',', '.'))
+    return float(value_str) if value_str is not None else None
+
+def extract_numeric_value(value_str):
+    """Извлекает числовое значение из строк с единицами измерения"""
+    if value_str is None or value_str == '':
+        return None
+
+    value_str = str(value_str).strip()
+
+    # Обрабатываем единицы измерения
+    if 'TB' in value_str:
+        numeric = re.search(NUMBER_PATTERN, value_str)
+        if numeric:
+            return parse_decimal_comma(numeric.group(1)) * 1000  # TB -> GB
+    elif 'GB' in value_str:
+        numeric = re.search(NUMBER_PATTERN, value_str)
+        if numeric:
+            return parse_decimal_comma(numeric.group(1))
+    elif 'MB' in value_str:
+        numeric = re.search(NUMBER_PATTERN, value_str)
+        if numeric:
+            return parse_decimal_comma(numeric.group(1)) / 1000  # MB -> GB
+    else:
+        # Обычное число с запятой как разделителем
+        return parse_decimal_comma(value_str)
+
+# %%
+# Векторизованные версии (выражения Polars)
+
+def parse_decimal_comma_expr(column):
+    """Выражение: строка с десятичной запятой -> Float64.
+
+    Принимает имя колонки или выражение любого типа. Пустые и
+    нечисловые строки превращаются в null вместо исключения.
+    """
+    expr = pl.col(column) if isinstance(column, str) else column
+    return (
+        expr.cast(pl.String)
+        .str.strip_chars()
+        .str.replace_all(',', '.', literal=True)
+        .cast(pl.Float64, strict=False)
+    )
+
+def extract_numeric_value_expr(column):
+    """Выражение: значение с суффиксом TB/GB/MB -> Float64 в GB.
+
+    Повторяет логику extract_numeric_value: при наличии единицы берется
+    первое число в строке и переводится в GB, без единицы - строка целиком
+    разбирается как число с десятичной запятой.
+    """
+    expr = pl.col(column) if isinstance(column, str) else column
+    text = expr.cast(pl.String)
+    number = parse_decimal_comma_expr(text.str.extract(NUMBER_PATTERN, 1))
+    multiplier = text.str.extract(UNIT_PATTERN, 1).replace_strict(
+        UNIT_MULTIPLIERS, default=None, return_dtype=pl.Float64
+    )
+
+    return (
+        pl.when(multiplier.is_null())
+        .then(parse_decimal_comma_expr(text))
+        .otherwise(number * multiplier)
+    )
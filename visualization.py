@@ -1,66 +1,93 @@
 # %% 
 # 1. Импорт библиотек
-import polars as pl
 import glob
+import os
+import re
+
+import altair as alt
+import polars as pl
+
+from chart_payload import compact_chart
+from downsample import downsample
+from instrumentation import profile_chart_spec, stage
+from loaders import load_collected, load_series_files
 
 # %%
 # 2. Загрузка данных
 data_files = glob.glob("data/*.csv")
 print(*data_files, sep="\n")
 # %% 3. Обработка данных
-df = pl.concat([
-    pl.read_csv(file).select([
+with stage("load_series") as s:
+    series_lf = load_series_files(data_files).select([
         pl.col('id').cast(pl.Int64),
-        pl.col('date').cast(pl.String),
-        pl.col('value').cast(pl.Float64)
+        pl.col('date'),
+        pl.col('value')
     ])
-    for file in data_files
-])
+    s.plan(series_lf)
+    df = series_lf.collect()
+    s.rows_out(df)
 unique_ids = df.select("id").unique().sort("id")["id"].to_list()
 print(*unique_ids, sep="\n")
 
-# Получаем min/max дат и значений из collected.csv
-date_min, date_max, value_min, value_max = pl.read_csv("data/raw/collected.csv").select(
-    pl.col('collected').min().alias('min_date'), 
-    pl.col('collected').max().alias('max_date'),
-    pl.col('property_value').min().alias('min_value'),
-    pl.col('property_value').max().alias('max_value')
-).row(0)
-
-
-# Загружаем collected.csv для второго слоя
-collected_df = pl.read_csv("data/raw/collected.csv").select([
-    pl.col('item_id').alias('id'),
-    pl.col('collected').alias('date'), 
-    pl.col('property_value').cast(pl.Float64).alias('value')  # приведение к Float64
-]).with_columns([
-    pl.col('id').map_elements(lambda x: unique_ids.index(x) if x in unique_ids else -1, return_dtype=pl.Int64).alias('id_index')
-]).filter(pl.col('id_index') >= 0)
+# Словарь id -> id_index (позиция в отсортированном списке), строится один раз
+id_table = pl.DataFrame({'id': unique_ids}, schema={'id': pl.Int64}).with_columns(
+    pl.int_range(pl.len(), dtype=pl.Int64).alias('id_index')
+)
+
+# Collected данные: min/max и второй слой из одного скана хранилища
+with stage("load_collected") as s:
+    collected_lf = load_collected().select([
+        pl.col('id').cast(pl.Int64),
+        pl.col('date'), 
+        pl.col('value')
+    ])
+    collected_queries = [
+        collected_lf.select(
+            pl.col('date').min().alias('min_date'), 
+            pl.col('date').max().alias('max_date'),
+            pl.col('value').min().alias('min_value'),
+            pl.col('value').max().alias('max_value')
+        ),
+        # inner join оставляет только id из data/*.csv
+        collected_lf.join(id_table.lazy(), on='id', how='inner'),
+    ]
+    for query in collected_queries:
+        s.plan(query)
+    collected_range, collected_df = pl.collect_all(collected_queries)
+    s.rows_out(collected_df)
+date_min, date_max, value_min, value_max = collected_range.row(0)
 # %%
 # 4. Интерактивная визуализация
-import altair as alt
 alt.data_transformers.disable_max_rows()
 
+CHART_WIDTH = 1200
+DOWNSAMPLE = "minmax"  # "minmax", "lttb" или "raw" (без прореживания, для детального зума)
+
 # Создаем маппинг ID -> имя файла
-import os
 id_to_filename = {}
 for file_path in data_files:
     filename = os.path.basename(file_path)  # получаем только имя файла
     # Извлекаем ID из имени файла (series_159782957_filled.csv -> 159782957)
-    import re
     id_match = re.search(r'series_(\d+)', filename)
     if id_match:
         id_from_filename = int(id_match.group(1))
     id_to_filename[id_from_filename] = filename
 
-# Объединяем данные с метками типов
-combined_data = pl.concat([
-    df.with_columns([
-        pl.col('id').map_elements(lambda x: unique_ids.index(x), return_dtype=pl.Int64).alias('id_index'),
-        pl.col('id').map_elements(lambda x: id_to_filename.get(x, f'series_{x}.csv'), return_dtype=pl.String).alias('layer')
-    ]),
-    collected_df.with_columns(pl.lit('Collected данные').alias('layer'))
-])
+# Словарь id -> layer
+layer_table = pl.DataFrame(
+    {'id': list(id_to_filename), 'layer': list(id_to_filename.values())},
+    schema={'id': pl.Int64, 'layer': pl.String}
+)
+
+# Объединяем данные с метками типов (словари присоединяются join'ом)
+with stage("attach_layers") as s:
+    combined_data = pl.concat([
+        df.join(id_table, on='id', how='left')
+        .join(layer_table, on='id', how='left')
+        .with_columns(pl.col('layer').fill_null(pl.format('series_{}.csv', pl.col('id')))),
+        collected_df.with_columns(pl.lit('Collected данные').alias('layer'))
+    ])
+    s.rows_out(combined_data)
 
 # Слайдер для переключения между ID
 slider = alt.selection_point(
@@ -69,10 +96,16 @@ slider = alt.selection_point(
     value=[{'id_index': 0}]
 )
 
-base_chart = alt.Chart(combined_data).add_params(slider)
+# Прореживаем каждый ряд каждого слоя под ширину графика
+with stage("downsample") as s:
+    s.rows_in(combined_data)
+    plot_data = downsample(combined_data, CHART_WIDTH, mode=DOWNSAMPLE, by=['id', 'layer'])
+    s.rows_out(plot_data)
+
+base_chart = alt.Chart(plot_data).add_params(slider)
 
 common_encoding = {
-    'x': alt.X('date:T', scale=alt.Scale(domain=[date_min, date_max])),
+    'x': alt.X('date:T', scale=alt.Scale(domain=[date_min.replace(tzinfo=None), date_max.replace(tzinfo=None)])),
     'y': alt.Y('value:Q', scale=alt.Scale(domain=[value_min, value_max])),
     'color': alt.Color(
         'layer:N', 
@@ -109,10 +142,15 @@ collected_layer = (base_chart
                    .transform_filter(alt.datum.layer == 'Collected данные'))
 
 chart = (series_layer + collected_layer).properties(
-    width=1200, 
+    width=CHART_WIDTH, 
     height=600, 
     title="Временные ряды: Series (линии) + Collected (точки)"
 ).interactive()
+# Данные в спецификации - компактно (chart_payload.py): даты числами, ряды кодами;
+# экспорт по группам ниже работает с исходным chart
+COMPACT_DATA = True
+display_chart = compact_chart(chart, plot_data, by=['id', 'layer'], series_cols=['id_index']) if COMPACT_DATA else chart
+profile_chart_spec(display_chart)
 
-chart
+display_chart
 # %%
\ No newline at end of file
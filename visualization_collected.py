@@ -3,60 +3,57 @@
 import polars as pl
 import altair as alt
 
+from change_points import detect_events, event_layer
+from chart_payload import compact_chart, export_compact_html
+from data_service import range_url, service_chart
+from group_shards import export_group_shards
+from grouping import assign_groups, scale_expr
+from instrumentation import profile_chart_spec, stage
+from loaders import load_collected, load_normalized
+from pyramid import chart_levels, ensure_pyramid, level_filter_expr, multires_frame
+from series_index import scan_series_index, series_summary
+
 alt.data_transformers.disable_max_rows()
 
 # %%
 # 1. Загрузка и анализ данных
-print("Загружаем и анализируем collected.csv...")
+print("Загружаем и анализируем collected данные...")
 
-# Загружаем collected данные
-df = pl.read_csv("data/raw/collected.csv").select([
-    pl.col('item_id').alias('id'),
-    pl.col('collected').alias('date'),  # оставляем как datetime
-    pl.col('property_value').cast(pl.Float64).alias('value')
-])
+# Collected данные через общий загрузчик: ленивый scan Parquet-хранилища
+# (фильтры по id ниже доходят до партиций, весь набор не читается)
+with stage("load_collected") as s:
+    df = load_collected()
 
 # %%
 # 1.1. Загрузка дополнительных серий из normalized данных
-print("Загружаем дополнительные серии из data/normalized/without_unit/...")
-
-import os
-from pathlib import Path
-
-additional_series_data = []
-normalized_dir = Path("data/normalized/")
+print("Загружаем дополнительные серии из хранилища normalized...")
 
-for csv_file in normalized_dir.glob("*.csv"):
-    print(f"Загружаем {csv_file.name}...")
-    series_df = pl.read_csv(str(csv_file)).select([
-        'id', 'date', 'value'  # игнорируем колонку unit
-    ]).with_columns([
+with stage("load_normalized") as s:
+    additional_df = load_normalized().with_columns([
         pl.lit("additional").alias("series_type")  # помечаем как дополнительные серии
-    ])
-    additional_series_data.append(series_df)
+    ]).collect()
+    s.rows_out(additional_df)
 
-# Объединяем все дополнительные серии
-if additional_series_data:
-    additional_df = pl.concat(additional_series_data)
-    print(f"Загружено {len(additional_series_data)} дополнительных серий, всего строк: {additional_df.height}")
+if additional_df.height > 0:
+    print(f"Загружено {additional_df['id'].n_unique()} дополнительных серий, всего строк: {additional_df.height}")
     
     # Получаем список уникальных ID дополнительных серий
     additional_series_ids = additional_df['id'].unique().sort().to_list()
     print(f"Дополнительные серии: {additional_series_ids}")
 else:
-    additional_df = pl.DataFrame(schema={"id": pl.Utf8, "date": pl.Utf8, "value": pl.Float64, "series_type": pl.Utf8})
     additional_series_ids = []
 
-# Подсчитываем количество уникальных дней для каждого ID
-# Создаем колонку только с датой (без времени)
-df = df.with_columns([
-    pl.col('date').str.slice(0, 10).alias('date_only')  # берем только YYYY-MM-DD
-])
-
-days_per_id = df.group_by('id').agg([
-    pl.col('date_only').n_unique().alias('unique_days'),
-    pl.col('date').count().alias('total_points')
-]).sort('unique_days', descending=True)
+# Количество уникальных дней и точек для каждого ID - из индекса рядов
+with stage("series_summary") as s:
+    days_per_id_lf = series_summary(scan_series_index("collected")).select([
+        pl.col('id'),
+        pl.col('unique_days'),
+        pl.col('n_points').alias('total_points'),
+        scale_expr().alias('scale')  # масштаб ряда - для группировки по величине
+    ]).sort(['unique_days', 'id'], descending=[True, False])  # id - для стабильного порядка групп
+    s.plan(days_per_id_lf)
+    days_per_id = days_per_id_lf.collect()
+    s.rows_out(days_per_id)
 
 print(f"Всего уникальных ID: {days_per_id.height}")
 print(f"Максимум дней у одного ID: {days_per_id['unique_days'].max()}")
@@ -73,36 +70,43 @@ print(f"ID с >{MIN_DAYS} днями: {filtered_ids.height}")
 # Получаем отсортированный список ID
 sorted_id_list = filtered_ids['id'].to_list()
 
-# Фильтруем основные данные
-filtered_data = df.filter(pl.col('id').is_in(sorted_id_list))
+# Читаем только отобранные ряды
+with stage("load_selected") as s:
+    filtered_lf = df.filter(pl.col('id').is_in(sorted_id_list)).with_columns([
+        pl.col('date').dt.date().alias('date_only')  # только дата, без времени
+    ])
+    s.plan(filtered_lf)
+    filtered_data = filtered_lf.collect()
 
-# Добавляем информацию о количестве дней
-filtered_data = filtered_data.join(
-    filtered_ids.select(['id', 'unique_days']), 
-    on='id', 
-    how='left'
-)
+    # Добавляем информацию о количестве дней
+    filtered_data = filtered_data.join(
+        filtered_ids.select(['id', 'unique_days']), 
+        on='id', 
+        how='left'
+    )
+    s.rows_out(filtered_data)
 
 print(f"Отфильтрованных строк данных: {filtered_data.height}")
 
 # %%
-# 3. Создание групп по 10 ID
-# Создаем маппинг ID -> номер группы
-id_to_group = {}
-for i, id_val in enumerate(sorted_id_list):
-    group_num = i // 10  # 10 ID на группу (для производительности)
-    id_to_group[id_val] = group_num
-
-# Добавляем номер группы к данным
-final_data = filtered_data.with_columns([
-    pl.col('id').map_elements(lambda x: id_to_group.get(x, 0), return_dtype=pl.Int64).alias('group_number')
-])
-
-total_groups = max(id_to_group.values()) + 1 if id_to_group else 1
+# 3. Создание групп по 10 ID (для производительности)
+GROUP_MODE = "rank"  # "rank" (по заполненным дням), "magnitude" или "cluster" (по масштабу рядов)
+
+# Номера групп по таблице ID (grouping.py) присоединяются к данным join'ом
+with stage("group_assignment") as s:
+    s.rows_in(filtered_data)
+    id_groups = assign_groups(
+        filtered_ids, size=10, mode=GROUP_MODE, by='id', first_group=0
+    ).rename({'group_num': 'group_number'}).collect()
+    final_data = filtered_data.join(id_groups, on='id', how='left', maintain_order='left')
+    s.rows_out(final_data)
+
+total_groups = id_groups['group_number'].max() + 1 if id_groups.height else 1
 print(f"Всего групп: {total_groups}")
 
 # %%
 # 4. Интерактивная визуализация
+CHART_WIDTH = 1200
 
 # Параметр для переключения между группами
 group_param = alt.param(
@@ -131,23 +135,15 @@ unit_multiplier = alt.param(
     )
 )
 
-# Создание чекбоксов для дополнительных серий
-additional_series_params = {}
-if additional_series_ids:
-    print(f"Создаем чекбоксы для {len(additional_series_ids)} дополнительных серий...")
-    for series_id in additional_series_ids:
-        # Создаем параметр-чекбокс для каждой серии
-        param_name = f"{series_id}_checkbox"
-        additional_series_params[series_id] = alt.param(
-            value=False,
-            bind=alt.binding_checkbox(name=f"Показать {series_id}: ")
-        )
+# Выбор дополнительных серий кликом в списке рядом с графиком: один
+# selection_point на все серии (клик - показать/скрыть, shift не нужен)
+picked_series = alt.selection_point(fields=['id'], toggle='true', empty=False, name='picked_series')
 
 # Подготавливаем дополнительные серии для объединения
 if additional_series_ids:
     # Добавляем колонку date_only для дополнительных данных
     additional_df_with_date = additional_df.with_columns([
-        pl.col('date').str.slice(0, 10).alias('date_only')  # берем только YYYY-MM-DD
+        pl.col('date').dt.date().alias('date_only')  # только дата, без времени
     ])
     
     # Конвертируем основные данные в строковые ID для совместимости
@@ -155,10 +151,10 @@ if additional_series_ids:
         pl.col('id').cast(pl.Utf8)
     ])
     
-    # Вычисляем реальные значения unique_days для дополнительных серий
-    additional_days_per_id = additional_df_with_date.group_by('id').agg([
-        pl.col('date_only').n_unique().alias('unique_days')
-    ])
+    # Значения unique_days для дополнительных серий - из индекса рядов
+    additional_days_per_id = series_summary(scan_series_index("normalized")).select([
+        'id', 'unique_days'
+    ]).collect()
     
     print(f"Подсчитанные дни для дополнительных серий:")
     for row in additional_days_per_id.iter_rows(named=True):
@@ -173,6 +169,7 @@ if additional_series_ids:
     
     # Добавляем колонки для совместимости с основными данными
     prepared_additional = additional_df_with_days.with_columns([
+        pl.col('id').cast(pl.Utf8),
         pl.lit(-1).cast(pl.Int64).alias('group_number'),  # специальная группа для дополнительных серий
     ]).drop('series_type').select([
         'id', 'date', 'value', 'date_only', 'unique_days', 'group_number'  # тот же порядок что и в основных данных
@@ -188,16 +185,67 @@ else:
     # Если нет дополнительных серий, также конвертируем основные данные в строковые ID
     combined_data = final_data.with_columns([pl.col('id').cast(pl.Utf8)])
 
-# Базовый чарт с параметрами
-all_params = [group_param, connect_lines, unit_multiplier] + list(additional_series_params.values())
-base_chart = alt.Chart(combined_data).add_params(*all_params)
+# Сбросы, скачки и выбросы - по полным данным, до прореживания
+with stage("change_points") as s:
+    s.rows_in(combined_data)
+    events = detect_events(combined_data.lazy(), by=['id', 'group_number']).collect()
+    s.rows_out(events)
+print(f"Найдено событий: {events.height}")
+
+# Агрегаты из пирамиды (pyramid.py): несколько уровней подробности сразу,
+# при масштабировании график переключается на более подробный уровень.
+# Для приближения глубже встроенных уровней - DOWNSAMPLE в tz.py или сервис
+# данных (SERVICE_URL ниже) с нужными рядами и окном
+with stage("pyramid") as s:
+    s.rows_in(combined_data)
+    ensure_pyramid('collected')
+    ensure_pyramid('normalized')
+    full_span = combined_data['date'].max() - combined_data['date'].min()
+    # Уровни в пределах EMBED_MAX_ROWS строк на все ряды (оценка по индексу):
+    # чем больше рядов, тем меньше глубина приближения
+    shown_summary = pl.concat([
+        series_summary(scan_series_index("collected")).filter(pl.col('id').is_in(sorted_id_list)),
+        series_summary(scan_series_index("normalized")).filter(pl.col('id').is_in(additional_series_ids)),
+    ]).collect()
+    levels = chart_levels(full_span, CHART_WIDTH, summary=shown_summary)
+    series_info = combined_data.select(['id', 'unique_days', 'group_number']).unique('id')
+    plot_data = pl.concat([
+        multires_frame('collected', sorted_id_list, levels),
+        multires_frame('normalized', additional_series_ids, levels),
+    ]).with_columns(pl.col('id').cast(pl.Utf8)).join(series_info, on='id', how='inner')
+    s.rows_out(plot_data)
+print(f"Уровни агрегатов: {levels}")
+
+# Масштабирование колесом/перетаскиванием; видимый отрезок оси x выбирает уровень
+zoom = alt.selection_interval(bind='scales', name='zoom')
+level_filter = level_filter_expr(zoom, levels, CHART_WIDTH, full_span)
+
+# Параметр для показа событий
+show_events = alt.param(
+    value=True,
+    bind=alt.binding_checkbox(name="Показать сбросы и скачки: ")
+)
+
+# Показываем выбранную группу ИЛИ выбранные дополнительные серии. indata
+# ищет id строки в хранилище выбора по хэш-индексу Vega: проверка строки не
+# зависит от числа серий (в кортеже выбора values - [id])
+series_filter = (
+    f"datum.group_number == {group_param.name} || "
+    f"indata('{picked_series.name}_store', 'values', datum.id)"
+)
+
+# Базовый чарт с параметрами (данные задаются у графика целиком, у событий - свои)
+all_params = [group_param, connect_lines, unit_multiplier, show_events]
+base_chart = alt.Chart().add_params(*all_params)
 
 # Основная визуализация точек
 points = base_chart.mark_point(
     size=50,  # увеличенные точки
     opacity=0.8
-).transform_calculate(
-    converted_value=f'datum.group_number == -1 ? datum.value * {unit_multiplier.name} : datum.value'
+).add_params(zoom).transform_filter(level_filter).transform_calculate(
+    converted_value=f'datum.group_number == -1 ? datum.value * {unit_multiplier.name} : datum.value',
+    converted_min=f'datum.group_number == -1 ? datum.min * {unit_multiplier.name} : datum.min',
+    converted_max=f'datum.group_number == -1 ? datum.max * {unit_multiplier.name} : datum.max'
 ).encode(
     x=alt.X('date:T', title='Дата'),
     y=alt.Y('converted_value:Q', title='Значение'),
@@ -214,24 +262,20 @@ points = base_chart.mark_point(
     ),
     tooltip=[
         alt.Tooltip('date:T', format='%d.%m.%Y %H:%M:%S', title='Дата и время'),
-        alt.Tooltip('converted_value:Q', format='.0f', title='Значение'), 
+        alt.Tooltip('converted_value:Q', format='.0f', title='Медиана'),
+        alt.Tooltip('converted_min:Q', format='.0f', title='Минимум'),
+        alt.Tooltip('converted_max:Q', format='.0f', title='Максимум'),
+        alt.Tooltip('count:Q', title='Точек в окне'),
+        alt.Tooltip('level:N', title='Уровень'),
         alt.Tooltip('id:N', title='ID'),
         alt.Tooltip('unique_days:Q', title='Заполненных дней')
     ]
-).transform_filter(
-    # Показываем выбранную группу ИЛИ выбранные дополнительные серии
-    f"datum.group_number == {group_param.name}" +
-    ("" if not additional_series_params else 
-     " || (" + " || ".join([
-         f"(datum.id == '{series_id}' && {param.name})" 
-         for series_id, param in additional_series_params.items()
-     ]) + ")")
-)
+).transform_filter(series_filter)
 
 # Слой линий для соединения точек одного ID
 lines = base_chart.mark_line(
     strokeWidth=1
-).transform_calculate(
+).transform_filter(level_filter).transform_calculate(
     converted_value=f'datum.group_number == -1 ? datum.value * {unit_multiplier.name} : datum.value'
 ).encode(
     x=alt.X('date:T', sort='ascending'),  # сортировка по времени
@@ -239,26 +283,67 @@ lines = base_chart.mark_line(
     color=alt.Color('id:N', scale=alt.Scale(scheme='category20'), legend=None),  # без легенды для линий
     opacity=alt.condition(connect_lines, alt.value(0.6), alt.value(0)),  # видимость через checkbox
     detail='id:N'  # группировка по ID для отдельных линий
-).transform_filter(
-    # Показываем выбранную группу ИЛИ выбранные дополнительные серии
-    f"datum.group_number == {group_param.name}" +
-    ("" if not additional_series_params else 
-     " || (" + " || ".join([
-         f"(datum.id == '{series_id}' && {param.name})" 
-         for series_id, param in additional_series_params.items()
-     ]) + ")")
-)
+).transform_filter(series_filter)
+
+# Вертикальные линии событий того же цвета, что и ряд
+event_rules = event_layer(
+    events,
+    color=alt.Color('id:N', scale=alt.Scale(scheme='category20'), legend=None),
+).transform_filter(series_filter).transform_filter(show_events)
 
-# Объединяем слои точек и линий
-chart = alt.layer(points, lines).properties(
-    width=1200, 
+# Объединяем слои точек, линий и событий
+main_chart = alt.layer(points, lines, event_rules).properties(
+    width=CHART_WIDTH, 
     height=700, 
     title=alt.Title(
         "Collected данные: отсортировано по количеству заполненных дней",
         subtitle=f"Фильтр: >{MIN_DAYS} дней. Группы по 10 ID. Всего {filtered_ids.height} ID в {total_groups} группах"
     )
-).interactive()
+)
+
+# Список дополнительных серий слева от графика: клик по квадрату показывает/скрывает серию
+picker_data = pl.DataFrame({'id': [str(series_id) for series_id in additional_series_ids]}, schema={'id': pl.Utf8})
+picker = alt.Chart(picker_data).mark_square(size=150).encode(
+    y=alt.Y('id:N', title=None, axis=alt.Axis(labelLimit=200)),
+    color=alt.condition(picked_series, alt.value('steelblue'), alt.value('lightgray')),
+    tooltip=[alt.Tooltip('id:N', title='ID')]
+).add_params(picked_series).properties(
+    width=20,
+    height=alt.Step(18),
+    title='Доп. серии'
+)
+
+# Данные - у графика целиком (их подменяют экспорт по группам и compact_chart)
+chart = alt.hconcat(picker, main_chart, data=plot_data)
+# Данные в спецификации - компактно (chart_payload.py): даты числами, ряды кодами;
+# экспорт по группам ниже работает с исходным chart
+COMPACT_DATA = True
+# Или данные с сервиса data_service.py (python data_service.py): браузер берет
+# те же уровни пирамиды по URL, в спецификации остается только таблица рядов
+SERVICE_URL = None  # например "http://127.0.0.1:8765"
+if SERVICE_URL:
+    data_url = range_url(SERVICE_URL, ['collected', 'normalized'], sorted_id_list + additional_series_ids, levels=levels)
+    display_chart = service_chart(chart, plot_data, data_url, by='id', series_cols=['group_number', 'unique_days'])
+elif COMPACT_DATA:
+    display_chart = compact_chart(chart, plot_data, by='id', series_cols=['group_number', 'unique_days'])
+else:
+    display_chart = chart
+profile_chart_spec(display_chart)
 
-# Отображаем график
-chart
-# %%
\ No newline at end of file
+display_chart
+# %%
+# Экспорт с подгрузкой данных по группам: charts/collected/index.html + groups/*.json
+# (дополнительные серии, группа -1, подгружаются всегда)
+EXPORT_SHARDS = False
+if EXPORT_SHARDS:
+    export_group_shards(chart, plot_data, 'group_number', group_param, "charts/collected",
+                        always_loaded=[-1], title="Collected данные по группам")
+# %%
+# Один HTML со всеми группами и компактными данными: "csv" (данные внутри
+# файла) или "arrow" (charts/collected/compact.arrow рядом, открывать через HTTP)
+EXPORT_COMPACT = None
+if EXPORT_COMPACT:
+    export_compact_html(chart, plot_data, "charts/collected/compact.html", by='id',
+                        series_cols=['group_number', 'unique_days'], fmt=EXPORT_COMPACT,
+                        title="Collected данные")
+# %%